@@ -0,0 +1,72 @@
+"""
+对比每次调用新建AsyncClient与共享连接池的吞吐(requests/s)
+    python bench/bench_http_client.py --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from stub_server import StubServer, create_stub_app
+
+
+async def run_load(call, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await call(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def bench(base_url: str, total: int, concurrency: int):
+    from httpx import AsyncClient
+
+    from api_tool import ApiAdapter
+    from http_client import http_client_lifespan
+
+    url = f'{base_url}/utn/ic/Base/V1'
+
+    async def per_call_client(i):
+        # 旧实现：每次调用新建客户端
+        async with AsyncClient() as client:
+            response = await client.get(url, params={'keyword': f'company-{i}'})
+            response.json()
+
+    adapter = ApiAdapter(url, 'bench', 'bench')
+
+    async def shared_client(i):
+        await adapter.invoke({'keyword': f'company-{i}'})
+
+    before = await run_load(per_call_client, total, concurrency)
+    async with http_client_lifespan():
+        after = await run_load(shared_client, total, concurrency)
+
+    print(f'per-call AsyncClient: {before:10.1f} req/s')
+    print(f'shared pooled client: {after:10.1f} req/s  ({after / before:.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    # 服务模块在导入时读取环境变量；关闭上游限流，只比较连接的开销
+    os.environ['shuidi_rate_limit_enabled'] = 'false'
+    with StubServer(create_stub_app(args.latency), port=args.port) as server:
+        asyncio.run(bench(server.base_url, args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+对比大响应(实控人、风险信息)在不同JSON处理方式下的耗时(ms/次)：
+标准库解析、当前JSON后端解析、透传原始文本，均包含FastMCP将工具结果序列化为文本的开销
+    python bench/bench_json.py --paths 500 --rounds 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import pydantic_core
+
+from json_codec import JSON_BACKEND, loads, raw_response
+
+
+def make_payload(paths: int) -> bytes:
+    node = {'StartNode': 'a1b2c3', 'StartName': '某某投资有限公司', 'StartNodeType': '0', 'EndNode': 'd4e5f6',
+            'EndName': '某某科技有限公司', 'EndNodeType': '0', 'Type': 'INVEST', 'Sequence': 0, 'Proportion': '51.00%'}
+    controller = {'AcName': '张三', 'IsPersonal': '1', 'VotePercent': '51%', 'beneficiaProportion': '51%',
+                  'Paths': [[dict(node, Sequence=i) for i in range(4)] for _ in range(paths)]}
+    response = {'statusCode': 1, 'statusMessage': '成功', 'data': {'ControllerData': [controller] * 3}}
+    return json.dumps(response, ensure_ascii=False).encode('utf-8')
+
+
+def to_tool_result(result) -> str:
+    # 与FastMCP处理工具返回值的方式相同：字符串原样返回，其它对象序列化为JSON
+    if isinstance(result, str):
+        return result
+    return pydantic_core.to_json(result, fallback=str, indent=2).decode()
+
+
+def timeit(fn, rounds: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paths', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    payload = make_payload(args.paths)
+    cases = {
+        'stdlib json': lambda: to_tool_result(json.loads(payload)),
+        f'{JSON_BACKEND} backend': lambda: to_tool_result(loads(payload)),
+        'passthrough': lambda: to_tool_result(raw_response(payload.decode('utf-8'))),
+    }
+    print(f'payload: {len(payload) / 1024:.1f} KB')
+    baseline = None
+    for name, fn in cases.items():
+        elapsed = timeit(fn, args.rounds)
+        baseline = baseline or elapsed
+        print(f'{name:>16}: {elapsed:8.2f} ms  ({baseline / elapsed:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
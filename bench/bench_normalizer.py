@@ -0,0 +1,83 @@
+"""
+对比逐条构造 Area/CompanyStatus/DateRange 与 normalize_batch 规范查询条件的耗时(ms/批)
+每轮开始前清空解析缓存，输入由 --distinct 条不同的条件重复组成
+    python bench/bench_normalizer.py --rows 10000 --distinct 200 --rounds 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from gazetteer import resolve_area
+from normalizer import (Area, COMPANY_STATUSES, CompanyStatus, DateRange, normalize_batch, normalize_company_status,
+                        parse_date_range)
+
+AREAS = [('江苏', '苏州', None), ('江苏', '昆山', None), ('浙江省', '杭州', '西湖'), ('上海', '浦东', None),
+         ('北京', '朝阳', None), ('湖北', '恩施', None), ('广东', '深圳', '南山区'), ('新疆', '阿克苏', None),
+         ('四川', None, None), (None, None, None)]
+
+
+def make_rows(rows: int, distinct: int) -> list[dict]:
+    random.seed(0)
+    pool = []
+    for i in range(distinct):
+        province, city, district = random.choice(AREAS)
+        year = 2000 + i % 24
+        pool.append({'province': province, 'city': city, 'district': district,
+                     'company_status': random.choice((None, *COMPANY_STATUSES)),
+                     'establish_date': random.choice((None, f'{year}-01-01@{year}-12-31', f'{year}-06-01@'))})
+    return [random.choice(pool) for _ in range(rows)]
+
+
+def per_instance(rows: list[dict]) -> list[dict]:
+    results = []
+    for row in rows:
+        area = Area(province=row['province'], city=row['city'], district=row['district'])
+        status = row['company_status']
+        results.append({'province': area.province, 'city': area.city, 'district': area.district,
+                        'company_status': CompanyStatus(status=status).status if status else None,
+                        'establishDate': DateRange(date_range=row['establish_date']).date_range})
+    return results
+
+
+def clear_caches():
+    resolve_area.cache_clear()
+    normalize_company_status.cache_clear()
+    parse_date_range.cache_clear()
+
+
+def timeit(fn, rows: list[dict], rounds: int) -> float:
+    elapsed = 0.0
+    for _ in range(rounds):
+        clear_caches()
+        start = time.perf_counter()
+        fn(rows)
+        elapsed += time.perf_counter() - start
+    return elapsed / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--distinct', type=int, default=200, help='不同条件的条数')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.distinct)
+    expected = per_instance(rows)
+    assert [{k: v for k, v in r.items() if k != 'errors'} for r in normalize_batch(rows)] == expected
+
+    print(f'rows: {args.rows}, distinct: {args.distinct}')
+    baseline = None
+    for name, fn in (('per-instance', per_instance), ('normalize_batch', normalize_batch)):
+        elapsed = timeit(fn, rows, args.rounds)
+        baseline = baseline or elapsed
+        print(f'{name:>16}: {elapsed:8.2f} ms  ({elapsed * 1000 / args.rows:.2f} us/row, {baseline / elapsed:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+对比风险信息大响应整体解析后裁剪与边读取边解析裁剪(需要安装ijson)的耗时(ms/次)及解析过程中的峰值内存
+响应正文按--chunk字节分块读取，模拟http响应的分块到达，峰值内存不含响应正文本身
+计时前先校验各接口裁剪规则下两种方式的结果相同，包括列表中嵌套列表的响应
+    python bench/bench_risk_stream.py --events 200 --companies 500 --rounds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from json_codec import JSON_BACKEND, STREAM_PARSE, loads
+from projection import PROJECTIONS, Projection, project, project_stream
+
+URL = 'https://api.shuidi.cn/utn/risk/CompanyRiskInfo'
+SEARCH_URL = 'https://api.shuidi.cn/utn/action/search/SeniorSearch'
+# 只用于校验的裁剪规则：有条数上限、没有下级规则的列表
+NESTED_URL = 'https://api.shuidi.cn/bench/nested'
+RISK_TYPES = ('self_risk', 'self_contract_risk', 'relation_risk', 'self_notice', 'relation_notice',
+              'self_history_risk', 'relation_history_risk')
+
+
+def make_payload(events: int, companies: int) -> bytes:
+    def risk_type(name):
+        list_data = [{'event_count': 3, 'company_cnt': companies, 'data_type': f't{i % 27 + 1}', 'desc': '风险描述',
+                      'company_events': [{'cid': j, 'company_name': f'关联企业{j}', 'company_event_count': 1,
+                                          'tip': j % 3 + 1, 'detail': '事件详情' * 10} for j in range(companies)]}
+                     for i in range(events)]
+        return {'total': events, 'name': name, 'list_data': list_data}
+
+    response = {'statusCode': 1, 'statusMessage': '成功', 'data': {name: risk_type(name) for name in RISK_TYPES}}
+    return json.dumps(response, ensure_ascii=False).encode('utf-8')
+
+
+def parity_cases() -> list:
+    """
+    :return [(接口地址, 响应)]，覆盖PROJECTIONS中各接口的响应结构，以及规则路径上的列表中嵌套列表、标量的情况
+    """
+    company = {'companyName': '测试企业', 'creditNo': '91110000000000000X', 'regCapital': '100万', 'extra': {'a': [1]}}
+    event = {'cid': 1, 'company_name': '关联企业', 'company_event_count': 1, 'tip': 2, 'detail': '事件详情'}
+    risk_event = {'event_count': 3, 'desc': '风险描述', 'company_events': [event] * 30}
+    cases = [
+        (SEARCH_URL, {'status': 1, 'statusCode': 1, 'data': {'total': 2, 'data_list': [company, company]}}),
+        (SEARCH_URL, {'statusCode': 2, 'statusMessage': '未找到', 'data': None}),
+        (URL, json.loads(make_payload(60, 25))),
+        (URL, {'statusCode': 1, 'data': {
+            'self_risk': {'list_data': [[1, 2, 3] * 30, [4], [5]] * 30},
+            'relation_risk': {'list_data': [[risk_event] * 60, risk_event, 7] * 30},
+            'self_notice': {'list_data': [dict(risk_event, company_events=[[event] * 30, [event]] * 15)]},
+            'self_history_risk': {'list_data': [], 'total': 0},
+            'relation_notice': None,
+        }}),
+        (URL, [[1, 2, 3], [4], [5]]),
+        (NESTED_URL, {'data': [[1, 2, 3], [4], [5]]}),
+        (NESTED_URL, {'data': [{'a': [1, 2, 3]}, [[1, 2, 3]], 3], 'total': 3}),
+    ]
+    assert all(PROJECTIONS.get(url.split('api.shuidi.cn', 1)[1]) for url, _ in cases)
+    return cases
+
+
+def check_parity(chunk: int):
+    PROJECTIONS['/bench/nested'] = Projection(limits={'data': 2}, stream=True)
+    assert project(NESTED_URL, {'data': [[1, 2, 3], [4], [5]]}) == {'data': [[1, 2, 3], [4]], 'data_total': 3}
+    for url, response in parity_cases():
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        expected = project(url, loads(payload))
+        for size in (chunk, 7):
+            streamed_result = asyncio.run(project_stream(url, chunks(payload, size)))[0]
+            assert streamed_result == expected, f'{url} 流式裁剪结果与整体解析不同'
+
+
+async def chunks(payload: bytes, size: int):
+    for i in range(0, len(payload), size):
+        yield payload[i:i + size]
+
+
+def buffered(payload: bytes, chunk: int):
+    async def run():
+        body = b''.join([part async for part in chunks(payload, chunk)])
+        return project(URL, loads(body))
+    return asyncio.run(run())
+
+
+def streamed(payload: bytes, chunk: int):
+    return asyncio.run(project_stream(URL, chunks(payload, chunk)))[0]
+
+
+def measure(fn, payload: bytes, chunk: int, rounds: int) -> tuple[float, float]:
+    fn(payload, chunk)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(payload, chunk)
+    elapsed = (time.perf_counter() - start) / rounds * 1000
+    tracemalloc.start()
+    fn(payload, chunk)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=200, help='每种风险类型的风险事件数')
+    parser.add_argument('--companies', type=int, default=500, help='每个风险事件涉及的企业数')
+    parser.add_argument('--chunk', type=int, default=65536)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    payload = make_payload(args.events, args.companies)
+    print(f'payload: {len(payload) / 1024 / 1024:.1f} MB, json backend: {JSON_BACKEND}')
+    cases = {'buffered': buffered}
+    if STREAM_PARSE:
+        check_parity(args.chunk)
+        assert streamed(payload, args.chunk) == buffered(payload, args.chunk)
+        cases['streamed'] = streamed
+    else:
+        print('未安装ijson或shuidi_stream_parse=false，跳过streamed')
+    for name, fn in cases.items():
+        elapsed, peak = measure(fn, payload, args.chunk, args.rounds)
+        print(f'{name:>10}: {elapsed:8.2f} ms  peak {peak:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
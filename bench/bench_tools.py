@@ -0,0 +1,325 @@
+"""
+基于本地桩服务压测所有工具：通过FastMCP的真实调度(默认经内存中的MCP客户端会话)并发调用，
+按场景输出吞吐、p50/p95/p99延迟、上游请求数及内存占用，结果为JSON，可与基线对比发现性能回退
+    python bench/bench_tools.py --requests 500 --concurrency 20 --latency 0.02 --distribution lognormal --output result.json
+    python bench/bench_tools.py --scenarios get_company_info,search_company_risk --baseline result.json --tolerance 0.2
+默认每次调用使用不同的企业名称(全部未命中缓存)，--keywords N 时企业名称在N个之间循环
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from stub_server import add_stub_arguments
+
+SINGLE_COMPANY_TOOLS = ('get_company_info', 'get_company_partner', 'get_stie_score', 'search_company_risk',
+                        'get_company_honor', 'get_company_contact', 'get_company_investment', 'get_company_cert',
+                        'get_company_controller', 'get_company_benificalowner')
+CITIES = ('上海', '杭州', '苏州', '南京', '宁波', '无锡', '合肥', '成都')
+
+
+def establish_date(n: int) -> str:
+    return f'{2000 + n // 336 % 25}-{n // 28 % 12 + 1:02d}-{n % 28 + 1:02d}@'
+
+
+def overlapping_period(n: int) -> str:
+    # 依次为整年、上半年、第一季度、单月，模拟逐步细化的统计问题
+    year = 2000 + n // 4 % 25
+    end = ('12-31', '06-30', '03-31', '01-31')[n % 4]
+    return f'{year}-01-01@{year}-{end}'
+
+
+# 场景名 -> (工具名, 第n个企业名称对应的参数)
+SCENARIOS = {
+    **{tool: (tool, lambda n, name: {'company_name': name}) for tool in SINGLE_COMPANY_TOOLS},
+    'get_person_related_company': ('get_person_related_company',
+                                   lambda n, name: {'company_name': name, 'person_name': '张三'}),
+    'search_established_companies': ('search_established_companies',
+                                     lambda n, name: {'province': '浙江', 'establish_date': establish_date(n)}),
+    'search_established_selfemployed': ('search_established_selfemployed',
+                                        lambda n, name: {'province': '江苏', 'establish_date': establish_date(n)}),
+    'search_companies': ('search_companies',
+                         lambda n, name: {'city': CITIES[n % len(CITIES)], 'company_status': '正常',
+                                          'extra_fields': [f'field{n}']}),
+    'search_selfemployed': ('search_selfemployed',
+                            lambda n, name: {'city': CITIES[n % len(CITIES)], 'company_status': '存续',
+                                             'extra_fields': [f'field{n}']}),
+    'count_established_companies': ('count_established_companies',
+                                    lambda n, name: {'province': '浙江', 'establish_date': overlapping_period(n)}),
+    'group_count_companies': ('group_count_companies',
+                              lambda n, name: {'group_by': 'province',
+                                               'establish_date': f'{2000 + n % 25}-01-01@{2000 + n % 25}-12-31'}),
+    'query_ownership_graph': ('query_ownership_graph', lambda n, name: {'company_name': name, 'hops': 3}),
+    'find_common_shareholders': ('find_common_shareholders',
+                                 lambda n, name: {'company_a': name, 'company_b': f'{name}分公司', 'hops': 2}),
+    'export_search_results': ('export_search_results',
+                              lambda n, name: {'province': '上海', 'establish_date': establish_date(n), 'max_rows': 200}),
+    'get_company_profile': ('get_company_profile', lambda n, name: {'company_name': name}),
+    'batch_query_companies': ('batch_query_companies',
+                              lambda n, name: {'company_names': [f'{name}-{i}' for i in range(10)], 'section': 'info'}),
+    'fetch_result_slice': ('fetch_result_slice',
+                           lambda n, name: {'handle': 'bench', 'path': 'data.items', 'offset': n % 900, 'limit': 50}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub(args, port: int) -> subprocess.Popen:
+    """
+    桩服务运行在独立进程中，不与被测服务争用GIL
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bench', 'stub_server.py'), '--port', str(port),
+                                '--latency', str(args.latency), '--distribution', args.distribution,
+                                '--items', str(args.items), '--not-found-rate', str(args.not_found_rate)])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('桩服务启动失败')
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def latency_summary(samples: list) -> dict:
+    return {
+        'mean': round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+        'p50': round(percentile(samples, 0.50) * 1000, 3),
+        'p95': round(percentile(samples, 0.95) * 1000, 3),
+        'p99': round(percentile(samples, 0.99) * 1000, 3),
+        'max': round(max(samples, default=0.0) * 1000, 3),
+    }
+
+
+def rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def peak_rss_mb() -> float:
+    # Linux下ru_maxrss的单位为KB，macOS下为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if platform.system() == 'Darwin' else peak / 1024
+
+
+def reset_state():
+    # 每个场景从空缓存开始，互不影响
+    from cache import response_cache
+    from establish_counter import establish_counter
+    from normalizer import company_name_cache
+    from ownership_graph import ownership_graph
+
+    response_cache.clear()
+    company_name_cache.clear()
+    establish_counter.clear()
+    ownership_graph.clear()
+    gc.collect()
+
+
+async def run_scenario(name: str, call, stub_url: str, args) -> dict:
+    import httpx
+
+    import resilience as resilience_module
+
+    tool, make_arguments = SCENARIOS[name]
+    cardinality = args.keywords or args.requests
+    reset_state()
+    httpx.post(f'{stub_url}/_stats/reset')
+
+    # 记录本场景的上游网络耗时，用于区分上游延迟与服务自身开销
+    upstream = []
+    record_latency = resilience_module.resilience.record_latency
+    resilience_module.resilience.record_latency = lambda url, latency: (upstream.append(latency),
+                                                                       record_latency(url, latency))
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_mb()
+
+    latencies = []
+    counts = {'ok': 0, 'failed': 0, 'exceptions': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(n):
+        async with semaphore:
+            arguments = make_arguments(n, f'压测企业{n % cardinality}')
+            start = time.perf_counter()
+            try:
+                text = await call(tool, arguments)
+            except Exception:
+                counts['exceptions'] += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            counts['ok' if json.loads(text).get('statusCode') == 1 else 'failed'] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.requests)))
+    duration = time.perf_counter() - start
+
+    del resilience_module.resilience.record_latency
+    result = {
+        'name': name,
+        'tool': tool,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        **counts,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(args.requests / duration, 2),
+        'latency_ms': latency_summary(latencies),
+        'upstream_requests': httpx.get(f'{stub_url}/_stats').json()['requests'],
+        'upstream_latency_ms': latency_summary(upstream),
+        'rss_mb': round(rss_mb(), 2),
+        'rss_delta_mb': round(rss_mb() - rss_before, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 2),
+    }
+    if args.tracemalloc:
+        result['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+    return result
+
+
+async def run(args, stub_url: str) -> list:
+    from http_client import http_client_lifespan
+    from mcp.shared.memory import create_connected_server_and_client_session
+    from mcp_server import mcp
+    from result_store import result_store
+
+    # 压测期间不输出每个请求的日志
+    for name in ('httpx', 'mcp'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    result_store._results.set('bench', {'data': {'items': list(range(1000))}}, 3600, size=1)
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    results = []
+
+    if args.dispatch == 'session':
+        # 经MCP协议(JSON-RPC序列化、参数校验)调用，与真实客户端一致
+        async with create_connected_server_and_client_session(mcp._mcp_server) as session:
+            async def call(tool, arguments):
+                result = await session.call_tool(tool, arguments)
+                return result.content[0].text
+
+            for name in names:
+                results.append(await run_scenario(name, call, stub_url, args))
+                print_result(results[-1])
+    else:
+        # 只经过FastMCP的工具调度及结果序列化
+        async with http_client_lifespan():
+            async def call(tool, arguments):
+                return (await mcp.call_tool(tool, arguments))[0].text
+
+            for name in names:
+                results.append(await run_scenario(name, call, stub_url, args))
+                print_result(results[-1])
+    return results
+
+
+def print_result(result: dict):
+    latency = result['latency_ms']
+    print(f"{result['name']:>34}: {result['throughput_rps']:9.1f} req/s  p50 {latency['p50']:8.2f}ms  "
+          f"p95 {latency['p95']:8.2f}ms  p99 {latency['p99']:8.2f}ms  upstream {result['upstream_requests']:6d}  "
+          f"rss {result['rss_mb']:7.1f}MB  failed {result['failed'] + result['exceptions']}", file=sys.stderr)
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """
+    与基线对比，吞吐下降或p95延迟上升超过tolerance的场景视为回退
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {result['name']: result for result in json.load(f)['scenarios']}
+    regressions = []
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append({'name': result['name'], 'metric': 'throughput_rps',
+                                'baseline': base['throughput_rps'], 'current': result['throughput_rps']})
+        if result['latency_ms']['p95'] > base['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append({'name': result['name'], 'metric': 'latency_ms.p95',
+                                'baseline': base['latency_ms']['p95'], 'current': result['latency_ms']['p95']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的调用次数')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--keywords', type=int, default=0, help='企业名称的个数，0表示每次调用都不同')
+    parser.add_argument('--scenarios', help=f"逗号分隔的场景，默认全部: {','.join(SCENARIOS)}")
+    parser.add_argument('--dispatch', choices=('session', 'call_tool'), default='session',
+                        help='session: 经内存中的MCP客户端会话调用；call_tool: 直接调用FastMCP.call_tool')
+    parser.add_argument('--rate-limit', action='store_true', help='启用上游限流，默认关闭以测量服务自身开销')
+    parser.add_argument('--tracemalloc', action='store_true', help='统计Python内存分配峰值(有额外开销)')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    parser.add_argument('--baseline', help='基线结果JSON文件，存在性能回退时退出码为1')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS) if args.scenarios else set()
+    if unknown:
+        parser.error(f"未知的场景: {','.join(sorted(unknown))}")
+
+    port = free_port()
+    stub_url = f'http://127.0.0.1:{port}'
+    # 服务模块在导入时读取环境变量
+    os.environ.update(shuidi_api_base=stub_url, shuidi_pname='bench', shuidi_pkey='bench',
+                      shuidi_disk_cache_enabled='false', shuidi_export_dir=tempfile.mkdtemp(prefix='shuidi-bench-'),
+                      shuidi_rate_limit_enabled='true' if args.rate_limit else 'false')
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level='ERROR')
+
+    stub = start_stub(args, port)
+    try:
+        results = asyncio.run(run(args, stub_url))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    report = {
+        'config': {key: getattr(args, key) for key in ('requests', 'concurrency', 'keywords', 'dispatch', 'rate_limit',
+                                                       'latency', 'distribution', 'items', 'not_found_rate')},
+        'python': platform.python_version(),
+        'scenarios': results,
+    }
+    if args.baseline:
+        report['regressions'] = compare(results, args.baseline, args.tolerance)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    if report.get('regressions'):
+        print(f"性能回退: {json.dumps(report['regressions'], ensure_ascii=False)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+本地水滴接口桩服务，用于压测，不访问真实的 api.shuidi.cn
+按接口返回与真实接口结构相同的数据，可配置延迟分布、列表条数及statusCode == 2(未找到企业)的比例
+    python bench/stub_server.py --port 18080 --latency 0.05 --distribution lognormal --items 50 --not-found-rate 0.1
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+import zlib
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+# 查询单个企业的接口，按not_found_rate返回statusCode == 2
+COMPANY_ENDPOINTS = ('/utn/ic/Base/V1', '/utn/ic/Partners/V2', '/utn/stie/score', '/utn/risk/CompanyRiskInfo',
+                     '/utn/cf/Honor', '/utn/ic/GetContacts', '/utn/ic/Invest/V3', '/utn/ip/CertificateList/V2',
+                     '/utn/cp/AllCompanys', '/utn/pic/ActualController', '/utn/pic/BeneficialOwner')
+
+
+def sample_latency(latency: float, distribution: str = 'fixed') -> float:
+    """
+    :param latency: 平均延迟(秒)
+    """
+    if latency <= 0:
+        return 0.0
+    if distribution == 'uniform':
+        return random.uniform(0, 2 * latency)
+    if distribution == 'exponential':
+        return random.expovariate(1 / latency)
+    if distribution == 'lognormal':
+        # sigma=1的对数正态分布，均值为latency，长尾明显
+        return random.lognormvariate(0, 1) * latency / 1.6487
+    return latency
+
+
+def company(i: int, keyword: str) -> dict:
+    return {'companyName': f'{keyword}{i}有限公司', 'creditNo': f'91310000{i:010d}', 'establishDate': '2020-01-01',
+            'legalPerson': '张三', 'capital': '1000万人民币', 'companyStatusStr': '存续',
+            'regCapital': '1000', 'province': '上海', 'city': '上海市', 'industry': '软件和信息技术服务业',
+            'address': '上海市浦东新区某某路1号', 'businessScope': '技术开发、技术咨询、技术服务' * 5}
+
+
+def path_node(i: int) -> dict:
+    return {'StartNode': f's{i}', 'StartName': f'某某投资{i}有限公司', 'StartNodeType': '0', 'EndNode': f'e{i}',
+            'EndName': f'某某科技{i}有限公司', 'EndNodeType': '0', 'Type': 'INVEST', 'Sequence': i % 4,
+            'Proportion': '51.00%'}
+
+
+def risk_type(name: str, items: int) -> dict:
+    events = [{'event_count': 3, 'company_cnt': items, 'data_type': f't{i % 27 + 1}', 'desc': '风险描述',
+               'company_events': [{'cid': j, 'company_name': f'关联企业{j}', 'company_event_count': 1, 'tip': j % 3 + 1,
+                                   'detail': '事件详情' * 10} for j in range(items)]}
+              for i in range(5)]
+    return {'total': len(events), 'name': name, 'list_data': events}
+
+
+def partner(i: int, keyword: str) -> dict:
+    # 股东从固定的50家投资公司中按企业名称选取，不同企业之间存在共同股东
+    n = (zlib.crc32((keyword or '').encode()) + i) % 50
+    return {'name': f'某某投资{n}有限公司', 'type': 0, 'stockType': '企业法人', 'stockProportion': '20.00%',
+            'identifyNo': f'91310000MA{n:08d}', 'stockCapital': '200万人民币', 'includeDate': '2020-01-01'}
+
+
+def make_data(path: str, keyword: str, items: int):
+    if path.endswith('/SeniorSearch'):
+        return {'num_found': str(items * 10), 'data_list': [company(i, keyword or '搜索') for i in range(items)]}
+    if path.endswith('/Search/V1'):
+        name = keyword if keyword and keyword.endswith('公司') else f'{keyword}有限公司'
+        return {'items': [{'company_name': name, 'credit_no': '913100000000000000'}]}
+    if path.endswith('/Partners/V2'):
+        partners = [partner(i, keyword) for i in range(min(items, 4))]
+        partners.append({'name': '张三', 'type': 1, 'stockType': '自然人股东', 'stockProportion': '20.00%'})
+        return {'total': len(partners), 'items': partners}
+    if path.endswith('/Invest/V3'):
+        return {'total': items, 'Items': [{'Name': f'{keyword}子公司{i}', 'CreditCode': f'91330000MA{i:08d}',
+                                           'FundedRatio': '60%', 'Status': '存续'} for i in range(min(items, 5))]}
+    if path.endswith('/Base/V1'):
+        return {'CompanyName': keyword, 'CompanyType': '有限责任公司', 'LegalPerson': '张三', 'Capital': '1000万人民币',
+                'EstablishDate': '2020-01-01', 'CompanyStatus': '存续', 'CreditNo': '913100000000000000',
+                'BusinessScope': '技术开发、技术咨询、技术服务' * 20}
+    if path.endswith('/CompanyRiskInfo'):
+        names = ('self_risk', 'self_contract_risk', 'relation_risk', 'self_notice', 'relation_notice',
+                 'self_history_risk', 'relation_history_risk')
+        return {name: risk_type(name, items) for name in names}
+    if path.endswith('/ActualController'):
+        return {'ControllerData': [{'AcName': '张三', 'IsPersonal': '1', 'VotePercent': '51%', 'beneficiaProportion': '51%',
+                                    'Paths': [[path_node(i + j) for j in range(4)] for i in range(items)]}]}
+    if path.endswith('/BeneficialOwner'):
+        return {'Total': items, 'BeneficialOwnerData': [
+            {'BoName': f'受益人{i}', 'IsPersonal': '1', 'StockPercent': '10%', 'BoType': '1', 'Position': '董事',
+             'Paths': [path_node(i + j) for j in range(4)]} for i in range(items)]}
+    return {'total': items, 'items': [company(i, keyword or '') for i in range(items)]}
+
+
+def create_stub_app(latency: float = 0.0, distribution: str = 'fixed', items: int = 10,
+                    not_found_rate: float = 0.0) -> Starlette:
+    """
+    :param latency: 平均延迟(秒)
+    :param distribution: 延迟分布，fixed、uniform、exponential、lognormal
+    :param items: 响应中列表的条数，控制响应大小
+    :param not_found_rate: 查询单个企业的接口返回statusCode == 2的比例
+    """
+    stats = {'requests': 0, 'not_found': 0}
+
+    async def handle(request: Request):
+        stats['requests'] += 1
+        delay = sample_latency(latency, distribution)
+        if delay:
+            await asyncio.sleep(delay)
+        path = request.url.path
+        params = request.query_params
+        keyword = params.get('keyword') or params.get('key_word') or params.get('name')
+        if path in COMPANY_ENDPOINTS and not_found_rate and random.random() < not_found_rate:
+            stats['not_found'] += 1
+            return JSONResponse({'statusCode': 2, 'statusMessage': '未找到企业'})
+        return JSONResponse({'statusCode': 1, 'statusMessage': '成功', 'data': make_data(path, keyword, items)})
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats)
+
+    async def reset_stats(request: Request):
+        stats.update(requests=0, not_found=0)
+        return JSONResponse(stats)
+
+    return Starlette(routes=[Route('/_stats', get_stats), Route('/_stats/reset', reset_stats, methods=['POST']),
+                             Route('/{path:path}', handle)])
+
+
+class StubServer:
+    """
+    在后台线程中运行桩服务
+    """
+    def __init__(self, app: Starlette, host: str = '127.0.0.1', port: int = 18080):
+        self.base_url = f'http://{host}:{port}'
+        self._server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level='warning', access_log=False))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.0, help='上游平均延迟(秒)')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--items', type=int, default=10, help='响应中列表的条数')
+    parser.add_argument('--not-found-rate', type=float, default=0.0, help='返回statusCode == 2的比例')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    app = create_stub_app(args.latency, args.distribution, args.items, args.not_found_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning', access_log=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,32 @@
+import asyncio
 import hashlib
 import os
 import time
-from urllib.parse import urlencode
+from contextlib import aclosing
+from urllib.parse import urlencode, urlsplit, urlunsplit
 
 from dotenv import load_dotenv
-from httpx import AsyncClient
+
+import metrics
+import tracing
+from cache import MISSING, response_cache
+from http_client import get_http_client
+from json_codec import JSON_PASSTHROUGH, STREAM_PARSE_MIN_BYTES, loads, raw_response
+from projection import SEARCH_FIELDS, has_projection, has_stream_projection, project, project_stream
+from rate_limiter import rate_limiter
+from resilience import UpstreamHTTPError, resilience
+from singleflight import SingleFlight
 
 
 load_dotenv()
 
 SHUIDI_PNAME = os.getenv("shuidi_pname")
 SHUIDI_PKEY = os.getenv("shuidi_pkey")
+# 覆盖接口的协议及域名，例如 http://127.0.0.1:8000 ，用于压测及本地桩服务
+SHUIDI_API_BASE = os.getenv("shuidi_api_base")
+
+# 合并相同接口及参数的并发请求
+in_flight_requests = SingleFlight()
 
 def create_api_adapter(url, pname=SHUIDI_PNAME, pkey=SHUIDI_PKEY):
 
@@ -20,56 +36,195 @@ def create_search_api_adapter(pname=SHUIDI_PNAME, pkey=SHUIDI_PKEY):
 
     return SearchApiAdapter(pname, pkey)
 
+class StreamedResponse:
+    """
+    边下载边解析裁剪的http响应，不保留响应正文
+    """
+    __slots__ = ('status_code', 'data', 'size')
+
+    def __init__(self, status_code, data, size):
+        self.status_code = status_code
+        self.data = data
+        self.size = size
+
+def response_size(response) -> int:
+    return response.size if isinstance(response, StreamedResponse) else len(response.content)
+
+def rebase_url(url, base=SHUIDI_API_BASE):
+    if not base:
+        return url
+    parts = urlsplit(url)
+    base_parts = urlsplit(base)
+    return urlunsplit((base_parts.scheme, base_parts.netloc, base_parts.path.rstrip('/') + parts.path, parts.query, ''))
+
 class ApiAdapter:
     def __init__(self, url, pname, pkey):
-        self.url = url
+        self.url = rebase_url(url)
         self.pname = pname
         self.pkey = pkey
 
 
-    async def _invoke(self, params=None):
+    async def _invoke(self, params=None, extra_fields=None):
+        """
+        调用上游接口(含重试)，返回http响应，配置了流式解析的接口返回StreamedResponse
+        """
         filtered_params = {k: v for k, v in params.items() if v is not None}
         api_params = urlencode(filtered_params)
+        with tracing.span('ApiAdapter._invoke', **{'url.path': metrics.endpoint_of(self.url)}):
+            return await resilience.call(self.url, lambda: self._send(api_params, extra_fields))
+
+    async def _stream(self, api_url, extra_fields=None):
+        """
+        边下载边解析裁剪响应，不缓冲完整的响应正文
+        非200的响应及Content-Length小于STREAM_PARSE_MIN_BYTES的响应按普通响应读取，之后整体解析
+        """
+        async with get_http_client().stream('GET', api_url) as response:
+            length = response.headers.get('content-length')
+            if response.status_code != 200 or (length is not None and int(length) < STREAM_PARSE_MIN_BYTES):
+                await response.aread()
+                return response
+            data, size = await project_stream(self.url, response.aiter_bytes(), extra_fields)
+            return StreamedResponse(response.status_code, data, size)
+
+    async def _send(self, api_params, extra_fields=None):
+        # 每次发送(包括重试及对冲请求)都重新签名
+        with metrics.timed('sign', self.url):
+            ptime = int(time.time() * 1000)
+            m = hashlib.md5()
+            m.update((self.pkey + '_' + str(ptime) + '_' + self.pkey).encode('utf-8'))
+            vkey = m.hexdigest()
+
+            api_url = f'{self.url}?{api_params}&pname={self.pname}&ptime={ptime}&vkey={vkey}'
+
+        endpoint = metrics.endpoint_of(self.url)
+        # 每次尝试(包括重试及对冲请求)一个span，排队等待限流的时间计入span
+        with tracing.span(f'GET {endpoint}', tracing.SPAN_KIND_CLIENT,
+                          **{'http.request.method': 'GET', 'url.path': endpoint}) as current:
+            async with rate_limiter.slot(self.url) as permit:
+                start = time.monotonic()
+                # 流式解析时解析耗时计入网络耗时
+                if has_stream_projection(self.url):
+                    response = await self._stream(api_url, extra_fields)
+                else:
+                    response = await get_http_client().get(api_url)
+                latency = time.monotonic() - start
+                resilience.record_latency(self.url, latency)
+                permit.record(response.status_code)
+            if current is not None:
+                current.set_attribute('http.response.status_code', response.status_code)
+                current.set_attribute('shuidi.network_ms', round(latency * 1000, 3))
+        metrics.phase_duration.observe(latency, 'network', endpoint)
+        metrics.upstream_requests.inc(endpoint, str(response.status_code))
+        metrics.upstream_bytes.observe(response_size(response), endpoint)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise UpstreamHTTPError(response.status_code)
+        return response
 
-        ptime = int(time.time() * 1000)
-        m = hashlib.md5()
-        m.update((self.pkey + '_' + str(ptime) + '_' + self.pkey).encode('utf-8'))
-        vkey = m.hexdigest()
-
-        api_url = f'{self.url}?{api_params}&pname={self.pname}&ptime={ptime}&vkey={vkey}'
-
-        async with AsyncClient() as client:
-            response = await client.get(api_url)
-            return response.json()
-
-
-    async def invoke(self, params=None):
-
-        response = await self._invoke(params)
-        return self._on_response(response)
 
-    def _on_response(self, response):
+    async def invoke(self, params=None, use_cache=True, extra_fields=None, refresh=False, speculative=False):
+        """
+        :param extra_fields: 裁剪规则之外额外保留的字段路径，例如 data.data_list.regCapital
+        :param refresh: 不读取缓存，重新请求并写入缓存，用于在缓存过期前提前刷新
+        :param speculative: 投机调用，合并的所有调用方都取消后取消上游请求，不再等待结果写入缓存
+        """
+        cache_key = response_cache.make_key(self.url, params)
+        if extra_fields:
+            cache_key = f"{cache_key}#{','.join(sorted(extra_fields))}"
+        endpoint = metrics.endpoint_of(self.url)
+        with tracing.span('ApiAdapter.invoke', **{'url.path': endpoint}) as current:
+            if use_cache and not refresh:
+                cached = await response_cache.get(self.url, cache_key)
+                metrics.cache_requests.inc(endpoint, 'hit' if cached is not MISSING else 'miss')
+                if current is not None:
+                    current.set_attribute('shuidi.cache', 'hit' if cached is not MISSING else 'miss')
+                if cached is not MISSING:
+                    return cached
+
+            return await in_flight_requests.do(cache_key, lambda: self._fetch(params, cache_key, use_cache, extra_fields),
+                                               cancel_abandoned=speculative)
+
+    async def _fetch(self, params, cache_key, use_cache, extra_fields=None):
+        # 透传模式下，没有裁剪规则的接口直接返回原始响应文本
+        raw = JSON_PASSTHROUGH and not extra_fields and not has_projection(self.url)
+        http_response = await self._invoke(params, extra_fields)
+        with metrics.timed('shaping', self.url), \
+                tracing.span('ApiAdapter._on_response', **{'shuidi.raw': raw, 'shuidi.response_bytes': response_size(http_response)}):
+            if isinstance(http_response, StreamedResponse):
+                response = http_response.data
+            elif raw:
+                response = raw_response(http_response.text)
+            else:
+                response = self._on_response(loads(http_response.content), extra_fields)
+        if use_cache:
+            await response_cache.set(self.url, cache_key, response)
         return response
 
+    def _on_response(self, response, extra_fields=None):
+        return project(self.url, response, extra_fields)
+
 
 class SearchApiAdapter(ApiAdapter):
 
+    # 保留的字段，裁剪规则见projection.PROJECTIONS
+    FIELDS = SEARCH_FIELDS
+    # 分页参数名及每页条数
+    PAGE_PARAM = os.getenv("shuidi_search_page_param", "page")
+    PAGE_SIZE_PARAM = os.getenv("shuidi_search_page_size_param", "pagesize")
+    PAGE_SIZE = int(os.getenv("shuidi_search_page_size", "100"))
+
     def __init__(self, pname, pkey):
         super().__init__(url='http://api.shuidi.cn/utn/action/search/SeniorSearch', pname=pname, pkey=pkey)
 
-    def _on_response(self, response):
-        # 控制响应大小，只保留接口返回的必要数据
-        keys_to_copy = ['companyName','creditNo','establishDate','legalPerson', 'capital', 'companyStatusStr']
-        data = response.get('data')
-        if data:
-            data_list = data.get('data_list')
-            if data_list:
-                new_data_list = []
-                for row in data_list:
-                    new_row = {k: row[k] for k in keys_to_copy}
-                    new_data_list.append(new_row)
-                data['data_list'] = new_data_list
-        response['data'] = data
-        #删除多余的status,与其他api接口统计返回格式
-        response.pop('status', None)
-        return response
+    async def iter_pages(self, params, page_size=None, max_rows=None, prefetch=1, extra_fields=None):
+        """
+        逐页查询，以异步生成器的方式返回每页的响应，同时预取后续prefetch页
+        分页结果不写入缓存，内存占用只与页大小及预取页数有关
+        :param max_rows: 最多返回的记录数，为None时返回全部
+        """
+        page_size = page_size or self.PAGE_SIZE
+
+        def fetch(page):
+            page_params = dict(params, **{self.PAGE_PARAM: page, self.PAGE_SIZE_PARAM: page_size})
+            return asyncio.ensure_future(self.invoke(page_params, use_cache=False, extra_fields=extra_fields))
+
+        pending = [fetch(1)]
+        next_page = 2
+        last_page = None
+        rows = 0
+        try:
+            while pending:
+                response = await pending.pop(0)
+                data = response.get('data') or {}
+                data_list = data.get('data_list') or []
+                rows += len(data_list)
+                finished = (response.get('statusCode') != 1 or len(data_list) < page_size
+                            or (max_rows is not None and rows >= max_rows))
+                if not finished:
+                    if last_page is None:
+                        num_found = int(data.get('num_found') or 0)
+                        last_page = -(-num_found // page_size)
+                        if max_rows is not None:
+                            last_page = min(last_page, -(-max_rows // page_size))
+                    # 调用方处理当前页时，后续页已在请求中
+                    while len(pending) < max(prefetch, 1) and next_page <= last_page:
+                        pending.append(fetch(next_page))
+                        next_page += 1
+                yield response
+                if finished:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iter_rows(self, params, page_size=None, max_rows=None, prefetch=1, extra_fields=None):
+        """
+        逐条返回查询结果
+        """
+        rows = 0
+        async with aclosing(self.iter_pages(params, page_size, max_rows, prefetch, extra_fields)) as pages:
+            async for response in pages:
+                for row in (response.get('data') or {}).get('data_list') or []:
+                    if max_rows is not None and rows >= max_rows:
+                        return
+                    rows += 1
+                    yield row
@@ -0,0 +1,237 @@
+import os
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from urllib.parse import urlencode, urlsplit
+
+from dotenv import load_dotenv
+
+from disk_cache import DiskCache
+from json_codec import RawJSON, dumps_bytes
+
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("shuidi_cache_enabled", "true").lower() in ('1', 'true', 'yes')
+CACHE_MAX_BYTES = int(os.getenv("shuidi_cache_max_bytes", str(64 * 1024 * 1024)))
+# 多进程部署时通过磁盘缓存在进程间共享响应：只配置了内存缓存的接口也写入磁盘，有效期与内存缓存相同
+CACHE_SHARED = os.getenv("shuidi_cache_shared", "false").lower() in ('1', 'true', 'yes')
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存，可按条目数及估算字节数限制内存占用
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, MISSING, record=False) is not MISSING
+
+    def get(self, key, default=None, record=True):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            if record:
+                self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if record:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl, size=1):
+        if ttl <= 0:
+            return
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        self._evict()
+
+    def ttl(self, key):
+        """
+        返回剩余有效时间(秒)，不存在时返回None
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        remaining = entry[1] - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def pop(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        while self._data and ((self.max_entries is not None and len(self._data) > self.max_entries)
+                              or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key, (_, _, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    # 内存缓存有效期(秒)，0表示不缓存
+    ttl: float
+    # 磁盘缓存有效期(秒)，0表示不写入磁盘，用于变化缓慢的接口，服务重启后仍可命中
+    disk_ttl: float = 0
+
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+DEFAULT_CACHE_POLICY = CachePolicy(ttl=10 * MINUTE)
+
+# 各接口的缓存策略，按接口路径配置
+CACHE_POLICIES = {
+    '/utn/action/search/SeniorSearch': CachePolicy(ttl=10 * MINUTE),
+    '/utn/ic/Search/V1': CachePolicy(ttl=DAY, disk_ttl=7 * DAY),
+    '/utn/ic/Base/V1': CachePolicy(ttl=DAY, disk_ttl=7 * DAY),
+    '/utn/ic/Partners/V2': CachePolicy(ttl=DAY),
+    '/utn/stie/score': CachePolicy(ttl=7 * DAY, disk_ttl=30 * DAY),
+    '/utn/risk/CompanyRiskInfo': CachePolicy(ttl=HOUR),
+    '/utn/cf/Honor': CachePolicy(ttl=7 * DAY, disk_ttl=30 * DAY),
+    '/utn/ic/GetContacts': CachePolicy(ttl=DAY, disk_ttl=7 * DAY),
+    '/utn/ic/Invest/V3': CachePolicy(ttl=DAY),
+    '/utn/ip/CertificateList/V2': CachePolicy(ttl=7 * DAY, disk_ttl=30 * DAY),
+    '/utn/cp/AllCompanys': CachePolicy(ttl=DAY),
+    '/utn/pic/ActualController': CachePolicy(ttl=DAY),
+    '/utn/pic/BeneficialOwner': CachePolicy(ttl=DAY),
+}
+
+
+def estimate_size(value) -> int:
+    # 透传的原始响应文本直接按长度估算
+    if isinstance(value, str):
+        return len(value)
+    return len(dumps_bytes(value))
+
+
+class ResponseCache:
+    """
+    接口响应缓存，以接口地址及过滤后的参数为key(不含ptime/vkey签名)，仅缓存成功的响应
+    分两级：内存LRU缓存，及配置了disk_ttl的接口使用的磁盘缓存
+    缓存的响应会被多个调用方共享，调用方不应修改返回的dict
+    """
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, policies=None, enabled=CACHE_ENABLED, disk=None, shared=CACHE_SHARED):
+        self.enabled = enabled
+        self.shared = shared
+        self.policies = CACHE_POLICIES if policies is None else policies
+        self.disk = DiskCache() if disk is None else disk
+        self._cache = TTLCache(max_bytes=max_bytes)
+        self._endpoint_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def policy(self, url) -> CachePolicy:
+        return self.policies.get(urlsplit(url).path, DEFAULT_CACHE_POLICY)
+
+    def disk_ttl(self, policy: CachePolicy) -> float:
+        return max(policy.disk_ttl, policy.ttl) if self.shared else policy.disk_ttl
+
+    @staticmethod
+    def make_key(url, params=None) -> str:
+        filtered_params = sorted((k, v) for k, v in (params or {}).items() if v is not None)
+        return f'{url}?{urlencode(filtered_params)}'
+
+    async def get(self, url, key):
+        policy = self.policy(url)
+        if not self.enabled or policy.ttl <= 0:
+            return MISSING
+        value = self._cache.get(key, MISSING)
+        if value is MISSING and self.disk_ttl(policy) > 0:
+            result = await self.disk.get(key)
+            if result is not None:
+                value, remaining = result
+                self._cache.set(key, value, min(policy.ttl, remaining), size=estimate_size(value))
+        self._endpoint_stats[urlsplit(url).path]['hits' if value is not MISSING else 'misses'] += 1
+        return value
+
+    def ttl(self, key):
+        """
+        内存缓存中剩余的有效时间(秒)，不存在或已过期时返回None
+        """
+        return self._cache.ttl(key)
+
+    async def reload(self, url, key, min_remaining=0.0):
+        """
+        从磁盘缓存重新加载到内存缓存，用于内存缓存已过期或即将过期而磁盘缓存仍有效的情况，不计入命中统计
+        :return 加载后内存缓存的剩余有效时间，磁盘缓存不存在或剩余有效时间不超过min_remaining时不加载，返回None
+        """
+        policy = self.policy(url)
+        if not self.enabled or policy.ttl <= 0 or self.disk_ttl(policy) <= 0:
+            return None
+        result = await self.disk.get(key)
+        if result is None or result[1] <= min_remaining:
+            return None
+        value, remaining = result
+        ttl = min(policy.ttl, remaining)
+        self._cache.set(key, value, ttl, size=estimate_size(value))
+        return ttl
+
+    async def set(self, url, key, response):
+        if not self.enabled or not isinstance(response, (dict, RawJSON)) or response.get('statusCode') != 1:
+            return
+        policy = self.policy(url)
+        size = estimate_size(response)
+        self._cache.set(key, response, policy.ttl, size=size)
+        disk_ttl = self.disk_ttl(policy)
+        if disk_ttl > 0:
+            await self.disk.set(key, urlsplit(url).path, response, disk_ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        stats['enabled'] = self.enabled
+        stats['shared'] = self.shared
+        stats['disk'] = self.disk.stats()
+        stats['endpoints'] = dict(self._endpoint_stats)
+        return stats
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from json_codec import JSON_PASSTHROUGH, RawJSON, dumps_bytes, loads, raw_response
+
+
+load_dotenv()
+
+DISK_CACHE_ENABLED = os.getenv("shuidi_disk_cache_enabled", "true").lower() in ('1', 'true', 'yes')
+DISK_CACHE_PATH = os.getenv("shuidi_disk_cache_path",
+                            os.path.join(os.path.expanduser('~'), '.cache', 'shuidi-mcp', 'responses.sqlite3'))
+DISK_CACHE_MAX_BYTES = int(os.getenv("shuidi_disk_cache_max_bytes", str(256 * 1024 * 1024)))
+# 每写入多少次检查一次是否需要压缩
+DISK_CACHE_COMPACT_INTERVAL = 200
+# 压缩时淘汰到上限的比例，避免频繁压缩
+DISK_CACHE_COMPACT_TARGET = 0.8
+
+
+class DiskCache:
+    """
+    基于SQLite的持久化缓存，保存序列化后的接口响应及过期时间，超过容量上限时按最近访问时间淘汰
+    所有SQLite操作在线程池中执行，不阻塞事件循环
+    """
+    def __init__(self, path=DISK_CACHE_PATH, max_bytes=DISK_CACHE_MAX_BYTES, enabled=DISK_CACHE_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            # WAL模式允许多个进程同时读写同一个缓存文件
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, value BLOB NOT NULL, '
+                         'size INTEGER NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses(accessed_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses(expires_at)')
+            # 多个进程间的租约，例如只由一个worker刷新关注列表
+            conn.execute('CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)')
+            conn.commit()
+            self._bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            if row is None or row[1] <= now:
+                return None
+            conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            conn.commit()
+            if JSON_PASSTHROUGH:
+                return raw_response(row[0].decode('utf-8')), row[1] - now
+            return loads(row[0]), row[1] - now
+
+    def _set(self, key, endpoint, value, ttl):
+        data = value.encode('utf-8') if isinstance(value, RawJSON) else dumps_bytes(value)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            old = conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO responses (key, endpoint, value, size, expires_at, accessed_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (key, endpoint, data, len(data), now + ttl, now))
+            conn.commit()
+            self._bytes += len(data) - (old[0] if old else 0)
+            self._writes += 1
+            if self._bytes > self.max_bytes or self._writes % DISK_CACHE_COMPACT_INTERVAL == 0:
+                self._compact(conn)
+
+    def _compact(self, conn):
+        # 先删除过期数据，仍超过上限时按最近访问时间淘汰
+        conn.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+        self._bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if self._bytes > self.max_bytes:
+            target = self.max_bytes * DISK_CACHE_COMPACT_TARGET
+            freed = 0
+            keys = []
+            for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+                if self._bytes - freed <= target:
+                    break
+                keys.append((key,))
+                freed += size
+            conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+            self._bytes -= freed
+        conn.commit()
+        self.compactions += 1
+
+    def _acquire_lease(self, name, owner, ttl):
+        with self._lock:
+            conn = self._connect()
+            # 立即加写锁，多个进程同时争抢时只有一个能写入
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = conn.execute('SELECT owner, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+                acquired = row is None or row[0] == owner or row[1] <= now
+                if acquired:
+                    conn.execute('INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                                 (name, owner, now + ttl))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return acquired
+
+    def _release_lease(self, name, owner):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+            conn.commit()
+
+    def _disable(self, e):
+        logger.warning(f"磁盘缓存[{self.path}]不可用，已停用: {e}")
+        self.enabled = False
+
+    async def get(self, key):
+        """
+        :return (响应, 剩余有效时间) ，不存在或已过期时返回None
+        """
+        if not self.enabled:
+            return None
+        try:
+            result = await asyncio.to_thread(self._get, key)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self._disable(e)
+            return None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def set(self, key, endpoint, value, ttl):
+        if not self.enabled or ttl <= 0:
+            return
+        try:
+            await asyncio.to_thread(self._set, key, endpoint, value, ttl)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self._disable(e)
+
+    async def acquire_lease(self, name, owner, ttl) -> bool:
+        """
+        获取或续期租约，租约不存在、已过期或已由owner持有时成功，有效期为ttl秒
+        """
+        if not self.enabled:
+            return False
+        try:
+            return await asyncio.to_thread(self._acquire_lease, name, owner, ttl)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.warning(f"获取租约[{name}]失败: {e}")
+            return False
+
+    async def release_lease(self, name, owner):
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._release_lease, name, owner)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.warning(f"释放租约[{name}]失败: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'compactions': self.compactions,
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from datetime import date, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from api_tool import create_search_api_adapter
+from cache import DAY, MINUTE, TTLCache, response_cache
+from normalizer import parse_date_range
+
+
+load_dotenv()
+
+# 按成立日期分桶缓存的统计数条数
+ESTABLISH_BUCKET_CACHE_SIZE = int(os.getenv("shuidi_establish_bucket_cache_size", "100000"))
+# 已过去的日期桶的有效期；包含最近shuidi_establish_recent_days天的桶变化较快，使用较短的有效期
+ESTABLISH_BUCKET_TTL = float(os.getenv("shuidi_establish_bucket_ttl", str(DAY)))
+ESTABLISH_RECENT_BUCKET_TTL = float(os.getenv("shuidi_establish_recent_bucket_ttl", str(10 * MINUTE)))
+ESTABLISH_RECENT_DAYS = int(os.getenv("shuidi_establish_recent_days", "7"))
+# 缺失的桶超过该数量时不再分桶查询，直接按整个日期范围查询一次
+ESTABLISH_MAX_MISSING_BUCKETS = int(os.getenv("shuidi_establish_max_missing_buckets", "12"))
+# 并发查询缺失的桶的最大并发数
+ESTABLISH_CONCURRENCY = int(os.getenv("shuidi_establish_concurrency", "4"))
+
+
+def _month_end(day: date) -> date:
+    next_month = day.replace(day=28) + timedelta(days=4)
+    return next_month - timedelta(days=next_month.day)
+
+
+def split_date_range(start: date, end: date) -> list[tuple[date, date]]:
+    """
+    将闭区间[start, end]拆分为尽量少的整年、整月及单日的桶，例如
+    2022-12-30@2024-02-01 拆分为 2022-12-30、2022-12-31、2023年、2024年1月、2024-02-01
+    """
+    buckets = []
+    current = start
+    while current <= end:
+        if current.month == 1 and current.day == 1 and date(current.year, 12, 31) <= end:
+            bucket_end = date(current.year, 12, 31)
+        elif current.day == 1 and _month_end(current) <= end:
+            bucket_end = _month_end(current)
+        else:
+            bucket_end = current
+        buckets.append((current, bucket_end))
+        current = bucket_end + timedelta(days=1)
+    return buckets
+
+
+def split_periods(start: date, end: date, unit: str) -> list[tuple[str, date, date]]:
+    """
+    将闭区间[start, end]按自然年(year)或自然月(month)拆分，首尾不完整的周期截断到区间内
+    :return [(周期标签，例如2024或2024-03, 开始日期, 结束日期)]
+    """
+    periods = []
+    current = start
+    while current <= end:
+        if unit == 'year':
+            label, period_end = str(current.year), date(current.year, 12, 31)
+        else:
+            label, period_end = f'{current.year}-{current.month:02d}', _month_end(current)
+        periods.append((label, current, min(period_end, end)))
+        current = period_end + timedelta(days=1)
+    return periods
+
+
+def format_bucket(bucket: tuple[date, date]) -> str:
+    start, end = bucket
+    return f'{start.isoformat()}@{end.isoformat()}'
+
+
+class EstablishCounter:
+    """
+    按成立日期统计企业数，将日期范围拆分为年、月、日的桶，按地区、状态等条件缓存每个桶的num_found
+    新的日期范围由已缓存的桶累加，只查询缺失的桶，重叠的统计问题(2023年、2023年上半年、2023年3月)只需查询一次
+    """
+    def __init__(self, max_entries=ESTABLISH_BUCKET_CACHE_SIZE, ttl=ESTABLISH_BUCKET_TTL,
+                 recent_ttl=ESTABLISH_RECENT_BUCKET_TTL, recent_days=ESTABLISH_RECENT_DAYS,
+                 max_missing=ESTABLISH_MAX_MISSING_BUCKETS, concurrency=ESTABLISH_CONCURRENCY):
+        self.ttl = ttl
+        self.recent_ttl = recent_ttl
+        self.recent_days = recent_days
+        self.max_missing = max_missing
+        self.concurrency = concurrency
+        self._cache = TTLCache(max_entries=max_entries)
+        self.bucket_fetches = 0
+        self.direct_queries = 0
+
+    def _bucket_ttl(self, bucket: tuple[date, date], today: date) -> float:
+        return self.recent_ttl if bucket[1] >= today - timedelta(days=self.recent_days) else self.ttl
+
+    async def _query(self, params: dict, date_range: Optional[str]) -> dict:
+        # 只需要num_found，每页1条
+        adapter = create_search_api_adapter()
+        page_params = dict(params, establishDate=date_range,
+                           **{adapter.PAGE_PARAM: 1, adapter.PAGE_SIZE_PARAM: 1})
+        return await adapter.invoke(page_params, use_cache=False)
+
+    async def count(self, params: dict, date_range: Optional[str], today: Optional[date] = None) -> dict:
+        """
+        :param params: 高级搜索的查询条件，不含establishDate
+        :param date_range: yyyy-mm-dd@yyyy-mm-dd格式的成立日期范围，结束日期省略或晚于今天时按今天计算
+        :return statusCode为1时data包含num_found及分桶情况，否则为失败的接口响应
+        """
+        today = today or date.today()
+        start, end = parse_date_range(date_range)
+        end = min(end.date(), today) if end else today
+        base_key = response_cache.make_key('establish', params)
+        if start is None:
+            # 没有开始日期无法分桶，直接查询
+            return await self._direct(params, date_range, base_key, None, end, today)
+        start = start.date()
+        if start > end:
+            return {'statusCode': 1, 'data': {'num_found': 0, 'buckets': 0, 'cached_buckets': 0, 'fetched_buckets': 0}}
+
+        buckets = split_date_range(start, end)
+        counts = {}
+        missing = []
+        for bucket in buckets:
+            value = self._cache.get(f'{base_key}#{format_bucket(bucket)}')
+            if value is None:
+                missing.append(bucket)
+            else:
+                counts[bucket] = value
+        if len(missing) > self.max_missing:
+            return await self._direct(params, f'{start.isoformat()}@{end.isoformat()}', base_key, start, end, today)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(bucket):
+            async with semaphore:
+                return bucket, await self._query(params, format_bucket(bucket))
+
+        failed = None
+        for bucket, response in await asyncio.gather(*(fetch(bucket) for bucket in missing)):
+            if response.get('statusCode') != 1:
+                # 其它查询成功的桶仍然缓存，重试时只需查询失败的桶
+                failed = failed or response
+                continue
+            counts[bucket] = int((response.get('data') or {}).get('num_found') or 0)
+            self._cache.set(f'{base_key}#{format_bucket(bucket)}', counts[bucket], self._bucket_ttl(bucket, today))
+        self.bucket_fetches += len(missing)
+        if failed is not None:
+            return failed
+        return {'statusCode': 1, 'data': {'num_found': sum(counts.values()), 'buckets': len(buckets),
+                                          'cached_buckets': len(buckets) - len(missing),
+                                          'fetched_buckets': len(missing)}}
+
+    async def _direct(self, params: dict, date_range: Optional[str], base_key: str, start: Optional[date], end: date,
+                      today: date) -> dict:
+        """
+        按整个日期范围查询一次，结果按[start, end]缓存，有效期规则与桶相同，重复的相同统计不再查询
+        """
+        key = f"{base_key}#{start.isoformat() if start else ''}@{end.isoformat()}"
+        num_found = self._cache.get(key)
+        if num_found is None:
+            self.direct_queries += 1
+            response = await self._query(params, date_range)
+            if response.get('statusCode') != 1:
+                return response
+            num_found = int((response.get('data') or {}).get('num_found') or 0)
+            self._cache.set(key, num_found, self._bucket_ttl((start or end, end), today))
+        return {'statusCode': 1, 'data': {'num_found': num_found, 'buckets': 0, 'cached_buckets': 0, 'fetched_buckets': 0}}
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        stats.update(bucket_fetches=self.bucket_fetches, direct_queries=self.direct_queries)
+        return stats
+
+
+establish_counter = EstablishCounter()
@@ -0,0 +1,139 @@
+import json
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# 行政区划表，包含省、地级市(自治州、地区、盟)及区县的全称和简称，简称已预先生成
+GAZETTEER_PATH = os.getenv("shuidi_gazetteer_path",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.json'))
+# 按输入缓存的地区解析结果条数
+AREA_CACHE_SIZE = int(os.getenv("shuidi_area_cache_size", "4096"))
+
+
+class Gazetteer:
+    """
+    行政区划索引，名称或简称 -> 所在位置，查询时按已确定的省份、城市过滤，只有唯一匹配时才采用
+    全称优先于简称，例如 朝阳区 只匹配全称为朝阳区的区县，朝阳 还可匹配朝阳县
+    """
+    def __init__(self, data: dict):
+        # 省份名称及简称 -> 简称
+        self.provinces = {}
+        # 简称 -> 全称
+        self.province_names = {}
+        self.municipalities = set()
+        # 名称 -> [(省份简称, 城市全称)]，简称单独索引
+        self.city_names = {}
+        self.city_aliases = {}
+        # 名称 -> [(省份简称, 城市全称, 区县全称)]
+        self.district_names = {}
+        self.district_aliases = {}
+        # 省份简称 -> 城市全称列表，(省份简称, 城市全称) -> 区县全称列表，按行政区划代码排序
+        self.cities = {}
+        self.districts = {}
+
+        for province in data['provinces']:
+            name, short = province['name'], province['short']
+            self.provinces[name] = self.provinces[short] = short
+            self.province_names[short] = name
+            if name.endswith('市'):
+                self.municipalities.add(short)
+            self.cities[short] = [city['name'] for city in province['cities']]
+            for city in province['cities']:
+                self.districts[(short, city['name'])] = [district for district, *_ in city['districts']]
+                self.city_names.setdefault(city['name'], []).append((short, city['name']))
+                aliases = list(city['aliases'])
+                if short in self.municipalities:
+                    # 直辖市的城市即直辖市本身，表中没有简称，城市参数为"上海"、"上海市"时同样匹配
+                    aliases += [alias for alias in (short, name) if alias != city['name'] and alias not in aliases]
+                for alias in aliases:
+                    self.city_aliases.setdefault(alias, []).append((short, city['name']))
+                for district, *aliases in city['districts']:
+                    location = (short, city['name'], district)
+                    self.district_names.setdefault(district, []).append(location)
+                    for alias in aliases:
+                        self.district_aliases.setdefault(alias, []).append(location)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH) -> 'Gazetteer':
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _match(names: dict, aliases: dict, name: str, province=None, city=None):
+        for index in (names, aliases):
+            matched = [location for location in index.get(name, ())
+                       if (province is None or location[0] == province) and (city is None or location[1] == city)]
+            if len(matched) == 1:
+                return matched[0]
+            if matched:
+                return None
+        return None
+
+    def mainland_provinces(self) -> list:
+        """
+        有下级行政区划数据的省份简称，不含港澳台
+        """
+        return [province for province, cities in self.cities.items() if cities]
+
+    def find_city(self, name: str, province=None):
+        """
+        :return (省份简称, 城市全称)，未找到或有歧义时返回None
+        """
+        return self._match(self.city_names, self.city_aliases, name, province)
+
+    def find_district(self, name: str, province=None, city=None):
+        """
+        :return (省份简称, 城市全称, 区县全称)，未找到或有歧义时返回None
+        """
+        return self._match(self.district_names, self.district_aliases, name, province, city)
+
+    def resolve_area(self, province=None, city=None, district=None) -> tuple:
+        """
+        将地区条件规范为高级搜索接口的格式：省份为简称，城市为全称，区县为全称
+        直辖市的城市为直辖市本身(未传城市时同样补上，未传省份而城市为直辖市时补上省份)，城市参数为其下的区县时作为区县；其它省份的城市参数为县级市或区县时，城市改为其所属地级市
+        表中没有的名称：直辖市的区县补全"区"，其它城市名称保持原样
+        :return (province, city, district)
+        """
+        province = self.provinces.get(province, province) if province else province
+        if not province and city:
+            # 未传省份而城市为直辖市时补上省份，按直辖市规则处理
+            location = self.find_city(city)
+            if location and location[0] in self.municipalities:
+                province = location[0]
+        scope = province if province in self.province_names else None
+
+        if province in self.municipalities:
+            if city and self.provinces.get(city) != province and not district:
+                location = self.find_district(city, province)
+                district = location[2] if location else (city if city.endswith('区') else f'{city}区')
+            city = self.province_names[province]
+        elif city:
+            location = self.find_city(city, scope)
+            if location:
+                city = location[1]
+            else:
+                location = self.find_district(city, scope)
+                if location:
+                    city, district = location[1], district or location[2]
+
+        if district:
+            known_city = city if city and self.find_city(city, scope) else None
+            location = self.find_district(district, scope, known_city)
+            if location:
+                district = location[2]
+        return province, city, district
+
+
+gazetteer = Gazetteer.load()
+
+
+@lru_cache(maxsize=AREA_CACHE_SIZE)
+def resolve_area(province=None, city=None, district=None) -> tuple:
+    """
+    按输入缓存的地区解析，见 Gazetteer.resolve_area
+    """
+    return gazetteer.resolve_area(province, city, district)
@@ -0,0 +1,70 @@
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from httpx import AsyncClient, Limits, Timeout
+from loguru import logger
+
+
+load_dotenv()
+
+# 连接池及超时配置，均可通过环境变量覆盖
+HTTP_MAX_CONNECTIONS = int(os.getenv("shuidi_http_max_connections", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("shuidi_http_max_keepalive_connections", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("shuidi_http_keepalive_expiry", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("shuidi_http_connect_timeout", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("shuidi_http_read_timeout", "30"))
+HTTP_POOL_TIMEOUT = float(os.getenv("shuidi_http_pool_timeout", "10"))
+HTTP2_ENABLED = os.getenv("shuidi_http2", "false").lower() in ('1', 'true', 'yes')
+
+_client = None
+_client_refs = 0
+
+
+def _create_client() -> AsyncClient:
+    http2 = HTTP2_ENABLED
+    if http2 and importlib.util.find_spec('h2') is None:
+        # http2需要安装h2(httpx[http2])，未安装时退回http/1.1
+        logger.warning("shuidi_http2已开启，但未安装h2，使用HTTP/1.1")
+        http2 = False
+
+    limits = Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+    timeout = Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+    return AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+def get_http_client() -> AsyncClient:
+    """
+    获取进程内共享的http客户端，未通过http_client_lifespan启动时按需创建
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def open_http_client() -> AsyncClient:
+    global _client_refs
+    _client_refs += 1
+    return get_http_client()
+
+
+async def close_http_client():
+    global _client, _client_refs
+    _client_refs = max(_client_refs - 1, 0)
+    # SSE/Streamable-http下每个会话都会进入一次lifespan，最后一个会话结束时才关闭连接池
+    if _client_refs == 0 and _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+@asynccontextmanager
+async def http_client_lifespan():
+    await open_http_client()
+    try:
+        yield
+    finally:
+        await close_http_client()
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    # 未安装orjson时使用标准库json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    # 未安装ijson时不支持流式解析，响应下载完成后整体解析
+    ijson = None
+
+
+load_dotenv()
+
+# 透传模式：没有裁剪规则的接口直接返回上游的响应文本，只检查statusCode，不做完整的解析及重新序列化
+JSON_PASSTHROUGH = os.getenv("shuidi_json_passthrough", "false").lower() in ('1', 'true', 'yes')
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+# 安装ijson时，对配置了流式解析的接口边下载边解析裁剪，见projection.Projection.stream
+STREAM_PARSE = ijson is not None and os.getenv("shuidi_stream_parse", "true").lower() in ('1', 'true', 'yes')
+# 流式解析的耗时约为orjson整体解析的2~3倍，整体解析的峰值内存约为响应大小的3倍(见bench/bench_risk_stream.py)
+# 响应头Content-Length小于该值的响应仍整体解析，常见的风险信息响应不受流式解析的耗时影响，只有更大的响应以耗时换取内存
+STREAM_PARSE_MIN_BYTES = int(os.getenv("shuidi_stream_parse_min_bytes", str(8 * 1024 * 1024)))
+
+# 只在响应开头查找statusCode
+STATUS_CODE_SCAN_CHARS = 256
+_STATUS_CODE = re.compile(r'"statusCode"\s*:\s*(-?\d+)')
+
+
+def loads(data):
+    """
+    :param data: str或bytes
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+async def stream_events(chunks, feed) -> int:
+    """
+    增量解析异步的字节块，每个块解析出的ijson basic_parse事件[(event, value)]交给feed处理，需要安装ijson
+    小数解析为float，与loads一致
+    :return 读取的字节数
+    """
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True)
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        parser.send(chunk)
+        if events:
+            feed(events)
+            del events[:]
+    # 结束时检查JSON是否完整
+    parser.close()
+    feed(events)
+    return size
+
+
+def dumps_bytes(value) -> bytes:
+    """
+    序列化为UTF-8编码的紧凑JSON，无法序列化的对象转为字符串
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # 超过64位的整数等orjson不支持的值
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def dumps(value) -> str:
+    return dumps_bytes(value).decode('utf-8')
+
+
+class RawJSON(str):
+    """
+    上游返回的原始JSON文本，作为工具结果时原样返回给客户端
+    get()与dict兼容，statusCode取自文本开头，读取其它字段时才解析整个响应
+    """
+    def __new__(cls, text: str, status_code: int):
+        raw = super().__new__(cls, text)
+        raw.status_code = status_code
+        raw._data = None
+        return raw
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            # orjson只接受str本身，不接受子类
+            self._data = loads(str(self))
+        return self._data
+
+    def get(self, key, default=None):
+        if key == 'statusCode':
+            return self.status_code
+        return self.data.get(key, default)
+
+
+def raw_response(text: str):
+    """
+    包装上游的响应文本，开头找不到statusCode时完整解析(非JSON时抛出异常)
+    """
+    match = _STATUS_CODE.search(text, 0, STATUS_CODE_SCAN_CHARS)
+    if match is None or not text.lstrip().startswith('{'):
+        return loads(text)
+    return RawJSON(text, int(match.group(1)))
+
+
+def decoded(value):
+    """
+    返回可修改、可遍历的响应，RawJSON解析为dict
+    """
+    return value.data if isinstance(value, RawJSON) else value
@@ -1,62 +1,209 @@
+import argparse
 import asyncio
+import csv
 import inspect
+import json
+import os
+import shutil
 import sys
+import tempfile
+from contextlib import aclosing, asynccontextmanager
+from datetime import date, datetime
 from functools import wraps
 from typing import Optional
 
 from loguru import logger
 from mcp.server import FastMCP
+from mcp.server.fastmcp import Context
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
-from api_tool import create_api_adapter, create_search_api_adapter
-from normalizer import Area, CompanyStatus, DateRange, normalize_company_name
+import metrics
+import tracing
+from api_tool import create_api_adapter, create_search_api_adapter, in_flight_requests
+from cache import MISSING, estimate_size, response_cache
+from establish_counter import establish_counter, split_periods
+from gazetteer import gazetteer
+from http_client import http_client_lifespan
+from json_codec import decoded
+from ownership_graph import DIRECTIONS, INVEST_URL, PARTNERS_URL, ownership_graph
+from rate_limiter import rate_limiter
+from projection import projection_stats
+from resilience import resilience
+from result_store import RESULT_HANDLE_THRESHOLD, list_paths, preview, result_store
+from normalizer import (Area, CompanyStatus, DateRange, cache_company_name, get_cached_company_name, normalize_company_name,
+                        parse_date_range, search_company_name)
+from watchlist import BASE_URL, CONTROLLER_URL, RISK_URL, watchlist_lifespan, watchlist_refresher
 
-mcp = FastMCP(name='Shuidi DataMcpServer')
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    # 服务启动时创建共享的http连接池，退出时关闭
+    async with http_client_lifespan():
+        yield
+
+
+class ShuidiMCP(FastMCP):
+    """
+    注册的工具自动记录调用次数、返回的statusCode及耗时，并作为trace的根span
+    """
+    def add_tool(self, fn, name=None, description=None, annotations=None):
+        name = name or fn.__name__
+        super().add_tool(metrics.instrument_tool(name)(tracing.traced(f'tool {name}')(fn)), name, description, annotations)
+
+
+mcp = ShuidiMCP(name='Shuidi DataMcpServer', lifespan=server_lifespan)
+
+# 高级搜索的企业类型条件
+ESTABLISHED_COMPANY_TYPES = '有限责任公司,股份有限公司,股份合作公司,国有企业,央企,集体所有制,全民所有制,独资企业,有限合伙,普通合伙,外商投资企业,港、澳、台商投资企业,联营企业,私营企业'
+COMPANY_TYPES = '有限责任公司,股份有限公司,独资企业,集体所有制,有限合伙,普通合伙,股份合作公司,全民所有制,联营企业,私营企业,其他'
+SELFEMPLOYED_TYPES = '个体工商户'
 
 def create_bad_resonse(message) -> dict:
     return {'statusCode':99999, 'statusMessage': message}
 
-def normalize_company(param_name: str):
+# 投机模式：首次调用接口的同时并发查询企业全称，减少简称场景下的串行等待
+SPECULATIVE_NORMALIZE = os.getenv("shuidi_speculative_normalize", "false").lower() in ('1', 'true', 'yes')
+
+
+async def call_speculatively(func, bound, param_name: str, company_name: str):
+    """
+    同时发起接口调用及企业名称搜索，原名调用成功则直接返回并取消搜索，
+    原名查询不到企业(statusCode == 2)时才缓存搜索结果并用全称再次调用，原名为全称时不会被缓存为其它企业的别名
+    取消的搜索在没有其它调用方合并等待时同时取消上游请求，但请求可能已发出，计入名称匹配指标的cancelled
+    """
+    first = asyncio.ensure_future(func(*bound.args, **bound.kwargs))
+    resolve = asyncio.ensure_future(search_company_name(company_name, speculative=True))
+    try:
+        response = await first
+        if response.get('statusCode') != 2:
+            return response
+
+        n_company_name, status_code = await resolve
+        cache_company_name(company_name, n_company_name, status_code)
+        if not n_company_name or n_company_name == company_name:
+            record_normalize(func.__name__, 'unmatched')
+            return response
+        record_normalize(func.__name__, 'retry')
+        bound.arguments[param_name] = n_company_name
+        return await func(*bound.args, **bound.kwargs)
+    finally:
+        if not resolve.done():
+            record_normalize(func.__name__, 'cancelled')
+        for task in (first, resolve):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+def record_normalize(tool: str, result: str):
+    metrics.normalize_retries.inc(tool, result)
+    tracing.set_attribute('shuidi.normalize', result)
+
+
+def in_request(ctx: Optional[Context]) -> bool:
+    try:
+        return ctx is not None and ctx.request_context is not None
+    except ValueError:
+        return False
+
+
+def normalize_company(param_name: str, speculative: Optional[bool] = None):
+    """
+    接口返回statusCode == 2(未找到企业)时，将企业名称模糊匹配为全称后重试
+    已缓存的简称直接替换为全称调用，已确认无法匹配的名称不再重复搜索
+    :param speculative 是否使用投机模式，为None时由环境变量shuidi_speculative_normalize决定
+    """
     def decorator(func):
+        sig = inspect.signature(func)
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            response =  await func(*args, **kwargs)
-            if response.get('statusCode') == 2:
-                sig = inspect.signature(func)
-                params = list(sig.parameters.keys())
-                if param_name in params:
-                    param_index = params.index(param_name)
-                    if kwargs.get(param_name):
-                        company_name = kwargs.get(param_name)
-                    else:
-                        args = list(args)
-                        company_name = args[param_index]
-                    n_company_name = await normalize_company_name(company_name)
-                    if n_company_name and company_name != n_company_name:
-                        if kwargs.get(param_name):
-                            kwargs[param_name] = n_company_name
-                        else:
-                            args[param_index] = n_company_name
-                            args = tuple(args)
-                        return await func(*args, **kwargs)
+            with tracing.span('normalize_company', tool=func.__name__):
+                return await call(*args, **kwargs)
+
+        async def call(*args, **kwargs):
+            bound = sig.bind_partial(*args, **kwargs)
+            company_name = bound.arguments.get(param_name)
+            if not company_name:
+                return await func(*args, **kwargs)
+
+            cached_name = get_cached_company_name(company_name)
+            if cached_name is not MISSING and cached_name and cached_name != company_name:
+                record_normalize(func.__name__, 'alias')
+                bound.arguments[param_name] = cached_name
+                return await func(*bound.args, **bound.kwargs)
+
+            if cached_name is MISSING and (SPECULATIVE_NORMALIZE if speculative is None else speculative):
+                return await call_speculatively(func, bound, param_name, company_name)
+
+            response = await func(*args, **kwargs)
+            if response.get('statusCode') == 2 and cached_name is MISSING:
+                n_company_name = await normalize_company_name(company_name)
+                if n_company_name and company_name != n_company_name:
+                    record_normalize(func.__name__, 'retry')
+                    bound.arguments[param_name] = n_company_name
+                    return await func(*bound.args, **bound.kwargs)
+                record_normalize(func.__name__, 'unmatched')
             return response
         return wrapper
     return decorator
 
 
+def store_large_result(func):
+    """
+    结果超过shuidi_result_handle_threshold时保存在服务端，只返回摘要、列表路径及句柄，
+    可通过fetch_result_slice工具或资源shuidi://results/{handle}/{path}/{offset}/{limit}分片获取
+    结果无法保存(超过shuidi_result_store_max_bytes或多worker)时返回完整结果；full_result属性为不保存结果的原函数
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        response = await func(*args, **kwargs)
+        if RESULT_HANDLE_THRESHOLD <= 0 or response.get('statusCode') != 1:
+            return response
+        size = estimate_size(response)
+        if size < RESULT_HANDLE_THRESHOLD:
+            return response
+        handle = result_store.put(decoded(response), size)
+        if handle is None:
+            return response
+        response = decoded(response)
+        return {
+            'statusCode': 1,
+            'statusMessage': '结果较大，已保存在服务端，请根据lists中的路径通过fetch_result_slice分页获取',
+            'handle': handle,
+            'resource': f'shuidi://results/{handle}',
+            'size': size,
+            'lists': list_paths(response),
+            'preview': preview(response),
+        }
+    wrapper.full_result = func
+    return wrapper
+
+
+def full_result(tool):
+    """
+    合并多个工具结果的工具需要完整的data，使用store_large_result包装前的函数
+    """
+    return getattr(tool, 'full_result', tool)
+
+
 @mcp.tool()
-async def search_established_companies(province=None, city=None, district=None, establish_date=None) -> dict:
+async def search_established_companies(province=None, city=None, district=None, establish_date=None, extra_fields: Optional[list[str]] = None) -> dict:
     """
     输入省份、城市、成立日期查询并统计某时间段成立的企业
     回答问题时结果中请先说明查询到的企业数，并以列表的形式列出查询到的前10条企业
     :param province String 省份,例如上海,新疆,江苏,为None时表示查询全国的企业
     :param city String 城市,地级市，例如杭州，苏州
-    :param district String 区县,区县名称需完整,包含市、县、区,例如昆山市，浦东新区
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
     :param establish_date String 成立期限，格式如yyyy-mm-dd@yyyy-mm-dd
                                           2023-01-12@2023-11-11 表示2012年1月12日到2023年11月11日之间成立的企业,
                                           2023-01-12@2023-01-12 表示2012年1月12日成立的企业,
                                           2023-01-12@表示2023年1月12号及之后成立的企业,
                                           @2023-11-11表示23年11月11日之前成立的公司,
                                           为None时表示任意时间成立的企业。
+    :param extra_fields List 默认只返回下列字段，需要接口返回的其它字段时传入字段名列表
 
     :return
     statusCode	int	1代表成功,其他表示失败
@@ -73,28 +220,29 @@ async def search_established_companies(province=None, city=None, district=None,
     try:
         area = Area(province=province, city=city, district=district)
         establish_date = DateRange(date_range=establish_date).date_range
-        params = {'province': area.province, 'city': area.city, 'district': area.district, 'establishDate':establish_date, 'company_type':'有限责任公司,股份有限公司,股份合作公司,国有企业,央企,集体所有制,全民所有制,独资企业,有限合伙,普通合伙,外商投资企业,港、澳、台商投资企业,联营企业,私营企业'}
+        params = {'province': area.province, 'city': area.city, 'district': area.district, 'establishDate':establish_date, 'company_type': ESTABLISHED_COMPANY_TYPES}
         adapter = create_search_api_adapter()
-        return await adapter.invoke(params)
+        return await adapter.invoke(params, extra_fields=search_extra_fields(extra_fields))
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"查询统计企业失败！{e}")
 
 
 @mcp.tool()
-async def search_established_selfemployed(province=None, city=None, district=None, establish_date=None) -> dict:
+async def search_established_selfemployed(province=None, city=None, district=None, establish_date=None, extra_fields: Optional[list[str]] = None) -> dict:
     """
     输入省份、城市、成立日期查询并统计某时间段成立的个体工商户
     回答问题时结果中请先说明查询到的记录数，并以列表的形式列出查询到的前10条个体工商户
     :param province String 省份,例如上海,新疆,江苏,为None时表示查询全国的企业
     :param city String 城市,地级市，例如杭州，苏州
-    :param district String 区县,区县名称需完整,包含市、县、区,例如昆山市，浦东新区
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
     :param establish_date String 成立期限，格式如yyyy-mm-dd@yyyy-mm-dd
                                           2023-01-12@2023-11-11 表示2012年1月12日到2023年11月11日之间成立的企业,
                                           2023-01-12@2023-01-12 表示2012年1月12日成立的企业,
                                           2023-01-12@表示2023年1月12号及之后成立的企业,
                                           @2023-11-11表示23年11月11日之前成立的公司,
                                           为None时表示任意时间成立的企业。
+    :param extra_fields List 默认只返回下列字段，需要接口返回的其它字段时传入字段名列表
 
     :return
     statusCode	int	状态码1代表成功,其他代表失败
@@ -111,24 +259,25 @@ async def search_established_selfemployed(province=None, city=None, district=Non
     try:
         area = Area(province=province, city=city, district=district)
         establish_date = DateRange(date_range=establish_date).date_range
-        params = {'province': area.province, 'city': area.city, 'district': area.district, 'establishDate':establish_date, 'company_type':'个体工商户'}
+        params = {'province': area.province, 'city': area.city, 'district': area.district, 'establishDate':establish_date, 'company_type': SELFEMPLOYED_TYPES}
         adapter = create_search_api_adapter()
-        return await adapter.invoke(params)
+        return await adapter.invoke(params, extra_fields=search_extra_fields(extra_fields))
     except Exception as e:
         logger.error(e)
         return create_bad_resonse("查询统计个体户失败！{e}")
 
 @mcp.tool()
-async def search_companies(province:Optional[str]=None, city:Optional[str]=None, district:Optional[str]=None, company_status:Optional[str]=None) -> dict:
+async def search_companies(province:Optional[str]=None, city:Optional[str]=None, district:Optional[str]=None, company_status:Optional[str]=None, extra_fields: Optional[list[str]] = None) -> dict:
     """
     输入省份、城市、企业状态查询并统计企业
     回答问题时结果中请先说明查询到的记录数，并以列表的形式列出查询到的前10条企业
     :param province String 省份,例如上海,新疆,江苏,为None时表示查询全国的企业
     :param city String 城市,地级市，例如杭州，苏州
-    :param district String 区县,区县名称需完整,包含市、县、区,例如昆山市，浦东新区
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
     :param company_status String 企业状态可以设为"正常"、"异常"、"在营"、"存续"、"在业"、"吊销"、"注销"、"迁入"、"迁出"、"撤销"、"清算"、"停业"、"其他",为None时表示所有状态的企业
                                  企业状态正常，包括了在营、存续、在业、迁入、迁出的企业
                                  企业状态异常，包括了吊销、注销企业
+    :param extra_fields List 默认只返回下列字段，需要接口返回的其它字段时传入字段名列表
     :return
     statusCode	int	状态码1代表成功,其他代表失败
     data.num_found	String	返回的记录数
@@ -147,29 +296,30 @@ async def search_companies(province:Optional[str]=None, city:Optional[str]=None,
             company_status = CompanyStatus(status=company_status).status
             params = {'province': area.province, 'city': area.city, 'district': area.district,
                       'company_status': company_status,
-                      'company_type': '有限责任公司,股份有限公司,独资企业,集体所有制,有限合伙,普通合伙,股份合作公司,全民所有制,联营企业,私营企业,其他'}
+                      'company_type': COMPANY_TYPES}
 
         else:
             params = {'province': area.province, 'city': area.city, 'district': area.district,
-                      'company_type': '有限责任公司,股份有限公司,独资企业,集体所有制,有限合伙,普通合伙,股份合作公司,全民所有制,联营企业,私营企业,其他'}
+                      'company_type': COMPANY_TYPES}
 
         adapter = create_search_api_adapter()
-        return await adapter.invoke(params)
+        return await adapter.invoke(params, extra_fields=search_extra_fields(extra_fields))
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"查询统计企业失败！{e}")
 
 @mcp.tool()
-async def search_selfemployed(province:Optional[str]=None, city:Optional[str]=None, district:Optional[str]=None, company_status:Optional[str]=None) -> dict:
+async def search_selfemployed(province:Optional[str]=None, city:Optional[str]=None, district:Optional[str]=None, company_status:Optional[str]=None, extra_fields: Optional[list[str]] = None) -> dict:
     """
     输入省份、城市、企业状态查询并统计个体户
     回答问题时结果中请先说明查询到的记录数，并以列表的形式列出查询到的前10条个体户
     :param province String 省份,例如上海,新疆,江苏,为None时表示查询全国的企业
     :param city String 城市,地级市，例如杭州，苏州
-    :param district String 区县,区县名称需完整,包含市、县、区,例如昆山市，浦东新区
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
     :param company_status String 企业状态可以设为"正常"、"异常"、"在营"、"存续"、"在业"、"吊销"、"注销"、"迁入"、"迁出"、"撤销"、"清算"、"停业"、"其他",为None时表示所有状态的企业
                                  企业状态正常，包括了在营、存续、在业、迁入、迁出的企业
                                  企业状态异常，包括了吊销、注销企业
+    :param extra_fields List 默认只返回下列字段，需要接口返回的其它字段时传入字段名列表
     :return
     statusCode	int	状态码1代表成功,其他代表失败
     data.num_found	String	返回的记录数
@@ -187,18 +337,258 @@ async def search_selfemployed(province:Optional[str]=None, city:Optional[str]=No
             company_status = CompanyStatus(status=company_status).status
             params = {'province': area.province, 'city': area.city, 'district': area.district,
                       'company_status': company_status,
-                      'company_type': '个体工商户'}
+                      'company_type': SELFEMPLOYED_TYPES}
 
         else:
             params = {'province': area.province, 'city': area.city, 'district': area.district,
-                      'company_type': '个体工商户'}
+                      'company_type': SELFEMPLOYED_TYPES}
 
         adapter = create_search_api_adapter()
-        return await adapter.invoke(params)
+        return await adapter.invoke(params, extra_fields=search_extra_fields(extra_fields))
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"查询统计个体户失败!{e}")
 
+# 导出文件目录及单次导出的最大记录数
+EXPORT_DIR = os.getenv("shuidi_export_dir", os.path.join(os.getcwd(), 'exports'))
+EXPORT_MAX_ROWS = int(os.getenv("shuidi_export_max_rows", "100000"))
+
+
+def search_extra_fields(extra_fields: Optional[list[str]]) -> Optional[list[str]]:
+    """
+    将企业字段名转换为高级搜索响应中的字段路径
+    """
+    return [f'data.data_list.{field}' for field in extra_fields] if extra_fields else None
+
+
+def path_extra_fields(list_key: str, extra_fields: Optional[list[str]]) -> Optional[list[str]]:
+    """
+    将控制路径的字段名转换为实控人(ControllerData)、受益所有人(BeneficialOwnerData)响应中的字段路径
+    """
+    return [f'data.{list_key}.Paths.{field}' for field in extra_fields] if extra_fields else None
+
+
+def build_search_params(company_kind: str, province=None, city=None, district=None, company_status=None, establish_date=None) -> dict:
+    area = Area(province=province, city=city, district=district)
+    if company_kind == 'selfemployed':
+        company_type = SELFEMPLOYED_TYPES
+    else:
+        company_type = ESTABLISHED_COMPANY_TYPES if establish_date else COMPANY_TYPES
+    return {'province': area.province, 'city': area.city, 'district': area.district,
+            'company_status': CompanyStatus(status=company_status).status if company_status else None,
+            'establishDate': DateRange(date_range=establish_date).date_range,
+            'company_type': company_type}
+
+
+@mcp.tool()
+async def export_search_results(company_kind: str = 'company', province: Optional[str] = None, city: Optional[str] = None,
+                                district: Optional[str] = None, company_status: Optional[str] = None,
+                                establish_date: Optional[str] = None, file_format: str = 'jsonl',
+                                max_rows: int = 10000, extra_fields: Optional[list[str]] = None, ctx: Context = None) -> dict:
+    """
+    按地区、企业状态、成立日期条件逐页查询全部匹配的企业或个体户，并导出到本地JSONL/CSV文件，适用于需要完整名单而不仅是统计数的场景
+    查询过程中按页发送进度通知
+    :param company_kind String company表示企业，selfemployed表示个体工商户
+    :param province String 省份,例如上海,新疆,江苏,为None时表示查询全国的企业
+    :param city String 城市,地级市，例如杭州，苏州
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
+    :param company_status String 企业状态，可选值同search_companies，为None时表示所有状态
+    :param establish_date String 成立期限，格式同search_established_companies，为None时表示任意时间成立
+    :param file_format String 导出文件格式，jsonl或csv
+    :param max_rows Number 最多导出的记录数，默认10000
+    :param extra_fields List 默认只导出companyName、creditNo、establishDate、legalPerson、capital、companyStatusStr，需要接口返回的其它字段时传入字段名列表
+    :return
+    statusCode	int	1代表成功,其他表示失败
+    num_found Number 匹配的记录总数
+    rows Number 导出的记录数
+    path String 导出文件路径
+    """
+    if company_kind not in ('company', 'selfemployed'):
+        return create_bad_resonse(f"不支持的类型{company_kind}，可选值: company、selfemployed")
+    if file_format not in ('jsonl', 'csv'):
+        return create_bad_resonse(f"不支持的文件格式{file_format}，可选值: jsonl、csv")
+
+    try:
+        params = build_search_params(company_kind, province, city, district, company_status, establish_date)
+        max_rows = min(max_rows, EXPORT_MAX_ROWS)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, f"{company_kind}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.{file_format}")
+
+        adapter = create_search_api_adapter()
+        notify = in_request(ctx)
+        num_found = 0
+        rows = 0
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = None
+            if file_format == 'csv':
+                writer = csv.DictWriter(f, fieldnames=adapter.FIELDS + (extra_fields or []), extrasaction='ignore')
+                writer.writeheader()
+            async with aclosing(adapter.iter_pages(params, max_rows=max_rows, extra_fields=search_extra_fields(extra_fields))) as pages:
+                async for response in pages:
+                    if response.get('statusCode') != 1:
+                        return response
+                    data = response.get('data') or {}
+                    num_found = int(data.get('num_found') or 0)
+                    for row in (data.get('data_list') or [])[:max_rows - rows]:
+                        if writer:
+                            writer.writerow(row)
+                        else:
+                            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                        rows += 1
+                    if notify:
+                        await ctx.report_progress(rows, min(num_found, max_rows))
+        return {'statusCode': 1, 'num_found': num_found, 'rows': rows, 'path': os.path.abspath(path)}
+    except Exception as e:
+        logger.error(e)
+        return create_bad_resonse(f"导出查询结果失败!{e}")
+
+
+@mcp.tool()
+async def count_established_companies(company_kind: str = 'company', province: Optional[str] = None,
+                                      city: Optional[str] = None, district: Optional[str] = None,
+                                      establish_date: Optional[str] = None,
+                                      company_status: Optional[str] = None) -> dict:
+    """
+    统计某时间段成立的企业或个体工商户数量，只需要数量而不需要企业名单时使用
+    成立日期范围按年、月、日分桶缓存，重叠的统计问题(如2023年、2023年上半年、2023年3月)只查询缺失的部分
+    :param company_kind String company表示企业，selfemployed表示个体工商户
+    :param province String 省份,例如上海,新疆,江苏,为None时表示统计全国
+    :param city String 城市,地级市，例如杭州，苏州
+    :param district String 区县,例如昆山市，浦东新区，可使用简称
+    :param establish_date String 成立期限，格式同search_established_companies，结束日期省略时统计到今天
+    :param company_status String 企业状态，可选值同search_companies，为None时表示所有状态
+    :return
+    statusCode int 1代表成功,其他代表失败
+    data.num_found Number 记录数
+    data.buckets Number 日期范围拆分的桶数，为0时表示按整个日期范围直接查询
+    data.cached_buckets Number 命中缓存的桶数
+    data.fetched_buckets Number 本次查询的桶数
+    """
+    try:
+        params = build_search_params(company_kind, province, city, district, company_status, establish_date)
+        establish_date = params.pop('establishDate')
+        return await establish_counter.count(params, establish_date)
+    except Exception as e:
+        logger.error(e)
+        return create_bad_resonse(f"统计企业数量失败！{e}")
+
+
+# 分组统计的维度及对应的图表类型
+GROUP_CHART_TYPES = {'province': 'map', 'city': 'bar', 'district': 'bar', 'year': 'line', 'month': 'line',
+                     'status': 'pie'}
+# 按企业状态分组时的分组，与CompanyStatus的映射一致，三组互不重叠
+STATUS_GROUPS = ('正常', '异常', '其他')
+GROUP_CONCURRENCY = int(os.getenv("shuidi_group_concurrency", "8"))
+GROUP_MAX_GROUPS = int(os.getenv("shuidi_group_max_groups", "120"))
+
+
+def group_conditions(group_by: str, province=None, city=None, district=None, company_status=None,
+                     establish_date=None) -> list[tuple[str, dict]]:
+    """
+    按分组维度展开查询条件，分组维度的条件覆盖传入的条件
+    :return [(分组标签, 该分组的province、city、district、company_status、establish_date条件)]
+    :raise ValueError 缺少分组所需的条件或分组过多
+    """
+    conditions = {'province': province, 'city': city, 'district': district, 'company_status': company_status,
+                  'establish_date': establish_date}
+    if group_by == 'province':
+        groups = [(name, dict(conditions, province=name, city=None, district=None))
+                  for name in gazetteer.mainland_provinces()]
+    elif group_by == 'city':
+        area = Area(province=province)
+        if area.province in gazetteer.municipalities:
+            # 直辖市按区县分组
+            city = gazetteer.province_names[area.province]
+            groups = [(name, dict(conditions, province=area.province, city=city, district=name))
+                      for name in gazetteer.districts[(area.province, city)]]
+        elif gazetteer.cities.get(area.province):
+            groups = [(name, dict(conditions, province=area.province, city=name, district=None))
+                      for name in gazetteer.cities[area.province]]
+        else:
+            raise ValueError('按城市分组需要指定省份')
+    elif group_by == 'district':
+        area = Area(province=province, city=city)
+        location = gazetteer.find_city(area.city, area.province) if area.city else None
+        if location is None:
+            raise ValueError('按区县分组需要指定城市')
+        groups = [(name, dict(conditions, province=location[0], city=location[1], district=name))
+                  for name in gazetteer.districts[location]]
+    elif group_by in ('year', 'month'):
+        start, end = parse_date_range(establish_date)
+        if start is None:
+            raise ValueError('按年、月分组需要指定成立日期的开始日期')
+        end = min(end.date(), date.today()) if end else date.today()
+        groups = [(label, dict(conditions, establish_date=f'{period_start.isoformat()}@{period_end.isoformat()}'))
+                  for label, period_start, period_end in split_periods(start.date(), end, group_by)]
+    elif group_by == 'status':
+        groups = [(name, dict(conditions, company_status=name)) for name in STATUS_GROUPS]
+    else:
+        raise ValueError(f'不支持的分组维度{group_by}，可选值: {",".join(GROUP_CHART_TYPES)}')
+    if len(groups) > GROUP_MAX_GROUPS:
+        raise ValueError(f'分组数{len(groups)}超过上限{GROUP_MAX_GROUPS}，请缩小日期范围或改为按年分组')
+    return groups
+
+
+@mcp.tool()
+async def group_count_companies(group_by: str, company_kind: str = 'company', province: Optional[str] = None,
+                                city: Optional[str] = None, district: Optional[str] = None,
+                                establish_date: Optional[str] = None, company_status: Optional[str] = None) -> dict:
+    """
+    按省份、城市、区县、年、月或企业状态分组统计企业或个体工商户数量，一次调用并发完成所有分组的查询，
+    用于"统计全国各省2024年成立的企业"、"2023年每月新成立的企业"等问题，不要逐个分组调用查询工具
+    返回的结果可直接用于绘制地图、柱状图、折线图、饼图
+    :param group_by String 分组维度:
+        province 全国各省份(不含港澳台)
+        city 指定省份下的各城市，直辖市为其下的各区县
+        district 指定城市下的各区县
+        year / month 将establish_date按自然年、自然月拆分，需要指定开始日期
+        status 按企业状态分为正常、异常、其他
+    :param company_kind String company表示企业，selfemployed表示个体工商户
+    :param province String 省份，按城市分组时必填
+    :param city String 城市，按区县分组时必填
+    :param district String 区县
+    :param establish_date String 成立期限，格式同search_established_companies，结束日期省略时统计到今天
+    :param company_status String 企业状态，可选值同search_companies，按状态分组时忽略
+    :return
+    statusCode int 1代表成功,其他代表失败
+    data.group_by String 分组维度
+    data.chart_type String 建议的图表类型: map、bar、line、pie
+    data.dimensions List 列名，[分组维度, num_found]
+    data.source List 每个分组一行[分组标签, 记录数]，省份、城市、区县按记录数降序，年、月按时间顺序；查询失败的分组记录数为null
+    data.total Number 各分组记录数之和
+    data.failed List 查询失败的分组及原因
+    """
+    try:
+        groups = group_conditions(group_by, province, city, district, company_status, establish_date)
+        semaphore = asyncio.Semaphore(GROUP_CONCURRENCY)
+
+        async def count(label, conditions):
+            async with semaphore:
+                params = build_search_params(company_kind, **conditions)
+                date_range = params.pop('establishDate')
+                return label, await establish_counter.count(params, date_range)
+
+        source = []
+        failed = []
+        for label, response in await asyncio.gather(*(count(label, conditions) for label, conditions in groups)):
+            if response.get('statusCode') == 1:
+                source.append([label, response['data']['num_found']])
+            else:
+                source.append([label, None])
+                failed.append({'group': label, 'statusMessage': response.get('statusMessage')})
+        if failed and len(failed) == len(groups):
+            return create_bad_resonse(f"分组统计失败！{failed[0]['statusMessage']}")
+        if GROUP_CHART_TYPES[group_by] in ('map', 'bar'):
+            source.sort(key=lambda row: -1 if row[1] is None else row[1], reverse=True)
+        return {'statusCode': 1, 'data': {'group_by': group_by, 'chart_type': GROUP_CHART_TYPES[group_by],
+                                          'dimensions': [group_by, 'num_found'], 'source': source,
+                                          'total': sum(row[1] for row in source if row[1] is not None),
+                                          'failed': failed}}
+    except Exception as e:
+        logger.error(e)
+        return create_bad_resonse(f"分组统计失败！{e}")
+
+
 @mcp.tool()
 @normalize_company('company_name')
 async def get_company_info(company_name: str) -> dict:
@@ -223,7 +613,7 @@ async def get_company_info(company_name: str) -> dict:
     """
 
     try:
-        adapter = create_api_adapter('http://api.shuidi.cn/utn/ic/Base/V1')
+        adapter = create_api_adapter(BASE_URL)
         return await adapter.invoke({'keyword': company_name})
     except Exception as e:
         logger.error(e)
@@ -252,8 +642,10 @@ async def get_company_partner(company_name:str) -> dict:
         holderNum String 持股数
     """
     try:
-        adapter = create_api_adapter('https://api.shuidi.cn/utn/ic/Partners/V2')
-        return await adapter.invoke({'keyword': company_name})
+        adapter = create_api_adapter(PARTNERS_URL)
+        response = await adapter.invoke({'keyword': company_name})
+        ownership_graph.ingest_partners(company_name, response)
+        return response
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"获取企业[{company_name}]股东信息失败!{e}")
@@ -315,6 +707,7 @@ async def get_stie_score(company_name:str) -> dict:
 
 
 @mcp.tool()
+@store_large_result
 @normalize_company('company_name')
 async def search_company_risk(company_name:str) -> dict:
     """
@@ -329,16 +722,17 @@ async def search_company_risk(company_name:str) -> dict:
         relation_notice 关联重要信息
         self_history_risk 自我历史风险
         relation_history_risk 关联历史风险
-    每种类型的风险，包括 total Number 事件总数， name String 事件名称, list_data 风险事件列表
+    每种类型的风险，包括 total Number 事件总数， name String 事件名称, list_data 风险事件列表(条数有上限，被截断时list_data_total为原始条数)
     风险事件，包括 event_count Number 该风险事件发生总数，company_cnt Number 该风险事件涉及企业数量，data_type 风险事件类型, desc 风险描述, company_events 该风险事件具体详情列表
         事件类型包括：{"n1":"法定代表人变更","n2":"主要人员变更","n3":"股东信息变更","n4":"注册资本变更","n5":"对外投资变更","n6":"新增联系电话","n7":"新增联系邮箱","n8":"联系地址变更","n9":"新增icp备案",
                     "t1":"被执行人","t1h":"历史被执行人","t2":"失信被执行","t3":"裁判文书","t4":"法院公告","t5":"开庭公告","t6":"立案信息","t7":"终本案件","t8":"限制高消费","t9":"行政处罚(其它)","t10":" 欠税公告",
                     "t11":"税收违法","t12":"送达公告","t13":"司法拍卖","t14":"询价评估结果","t15":"询价评估机构","t16":"破产重整","t17":"司法协助","t18":"经营异常","t19":"行政处罚-工商","t20":"严重违法",
                     "t21":"股权出质","t22":"清算信息","t23":"动产抵押","t24":"简易注销","t25":"知识产权出质","t26":"抽查检查","t27":"对外担保","c1":"裁判文书(合同纠纷)","c2":"开庭公告(合同纠纷)"}
+        company_events 条数有上限，被截断时company_events_total为原始条数，涉及企业总数见company_cnt
         company_events 中包含 cid 企业id, company_name 企业名称, company_event_count 该企业发生次数, tip 与查询企业的关系（1 表示股东，2 表示对外投资，3 表示分支机构, 空值表示当前查询企业）
     """
     try:
-        adapter = create_api_adapter('https://api.shuidi.cn/utn/risk/CompanyRiskInfo')
+        adapter = create_api_adapter(RISK_URL)
         return await adapter.invoke({'keyword': company_name})
     except Exception as e:
         logger.error(e)
@@ -412,8 +806,10 @@ async def get_company_investment(company_name:str) -> dict:
         FundedRatio String 出资比例
     '''
     try:
-        adapter = create_api_adapter('https://api.shuidi.cn/utn/ic/Invest/V3')
-        return await adapter.invoke({'keyword': company_name})
+        adapter = create_api_adapter(INVEST_URL)
+        response = await adapter.invoke({'keyword': company_name})
+        ownership_graph.ingest_investments(company_name, response)
+        return response
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"获取企业[{company_name}]对外投资信息失败!{e}")
@@ -444,6 +840,7 @@ async def get_company_cert(company_name:str) -> dict:
         return create_bad_resonse(f"获取企业[{company_name}]资质证书失败!{e}")
 
 @mcp.tool()
+@store_large_result
 @normalize_company('company_name')
 async def get_person_related_company(company_name:str, person_name:str) -> dict:
     """
@@ -470,41 +867,45 @@ async def get_person_related_company(company_name:str, person_name:str) -> dict:
 
 
 @mcp.tool()
+@store_large_result
 @normalize_company('company_name')
-async def get_company_controller(company_name:str) -> dict:
+async def get_company_controller(company_name:str, extra_fields: Optional[list[str]] = None) -> dict:
     """
     根据企业名称获取该企业的实控人信息,并显示控制路径
     :param company_name: 企业名称
+    :param extra_fields List 控制路径默认不返回节点id，需要时传入字段名列表，例如 ["StartNode", "EndNode"]
     :return:
     ControllerData Array<Object> 实控人数据详情,有可能是多人,每个实控人信息包括：
         AcName String 实控人名称
         IsPersonal String 0非自然人，1自然人
         VotePercent String 表决权（百分比）
         beneficiaProportion String 最终持股比例
-        Paths List<List<Object>> 控制路径,每条控制路径包括以下信息:
+        Paths List<List<Object>> 控制路径,最多返回shuidi_control_path_limit条，超过时总数见Paths_total，每条控制路径包括以下信息:
             StartName String 起始节点名称
             StartNodeType String 起始节点类型。0非自然人，1自然人
-            EndNode String 结束节点id
             EndName String 结束节点名称
             EndNodeType String  结束节点类型。0非自然人，1自然人
             Type String 关系类型。INVEST 投资关系，OWN法定代表人关系，BRANCH 分总公司
             Sequence Integer 路径序号。从0开始，依次向下穿透
             Proportion  String  持股比例（百分比）
-            StartNode String 起始节点id
     """
     try:
-        adapter = create_api_adapter('https://api.shuidi.cn/utn/pic/ActualController')
-        return await adapter.invoke({'keyword': company_name})
+        adapter = create_api_adapter(CONTROLLER_URL)
+        response = await adapter.invoke({'keyword': company_name}, extra_fields=path_extra_fields('ControllerData', extra_fields))
+        ownership_graph.ingest_paths(response, 'ControllerData')
+        return response
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"获取企业[{company_name}]的实控人信息失败!{e}")
 
 @mcp.tool()
+@store_large_result
 @normalize_company('company_name')
-async def get_company_benificalowner(company_name:str) -> dict:
+async def get_company_benificalowner(company_name:str, extra_fields: Optional[list[str]] = None) -> dict:
     """
     根据企业名称查询该企业的受益所有人信息
     :param company_name: 企业名称
+    :param extra_fields List 受益路径默认不返回节点id，需要时传入字段名列表，例如 ["StartNode", "EndNode"]
     :return:
     Total Integer 受益所有人数量
     BeneficialOwnerData List<Object> 受益所有人列表，每个受益所有人信息包括：
@@ -513,11 +914,9 @@ async def get_company_benificalowner(company_name:str) -> dict:
         StockPercent String 受益股份
         BoType String 受益类型（1直接或间接持股，3关键决策人员，4法定代表人/负责人）。同时符合多个的，中间用英文逗号隔开，如：1,3,4。
         Position String 受益人担任的职位
-        Paths List<Object> 全部受益路径，每个受益路径包括：
-            StartNode String 起始节点id
+        Paths List<Object> 受益路径，最多返回shuidi_control_path_limit条，超过时总数见Paths_total，每个受益路径包括：
             StartName String 起始节点名称
             StartNodeType String 起始节点类型。1自然人，2非自然人
-            EndNode String  结束节点
             EndName String  结束节点名称
             EndNodeType String  结束节点类型。1自然人，2非自然人
             Type    String 关系类型。 INVEST 投资关系，OWN法定代表人关系，BRANCH 分总公司
@@ -526,13 +925,356 @@ async def get_company_benificalowner(company_name:str) -> dict:
     """
     try:
         adapter = create_api_adapter('https://api.shuidi.cn/utn/pic/BeneficialOwner')
-        return await adapter.invoke({'keyword': company_name})
+        response = await adapter.invoke({'keyword': company_name}, extra_fields=path_extra_fields('BeneficialOwnerData', extra_fields))
+        ownership_graph.ingest_paths(response, 'BeneficialOwnerData')
+        return response
     except Exception as e:
         logger.error(e)
         return create_bad_resonse(f"获取企业[{company_name}]受益所有人信息失败!{e}")
 
 
-def init_logger():
+# 股权关系图查询的最大层数
+GRAPH_MAX_HOPS = int(os.getenv("shuidi_graph_max_hops", "4"))
+
+
+@mcp.tool()
+@normalize_company('company_name')
+async def query_ownership_graph(company_name: str, hops: int = 2, direction: str = 'up', max_nodes: int = 200) -> dict:
+    """
+    查询企业N层以内的股东、对外投资企业，用于股权穿透、查找关联企业等多层尽调问题，不要逐层调用股东、对外投资工具
+    股权关系缓存在服务端(含股东、对外投资、实控人、受益所有人工具查询过的关系)，只对缺失的企业逐层并发调用接口
+    :param company_name: 企业名称
+    :param hops: 层数，1为直接股东或直接对外投资，最多4层
+    :param direction: up 股东方向，down 对外投资方向，both 两个方向
+    :param max_nodes: 最多返回的节点数
+    :return:
+    statusCode int 1代表成功,2代表未找到企业
+    data.nodes List 节点，每个节点包括:
+        name String 名称
+        kind String company企业，person自然人
+        credit_code String 统一信用代码(已知时)
+        hops Number 与查询企业的层数
+    data.edges List 节点之间的关系，每条为[股东, 被投资企业, 持股比例, 关系类型(INVEST投资，OWN法定代表人，BRANCH分总公司)]
+    data.truncated Boolean 是否因节点数或接口调用次数上限未完整展开
+    data.failed List 获取失败的节点及原因
+    """
+    if direction not in DIRECTIONS:
+        return create_bad_resonse(f"不支持的方向{direction}，可选值: {','.join(DIRECTIONS)}")
+    try:
+        start, distances, failed, truncated = await ownership_graph.bfs(
+            company_name, min(max(hops, 1), GRAPH_MAX_HOPS), direction, max_nodes)
+        if len(distances) == 1 and ownership_graph.is_not_found(start):
+            return {'statusCode': 2, 'statusMessage': f'未找到企业[{company_name}]'}
+        nodes = [dict(ownership_graph.describe(key), hops=depth) for key, depth in distances.items()]
+        return {'statusCode': 1, 'data': {'nodes': nodes, 'edges': ownership_graph.edges_between(distances),
+                                          'truncated': truncated, 'failed': failed}}
+    except Exception as e:
+        logger.error(e)
+        return create_bad_resonse(f"查询企业[{company_name}]股权关系失败!{e}")
+
+
+async def shareholders_bfs(company_name: str, hops: int) -> tuple:
+    """
+    向上遍历企业的股东，关系图中未找到企业时匹配全称后重试，已缓存的简称直接使用全称
+    两家企业各自匹配，不会因一家未找到而重试另一家
+    :return (企业名称, ownership_graph.bfs的结果)
+    """
+    cached_name = get_cached_company_name(company_name)
+    if cached_name is not MISSING and cached_name:
+        company_name = cached_name
+    result = await ownership_graph.bfs(company_name, hops, max_nodes=1000)
+    start, distances = result[0], result[1]
+    if len(distances) == 1 and ownership_graph.is_not_found(start) and cached_name is MISSING:
+        n_company_name = await normalize_company_name(company_name)
+        if n_company_name and n_company_name != company_name:
+            record_normalize('find_common_shareholders', 'retry')
+            return n_company_name, await ownership_graph.bfs(n_company_name, hops, max_nodes=1000)
+        record_normalize('find_common_shareholders', 'unmatched')
+    return company_name, result
+
+
+@mcp.tool()
+async def find_common_shareholders(company_a: str, company_b: str, hops: int = 2) -> dict:
+    """
+    查找两家企业共同的直接或间接股东，用于判断两家企业是否存在关联关系
+    自然人股东按姓名匹配，同名的不同自然人会被视为同一人，请结合持股关系判断
+    :param company_a: 企业A名称
+    :param company_b: 企业B名称
+    :param hops: 向上穿透的层数，1为只比较直接股东，最多4层
+    :return:
+    statusCode int 1代表成功,2代表未找到企业
+    data.common List 共同股东，按层数之和排序，每个包括:
+        name String 名称
+        kind String company企业，person自然人
+        credit_code String 统一信用代码(已知时)
+        hops_a / hops_b Number 与企业A、B的层数
+        proportion_a / proportion_b String 直接持有企业A、B的比例，间接持股时为null
+    data.truncated Boolean 是否因节点数或接口调用次数上限未完整展开
+    data.failed List 获取失败的节点及原因
+    """
+    try:
+        hops = min(max(hops, 1), GRAPH_MAX_HOPS)
+        (company_a, (start_a, distances_a, failed_a, truncated_a)), \
+            (company_b, (start_b, distances_b, failed_b, truncated_b)) = \
+            await asyncio.gather(shareholders_bfs(company_a, hops), shareholders_bfs(company_b, hops))
+        for name, start, distances in ((company_a, start_a, distances_a), (company_b, start_b, distances_b)):
+            if len(distances) == 1 and ownership_graph.is_not_found(start):
+                return {'statusCode': 2, 'statusMessage': f'未找到企业[{name}]'}
+        holders_a = ownership_graph.holders_of(start_a)
+        holders_b = ownership_graph.holders_of(start_b)
+        common = [dict(ownership_graph.describe(key), hops_a=distances_a[key], hops_b=distances_b[key],
+                       proportion_a=holders_a[key][0] if key in holders_a else None,
+                       proportion_b=holders_b[key][0] if key in holders_b else None)
+                  for key in distances_a.keys() & distances_b.keys() if key not in (start_a, start_b)]
+        common.sort(key=lambda node: (node['hops_a'] + node['hops_b'], node['name']))
+        return {'statusCode': 1, 'data': {'common': common, 'truncated': truncated_a or truncated_b,
+                                          'failed': failed_a + failed_b}}
+    except Exception as e:
+        logger.error(e)
+        return create_bad_resonse(f"查找企业[{company_a}]与[{company_b}]的共同股东失败!{e}")
+
+
+@mcp.resource('shuidi://cache/stats', name='cache_stats', mime_type='application/json')
+def get_cache_stats() -> dict:
+    """
+    接口响应缓存的命中、未命中、淘汰等统计信息，并发请求合并情况，成立日期分桶统计、股权关系图的缓存情况及关注列表的刷新情况，用于调整缓存策略
+    """
+    stats = response_cache.stats()
+    stats['in_flight'] = in_flight_requests.stats()
+    stats['establish_buckets'] = establish_counter.stats()
+    stats['ownership_graph'] = ownership_graph.stats()
+    stats['watchlist'] = watchlist_refresher.stats()
+    return stats
+
+
+@mcp.resource('shuidi://projection/stats', name='projection_stats', mime_type='application/json')
+def get_projection_stats() -> dict:
+    """
+    各工具的响应裁剪前后的大小(抽样统计)及节省的字节数，工具之外的调用按接口路径统计
+    """
+    return projection_stats.stats()
+
+
+@mcp.resource('shuidi://limiter/stats', name='limiter_stats', mime_type='application/json')
+def get_limiter_stats() -> dict:
+    """
+    限流及自适应并发的状态：各接口当前并发上限、进行中及排队的请求数、剩余令牌数、排队超时次数
+    """
+    return rate_limiter.stats()
+
+
+@mcp.resource('shuidi://resilience/stats', name='resilience_stats', mime_type='application/json')
+def get_resilience_stats() -> dict:
+    """
+    重试、对冲请求次数及各接口熔断器状态(closed/open/half_open)、连续失败次数、p95延迟
+    """
+    return resilience.stats()
+
+
+@mcp.custom_route('/metrics', methods=['GET'])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """
+    Prometheus文本格式的指标，sse、streamable-http方式下可用
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def dump_metrics(format: str = 'json') -> dict:
+    """
+    获取服务的运行指标：各工具调用次数、返回的statusCode及耗时，各上游接口的请求次数、http状态码、响应大小，
+    缓存命中情况，企业名称匹配重试次数，及企业名称匹配、签名、上游请求、响应解析裁剪各阶段的耗时
+    :param format: json 或 prometheus(Prometheus文本格式)
+    """
+    if format == 'prometheus':
+        return {'statusCode': 1, 'data': metrics.registry.render()}
+    return {'statusCode': 1, 'data': metrics.registry.to_dict()}
+
+
+def slice_stored_result(handle: str, path: str, offset: int, limit: int) -> dict:
+    try:
+        result = result_store.slice(handle, path, offset, limit)
+    except (KeyError, IndexError, ValueError) as e:
+        return create_bad_resonse(f"路径[{path}]不存在!{e}")
+    if result is None:
+        return create_bad_resonse(f"结果[{handle}]不存在或已过期，请重新查询")
+    result['statusCode'] = 1
+    return result
+
+
+@mcp.tool()
+async def fetch_result_slice(handle: str, path: str, offset: int = 0, limit: int = 50) -> dict:
+    """
+    分页读取保存在服务端的较大查询结果，查询工具返回handle时使用
+    :param handle: 查询工具返回的句柄
+    :param path: 列表路径，取自查询工具返回的lists，以.分隔，列表使用下标，例如 data.items 、data.ControllerData.0.Paths
+    :param offset: 起始位置，默认0
+    :param limit: 返回条数，默认50
+    :return:
+    total Number 列表总长度
+    items List 本次返回的数据
+    next_offset Number 下一页的起始位置，没有更多数据时为None
+    """
+    return slice_stored_result(handle, path, offset, limit)
+
+
+@mcp.resource('shuidi://results/{handle}', name='stored_result', mime_type='application/json')
+def get_stored_result(handle: str) -> dict:
+    """
+    保存在服务端的较大查询结果的摘要：各列表路径及长度、预览
+    """
+    return result_store.summary(handle) or create_bad_resonse(f"结果[{handle}]不存在或已过期")
+
+
+@mcp.resource('shuidi://results/{handle}/{path}/{offset}/{limit}', name='stored_result_slice', mime_type='application/json')
+def get_stored_result_slice(handle: str, path: str, offset: str, limit: str) -> dict:
+    """
+    保存在服务端的较大查询结果中某个列表的一段
+    """
+    return slice_stored_result(handle, path, int(offset), int(limit))
+
+
+# 企业画像各维度对应的查询工具
+# 合并返回各工具的data，使用不保存为句柄的完整结果
+PROFILE_SECTIONS = {
+    'info': full_result(get_company_info),
+    'partner': full_result(get_company_partner),
+    'controller': full_result(get_company_controller),
+    'benificalowner': full_result(get_company_benificalowner),
+    'risk': full_result(search_company_risk),
+    'honor': full_result(get_company_honor),
+    'cert': full_result(get_company_cert),
+    'contact': full_result(get_company_contact),
+    'investment': full_result(get_company_investment),
+    'stie_score': full_result(get_stie_score),
+}
+DEFAULT_PROFILE_SECTIONS = ['info', 'partner', 'controller', 'benificalowner', 'risk', 'honor', 'cert', 'contact']
+# 单次企业画像查询的最大并发数
+PROFILE_CONCURRENCY = int(os.getenv("shuidi_profile_concurrency", "4"))
+
+
+@mcp.tool()
+async def get_company_profile(company_name: str, sections: Optional[list[str]] = None) -> dict:
+    """
+    一次性并发查询企业多个维度的信息，合并返回，代替逐个调用单项查询工具
+    :param company_name: 企业名称
+    :param sections: 需要查询的维度列表，为None时查询 info、partner、controller、benificalowner、risk、honor、cert、contact，可选值:
+        info 基础信息(同get_company_info)
+        partner 股东信息(同get_company_partner)
+        controller 实控人(同get_company_controller)
+        benificalowner 受益所有人(同get_company_benificalowner)
+        risk 风险信息(同search_company_risk)
+        honor 荣誉资质(同get_company_honor)
+        cert 资质证书(同get_company_cert)
+        contact 联系方式(同get_company_contact)
+        investment 对外投资(同get_company_investment)
+        stie_score 科创评分(同get_stie_score)
+    :return:
+    statusCode int 任一维度查询成功即为1
+    companyName String 匹配到的企业全称
+    data Object 各维度查询成功的数据，key为维度名称，内容与对应单项工具返回的data相同
+    errors Object 查询失败的维度，key为维度名称，包含statusCode及statusMessage
+    """
+    sections = list(dict.fromkeys(sections or DEFAULT_PROFILE_SECTIONS))
+    semaphore = asyncio.Semaphore(PROFILE_CONCURRENCY)
+
+    async def fetch(section):
+        # 所有维度立即并发查询，全称不需要等待名称匹配；只有返回未找到企业的维度用全称重试，
+        # 并发的模糊匹配合并为一次搜索并缓存，之后开始的维度直接使用缓存的全称
+        async with semaphore:
+            try:
+                return await PROFILE_SECTIONS[section](company_name)
+            except Exception as e:
+                logger.error(e)
+                return create_bad_resonse(f"获取企业[{company_name}]{section}信息失败!{e}")
+
+    valid_sections = [section for section in sections if section in PROFILE_SECTIONS]
+    responses = await asyncio.gather(*(fetch(section) for section in valid_sections))
+
+    data = {}
+    errors = {section: create_bad_resonse(f"不支持的查询维度{section}") for section in sections if section not in PROFILE_SECTIONS}
+    for section, response in zip(valid_sections, responses):
+        if response.get('statusCode') == 1:
+            data[section] = response.get('data')
+        else:
+            errors[section] = {'statusCode': response.get('statusCode'), 'statusMessage': response.get('statusMessage')}
+
+    n_company_name = get_cached_company_name(company_name)
+    if data:
+        status_code = 1
+    else:
+        status_code = next(iter(errors.values()))['statusCode'] if errors else 99999
+    return {
+        'statusCode': status_code,
+        'companyName': n_company_name if isinstance(n_company_name, str) else company_name,
+        'data': data,
+        'errors': errors,
+    }
+
+
+# 批量查询的最大并发数及单次最多企业数
+BATCH_CONCURRENCY = int(os.getenv("shuidi_batch_concurrency", "8"))
+BATCH_MAX_SIZE = int(os.getenv("shuidi_batch_max_size", "500"))
+
+
+@mcp.tool()
+async def batch_query_companies(company_names: list[str], section: str = 'info', ctx: Context = None) -> dict:
+    """
+    批量查询多家企业的同一类信息，适用于对几十到几百家企业做尽调、筛查
+    每完成一家企业即发送进度通知及该企业的查询结果(日志通知)，最终结果按完成顺序排列
+    :param company_names: 企业名称或统一信用代码列表，最多500个
+    :param section: 查询的信息类型，可选值同get_company_profile的sections，例如
+        info 基础信息, risk 风险信息, stie_score 科创评分, partner 股东信息, controller 实控人
+    :return:
+    statusCode int 1代表成功,其他表示失败
+    total Number 企业总数
+    succeeded Number 查询成功的企业数
+    items List 各企业的查询结果，按完成顺序排列，每条包括:
+        index Number 在输入列表中的序号
+        company_name String 输入的企业名称
+        statusCode int 1代表成功,其他表示失败
+        data Object 查询成功时的数据，与对应单项工具返回的data相同
+        statusMessage String 查询失败时的原因
+    """
+    if section not in PROFILE_SECTIONS:
+        return create_bad_resonse(f"不支持的查询类型{section}，可选值: {','.join(PROFILE_SECTIONS)}")
+    if len(company_names) > BATCH_MAX_SIZE:
+        return create_bad_resonse(f"单次最多查询{BATCH_MAX_SIZE}家企业")
+
+    tool = PROFILE_SECTIONS[section]
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch(index, company_name):
+        async with semaphore:
+            try:
+                response = await tool(company_name)
+            except Exception as e:
+                logger.error(e)
+                response = create_bad_resonse(f"获取企业[{company_name}]{section}信息失败!{e}")
+        item = {'index': index, 'company_name': company_name, 'statusCode': response.get('statusCode')}
+        if item['statusCode'] == 1:
+            item['data'] = response.get('data')
+        else:
+            item['statusMessage'] = response.get('statusMessage')
+        return item
+
+    notify = in_request(ctx)
+    total = len(company_names)
+    items = []
+    for future in asyncio.as_completed([fetch(i, name) for i, name in enumerate(company_names)]):
+        item = await future
+        items.append(item)
+        if notify:
+            await ctx.log('info', json.dumps(item, ensure_ascii=False), logger_name='batch_query_companies')
+            await ctx.report_progress(len(items), total)
+
+    succeeded = sum(1 for item in items if item['statusCode'] == 1)
+    return {'statusCode': 1, 'total': total, 'succeeded': succeeded, 'items': items}
+
+
+def init_logger(sink=sys.stdout):
+    """
+    :param sink: INFO日志的输出，stdio方式下标准输出用于MCP协议通信，应使用sys.stderr
+    """
     # 移除默认handler
     logger.remove()
 
@@ -544,15 +1286,129 @@ def init_logger():
         "<level>{message}</level>"
     )
 
+    if sink is sys.stderr:
+        logger.add(sys.stderr, format=log_format, level="INFO", enqueue=True)
+        return
     # 添加标准输出
-    logger.add(sys.stdout, format=log_format, level="INFO", enqueue=True)
+    logger.add(sink, format=log_format, level="INFO", enqueue=True)
     # 设置异常处理
     logger.add(sys.stderr, format=log_format, level="ERROR", enqueue=True)
 
 
-def main():
+# 服务方式: stdio、sse、streamable-http
+SERVER_TRANSPORT = os.getenv("shuidi_transport", "stdio")
+SERVER_HOST = os.getenv("shuidi_host", "0.0.0.0")
+SERVER_PORT = int(os.getenv("shuidi_port", "8000"))
+# sse、streamable-http的worker进程数
+SERVER_WORKERS = int(os.getenv("shuidi_workers", "1"))
+# 收到退出信号后等待处理中请求完成的最长时间(秒)
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.getenv("shuidi_graceful_shutdown_timeout", "30"))
+TRANSPORTS = ('stdio', 'sse', 'streamable-http')
+
+
+def create_app():
+    """
+    sse、streamable-http的ASGI应用工厂，每个worker进程调用一次
+    多个worker时：streamable-http使用无状态模式，任一进程都可处理同一会话的请求；
+    各进程通过磁盘缓存共享接口响应，并平分限流速率
+    """
     init_logger()
-    mcp.run(transport='stdio')
+    if SERVER_WORKERS > 1:
+        response_cache.shared = True
+        rate_limiter.partition(SERVER_WORKERS)
+        # 结果句柄保存在进程内存中，分片请求可能由其它worker处理，因此直接返回完整结果
+        result_store.enabled = False
+        if RESULT_HANDLE_THRESHOLD > 0:
+            logger.warning("多worker时不支持结果句柄，较大的结果直接完整返回")
+        if not response_cache.disk.enabled:
+            logger.warning("磁盘缓存未启用，各worker进程的缓存相互独立")
+        if watchlist_refresher.enabled:
+            if response_cache.disk.enabled:
+                # 只由持有租约的一个worker刷新，其它worker经磁盘缓存读取刷新结果
+                watchlist_refresher.shared = True
+            else:
+                logger.warning("多worker时关注列表的刷新需要磁盘缓存，已停用")
+                watchlist_refresher.path = ''
+
+    if SERVER_TRANSPORT == 'sse':
+        app = mcp.sse_app()
+    else:
+        if SERVER_WORKERS > 1:
+            mcp.settings.stateless_http = True
+        app = mcp.streamable_http_app()
+
+    transport_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def app_lifespan(app):
+        # 进程内共享一个http连接池及关注列表的刷新任务，退出时等待处理中的请求结束后关闭连接池及磁盘缓存
+        async with http_client_lifespan(), metrics.shared_metrics():
+            try:
+                # 刷新任务在关闭磁盘缓存前退出并释放租约
+                async with watchlist_lifespan(), transport_lifespan(app):
+                    yield
+            finally:
+                response_cache.disk.close()
+                tracing.exporter.close()
+                logger.info(f"worker进程{os.getpid()}已退出")
+
+    app.router.lifespan_context = app_lifespan
+    return app
+
+
+def serve(transport: str, host: str, port: int, workers: int):
+    import uvicorn
+
+    if transport == 'sse' and workers > 1:
+        # SSE的消息请求必须由建立连接的进程处理
+        logger.warning("sse不支持多个worker进程，使用单进程")
+        workers = 1
+    # worker进程重新导入本模块，通过环境变量传递配置
+    os.environ.update(shuidi_transport=transport, shuidi_workers=str(workers))
+    metrics_dir = None
+    if workers > 1 and not metrics.registry.directory:
+        # 各worker进程的指标写入同一目录，/metrics合并所有进程的指标
+        metrics_dir = os.environ['shuidi_metrics_dir'] = tempfile.mkdtemp(prefix='shuidi-metrics-')
+    global SERVER_TRANSPORT, SERVER_WORKERS
+    SERVER_TRANSPORT, SERVER_WORKERS = transport, workers
+
+    uvicorn.run('mcp_server:create_app' if workers > 1 else create_app, factory=True,
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host=host, port=port, workers=workers,
+                timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+                log_level=mcp.settings.log_level.lower())
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+async def run_stdio():
+    # 关注列表的刷新任务每个进程只启动一次，不随MCP会话的lifespan启动
+    async with http_client_lifespan(), watchlist_lifespan():
+        await mcp.run_stdio_async()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shuidi DataMcpServer')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=SERVER_TRANSPORT)
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+
+    if args.transport == 'stdio':
+        init_logger(sys.stderr)
+        # stdio方式下没有/metrics，通过工具获取指标
+        mcp.add_tool(dump_metrics)
+        if tracing.exporter.target == 'stdout':
+            # 标准输出用于MCP协议通信
+            logger.warning("stdio方式下trace不能导出到stdout，改为stderr")
+            tracing.exporter.target = 'stderr'
+        try:
+            asyncio.run(run_stdio())
+        finally:
+            tracing.exporter.close()
+    else:
+        serve(args.transport, args.host, args.port, max(args.workers, 1))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,273 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from loguru import logger
+
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("shuidi_metrics_enabled", "true").lower() in ('1', 'true', 'yes')
+# 多进程部署时各进程写入指标快照的目录，读取时合并所有进程的指标
+METRICS_DIR = os.getenv("shuidi_metrics_dir")
+METRICS_FLUSH_INTERVAL = float(os.getenv("shuidi_metrics_flush_interval", "5"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(8))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        if METRICS_ENABLED:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+    @staticmethod
+    def merge(series: dict, labels: tuple, value):
+        series[labels] = series.get(labels, 0) + value
+
+    def render(self, series: dict) -> list:
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in sorted(series.items())]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # 标签 -> [各桶计数(不累加，最后一个为+Inf), 总和, 次数]
+        self._values = {}
+
+    def observe(self, value: float, *label_values):
+        if not METRICS_ENABLED:
+            return
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def snapshot(self) -> list:
+        return [[list(labels), [list(counts), total, count]] for labels, (counts, total, count) in self._values.items()]
+
+    @staticmethod
+    def merge(series: dict, labels: tuple, value):
+        counts, total, count = value
+        entry = series.get(labels)
+        if entry is None:
+            series[labels] = [list(counts), total, count]
+        else:
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def render(self, series: dict) -> list:
+        lines = []
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, (("le", le),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {count}')
+        return lines
+
+
+class Registry:
+    """
+    进程内的指标，按Prometheus文本格式输出；设置了directory时合并各进程写入的快照
+    """
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self._metrics = {}
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid=None) -> str:
+        return os.path.join(self.directory, f'{pid or os.getpid()}.json')
+
+    def flush(self):
+        """
+        将本进程的指标写入快照文件，先写临时文件再替换，读取方不会读到写了一半的文件
+        """
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path()
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(f'{path}.tmp', path)
+
+    def _collect(self) -> dict:
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = self._snapshot_path()
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"读取指标快照[{path}]失败: {e}")
+        merged = {name: {} for name in self._metrics}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in series:
+                    metric.merge(merged[name], tuple(labels), value)
+        return merged
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._collect().items():
+            metric = self._metrics[name]
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(metric.render(series))
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> dict:
+        """
+        合并后的指标，直方图只保留次数、总和及平均值
+        """
+        result = {}
+        for name, series in self._collect().items():
+            metric = self._metrics[name]
+            items = []
+            for labels, value in sorted(series.items()):
+                item = dict(zip(metric.labels, labels))
+                if metric.type == 'histogram':
+                    _, total, count = value
+                    item.update(count=count, sum=round(total, 6), avg=round(total / count, 6) if count else 0.0)
+                else:
+                    item['value'] = value
+                items.append(item)
+            result[name] = items
+        return result
+
+
+registry = Registry()
+# 当前调用的工具名称，工具之外(如关注列表刷新)为None
+current_tool = ContextVar('shuidi_current_tool', default=None)
+
+tool_calls = registry.counter('shuidi_tool_calls_total', '工具调用次数，status为返回的statusCode', ('tool', 'status'))
+tool_duration = registry.histogram('shuidi_tool_duration_seconds', '工具调用耗时', ('tool',))
+upstream_requests = registry.counter('shuidi_upstream_requests_total', '上游接口请求次数(含重试及对冲)', ('endpoint', 'http_status'))
+upstream_bytes = registry.histogram('shuidi_upstream_response_bytes', '上游接口响应大小', ('endpoint',), BYTES_BUCKETS)
+cache_requests = registry.counter('shuidi_cache_requests_total', '接口响应缓存查询次数', ('endpoint', 'result'))
+normalize_retries = registry.counter('shuidi_normalize_retries_total',
+                                     '企业名称匹配：alias使用已缓存的全称，retry匹配到全称后重试，unmatched未匹配到，cancelled取消的投机搜索',
+                                     ('tool', 'result'))
+phase_duration = registry.histogram('shuidi_phase_duration_seconds',
+                                    '各阶段耗时：normalize企业名称匹配，sign签名，network上游请求，shaping响应解析及裁剪',
+                                    ('phase', 'endpoint'))
+
+
+def endpoint_of(url) -> str:
+    return urlsplit(url).path
+
+
+@contextmanager
+def timed(phase: str, url):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_duration.observe(time.perf_counter() - start, phase, endpoint_of(url))
+
+
+def instrument_tool(name: str):
+    """
+    记录工具的调用次数、返回的statusCode及耗时，调用期间current_tool为工具名称
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 'exception'
+            token = current_tool.set(name)
+            try:
+                response = await func(*args, **kwargs)
+                status = str(response.get('statusCode')) if hasattr(response, 'get') else 'none'
+                return response
+            finally:
+                current_tool.reset(token)
+                tool_duration.observe(time.perf_counter() - start, name)
+                tool_calls.inc(name, status)
+        return wrapper
+    return decorator
+
+
+@asynccontextmanager
+async def shared_metrics(interval=METRICS_FLUSH_INTERVAL):
+    """
+    多进程部署时定期将本进程的指标写入快照目录，退出时再写入一次
+    """
+    if not registry.directory:
+        yield
+        return
+
+    async def flush_periodically():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(registry.flush)
+            except OSError as e:
+                logger.warning(f"写入指标快照失败: {e}")
+
+    task = asyncio.create_task(flush_periodically())
+    try:
+        yield
+    finally:
+        task.cancel()
+        try:
+            registry.flush()
+        except OSError as e:
+            logger.warning(f"写入指标快照失败: {e}")
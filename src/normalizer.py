@@ -1,140 +1,94 @@
 import asyncio
+import os
 import re
 from datetime import datetime
-from typing import Optional, ClassVar, Literal
+from functools import lru_cache
+from typing import Optional, Literal
 
 from pydantic.v1 import BaseModel
 from pydantic.v1 import validator
 
+import metrics
+import tracing
 from api_tool import create_api_adapter
+from cache import DAY, MINUTE, MISSING, TTLCache
+from gazetteer import resolve_area
 
+# 企业简称->全称的缓存，未能匹配到企业的名称同样缓存(值为None)，有效期较短
+COMPANY_NAME_TTL = float(os.getenv("shuidi_company_name_ttl", str(DAY)))
+COMPANY_NAME_NEGATIVE_TTL = float(os.getenv("shuidi_company_name_negative_ttl", str(30 * MINUTE)))
+COMPANY_NAME_CACHE_SIZE = int(os.getenv("shuidi_company_name_cache_size", "10000"))
 
-class Area(BaseModel):
-    province: Optional[str] = None
-    city: Optional[str] = None
-    district: Optional[str] = None
-
-    PROVINCE_MAPPING: ClassVar[dict] = {
-        "北京": "北京",
-        "北京市": "北京",
-        "天津": "天津",
-        "天津市": "天津",
-        "河北": "河北",
-        "河北省": "河北",
-        "山西": "山西",
-        "山西省": "山西",
-        "内蒙古": "内蒙古",
-        "内蒙古自治区": "内蒙古",
-        "辽宁": "辽宁",
-        "辽宁省": "辽宁",
-        "吉林": "吉林",
-        "吉林省": "吉林",
-        "黑龙江": "黑龙江",
-        "黑龙江省": "黑龙江",
-        "上海": "上海",
-        "上海市": "上海",
-        "江苏": "江苏",
-        "江苏省": "江苏",
-        "浙江": "浙江",
-        "浙江省": "浙江",
-        "安徽": "安徽",
-        "安徽省": "安徽",
-        "福建": "福建",
-        "福建省": "福建",
-        "江西": "江西",
-        "江西省": "江西",
-        "山东": "山东",
-        "山东省": "山东",
-        "河南": "河南",
-        "河南省": "河南",
-        "湖北": "湖北",
-        "湖北省": "湖北",
-        "湖南": "湖南",
-        "湖南省": "湖南",
-        "广东": "广东",
-        "广东省": "广东",
-        "广西": "广西",
-        "广西壮族自治区": "广西",
-        "海南": "海南",
-        "海南省": "海南",
-        "重庆": "重庆",
-        "重庆市": "重庆",
-        "四川": "四川",
-        "四川省": "四川",
-        "贵州": "贵州",
-        "贵州省": "贵州",
-        "云南": "云南",
-        "云南省": "云南",
-        "西藏": "西藏",
-        "西藏自治区": "西藏",
-        "陕西": "陕西",
-        "陕西省": "陕西",
-        "甘肃": "甘肃",
-        "甘肃省": "甘肃",
-        "青海": "青海",
-        "青海省": "青海",
-        "宁夏": "宁夏",
-        "宁夏回族自治区": "宁夏",
-        "新疆": "新疆",
-        "新疆维吾尔自治区": "新疆",
-        "台湾": "台湾",
-        "台湾省": "台湾",
-        "香港": "香港",
-        "香港特别行政区": "香港",
-        "澳门": "澳门",
-        "澳门特别行政区": "澳门"
-    }
-
-    MUNICIPALITIES: ClassVar[list] = ['北京', '上海', '天津', '重庆']
-
-    @validator('province')
-    def normalize_province(cls, v) -> str:
-        return cls.PROVINCE_MAPPING.get(v, v)
-
-    @validator('city')
-    def normalize_city(cls, v, values) -> str:
-        city = v
-        province = values.get('province')
-        if province in cls.MUNICIPALITIES:
-            city = province
-            if v and city.find(v) == -1:
-                district = v
-                if not district.endswith('区'):
-                    district = f"{district}区"
-                values['district'] = district
-
-
-        if city and not city.endswith('市'):
-            city = f"{city}市"
-
-        return city
-
-    @validator('district')
-    def normalize_district(cls, v, values) -> str:
-        district = values.get('district', v)
-        return district
+company_name_cache = TTLCache(max_entries=COMPANY_NAME_CACHE_SIZE)
 
 
-class CompanyStatus(BaseModel):
+class Area:
+    """
+    地区条件，由行政区划表解析为高级搜索接口的格式，解析结果按输入缓存
+    province 省份简称，city 城市全称(直辖市为直辖市本身)，district 区县全称
+    """
+    __slots__ = ('province', 'city', 'district')
 
-    status: Optional[Literal['正常', '异常', '存续', '在营', '在业', '吊销', '注销', '迁入', '迁出', '撤销', '清算', '停业', '其他']] = None
+    def __init__(self, province: Optional[str] = None, city: Optional[str] = None, district: Optional[str] = None):
+        self.province, self.city, self.district = resolve_area(province, city, district)
 
-    @validator('status')
-    def normalize_status(cls, v) -> str:
 
-        if v in ['存续', '在营', '在业']:
-            return '存续,在业'
+COMPANY_STATUSES = ('正常', '异常', '存续', '在营', '在业', '吊销', '注销', '迁入', '迁出', '撤销', '清算', '停业', '其他')
+# 企业状态 -> 高级搜索接口的company_status条件，未列出的状态原样使用
+COMPANY_STATUS_MAPPING = {
+    '存续': '存续,在业',
+    '在营': '存续,在业',
+    '在业': '存续,在业',
+    '正常': '存续,在业,迁入,迁出',
+    '异常': '吊销,注销',
+    '其他': '撤销,清算,停业,其他',
+}
+DATE_RANGE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})?@(\d{4}-\d{2}-\d{2})?$')
+# 成立日期条件解析结果的缓存条数
+DATE_RANGE_CACHE_SIZE = int(os.getenv("shuidi_date_range_cache_size", "4096"))
 
-        if v == '正常':
-            return '存续,在业,迁入,迁出'
 
-        if v == '异常':
-            return '吊销,注销'
+@lru_cache(maxsize=None)
+def normalize_company_status(status: Optional[str]) -> Optional[str]:
+    """
+    将企业状态转换为高级搜索接口的company_status条件
+    :raise ValueError 不支持的企业状态
+    """
+    if status is None:
+        return None
+    if status not in COMPANY_STATUSES:
+        raise ValueError(f'企业状态必须为{"、".join(COMPANY_STATUSES)}之一')
+    return COMPANY_STATUS_MAPPING.get(status, status)
 
-        if v == '其他':
-            return '撤销,清算,停业,其他'
 
-        return v
+@lru_cache(maxsize=DATE_RANGE_CACHE_SIZE)
+def parse_date_range(date_range: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
+    """
+    解析 yyyy-mm-dd@yyyy-mm-dd 格式的成立日期条件，两端均可省略，每个日期只解析一次
+    :return (开始日期, 结束日期)
+    :raise ValueError 格式错误、日期无效或开始日期大于结束日期
+    """
+    if date_range is None:
+        return None, None
+    match = DATE_RANGE_PATTERN.match(date_range)
+    if not match:
+        raise ValueError('日期格式必须为 yyyy-mm-dd@yyyy-mm-dd 或其变体')
+    try:
+        start_date, end_date = (datetime.strptime(value, '%Y-%m-%d') if value else None for value in match.groups())
+    except ValueError:
+        raise ValueError('无效的日期格式') from None
+    if start_date and end_date and start_date > end_date:
+        raise ValueError('开始日期不能大于结束日期')
+    return start_date, end_date
+
+
+class CompanyStatus(BaseModel):
+
+    status: Optional[Literal[COMPANY_STATUSES]] = None
+
+    @validator('status')
+    def normalize_status(cls, v) -> str:
+        return normalize_company_status(v)
 
 
 class DateRange(BaseModel):
@@ -143,66 +97,120 @@ class DateRange(BaseModel):
 
     @validator('date_range')
     def validate_date_range(cls, v):
-        if v is None:
-            return v
-
-        # 检查基本格式
-        pattern = r'^(?:\d{4}-\d{2}-\d{2})?@(?:\d{4}-\d{2}-\d{2})?$'
-        if not re.match(pattern, v):
-            raise ValueError('日期格式必须为 yyyy-mm-dd@yyyy-mm-dd 或其变体')
-
-        start_date_str, end_date_str = v.split('@')
-
-        # 验证日期格式
-        def is_valid_date(date_str: str) -> bool:
-            if not date_str:
-                return True
-            try:
-                datetime.strptime(date_str, '%Y-%m-%d')
-                return True
-            except ValueError:
-                return False
-
-        if not is_valid_date(start_date_str) or not is_valid_date(end_date_str):
-            raise ValueError('无效的日期格式')
-
-        # 如果两个日期都存在，验证开始日期不大于结束日期
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            if start_date > end_date:
-                raise ValueError('开始日期不能大于结束日期')
-
+        parse_date_range(v)
         return v
 
     def get_date_range(self) -> tuple[Optional[datetime], Optional[datetime]]:
         """获取日期范围的辅助方法"""
-        if not self.date_range:
-            return None, None
+        return parse_date_range(self.date_range)
+
+
+# 批量规范的输入字段 -> 输出字段，与build_search_params的参数一致
+BATCH_FIELDS = {'province': 'province', 'city': 'city', 'district': 'district',
+                'company_status': 'company_status', 'establish_date': 'establishDate'}
 
-        start_str, end_str = self.date_range.split('@')
 
-        start_date = datetime.strptime(start_str, '%Y-%m-%d') if start_str else None
-        end_date = datetime.strptime(end_str, '%Y-%m-%d') if end_str else None
+def _attempt(func, *args) -> tuple:
+    try:
+        return func(*args), None
+    except (ValueError, TypeError) as e:
+        return None, str(e)
+
 
-        return start_date, end_date
+def normalize_batch(rows) -> list[dict]:
+    """
+    批量规范地区、企业状态及成立日期条件，按列去重，每个不同的输入只解析一次，解析结果同时写入单条解析的缓存
+    :param rows: 条件列表，每条为包含province、city、district、company_status、establish_date的字典，缺少的键视为None
+    :return 与输入顺序一致的列表，每条包含province、city、district、company_status、establishDate，
+            及errors(字段 -> 错误信息，没有错误时为空字典)；解析失败的字段为None，不会抛出异常
+    """
+    columns = {field: [] for field in BATCH_FIELDS}
+    type_errors = []
+    for row in rows:
+        errors = {}
+        for field, column in columns.items():
+            value = row.get(field) if isinstance(row, dict) else None
+            if value is not None and not isinstance(value, str):
+                errors[field] = f'{field}必须为字符串'
+                value = None
+            column.append(value)
+        if not isinstance(row, dict):
+            errors['row'] = '条件必须为字典'
+        type_errors.append(errors)
+
+    areas = dict.fromkeys(zip(columns['province'], columns['city'], columns['district']))
+    for key in areas:
+        areas[key] = resolve_area(*key)
+    statuses = {status: _attempt(normalize_company_status, status) for status in set(columns['company_status'])}
+    date_ranges = {date_range: _attempt(parse_date_range, date_range) for date_range in set(columns['establish_date'])}
+
+    results = []
+    for i, errors in enumerate(type_errors):
+        province, city, district = areas[columns['province'][i], columns['city'][i], columns['district'][i]]
+        company_status, status_error = statuses[columns['company_status'][i]]
+        date_range = columns['establish_date'][i]
+        _, date_error = date_ranges[date_range]
+        if status_error:
+            errors['company_status'] = status_error
+        if date_error:
+            errors['establish_date'] = date_error
+        results.append({'province': province, 'city': city, 'district': district, 'company_status': company_status,
+                        'establishDate': None if date_error else date_range, 'errors': errors})
+    return results
+
+
+def get_cached_company_name(company_name: str):
+    """
+    查询企业名称缓存
+    :return 缓存的企业全称，已确认无法匹配时返回None，未缓存时返回MISSING
+    """
+    return company_name_cache.get(company_name, MISSING)
 
 
 async def normalize_company_name(company_name: str) -> str:
     """
-    根据企业名称模糊搜索，返回匹配的第一条记录的企业名称
+    根据企业名称模糊搜索，返回匹配的第一条记录的企业名称，结果(包括未匹配)会被缓存
     :param company_name:
     :return 最匹配的企业名称
     """
+    cached = get_cached_company_name(company_name)
+    if cached is not MISSING:
+        return cached
+    n_company_name, status_code = await search_company_name(company_name)
+    cache_company_name(company_name, n_company_name, status_code)
+    return n_company_name
+
+
+def cache_company_name(company_name: str, n_company_name, status_code) -> None:
+    """
+    缓存名称匹配结果，应在确认原名查询不到企业后调用，避免把全称误缓存为其它企业的别名
+    """
+    if n_company_name:
+        company_name_cache.set(company_name, n_company_name, COMPANY_NAME_TTL)
+    elif status_code in (1, 2):
+        # 接口正常返回但没有匹配的企业，缓存未匹配结果，接口异常时不缓存
+        company_name_cache.set(company_name, None, COMPANY_NAME_NEGATIVE_TTL)
+
+
+async def search_company_name(company_name: str, speculative: bool = False) -> tuple:
+    """
+    模糊搜索企业名称，不读写名称缓存
+    :param speculative: 投机搜索，取消时同时取消上游请求(没有其它调用方等待同一搜索时)
+    :return (匹配的第一条记录的企业名称，未匹配时为None, 搜索接口的statusCode)
+    """
     url = 'https://api.shuidi.cn/utn/ic/Search/V1'
-    response = await create_api_adapter(url).invoke({'key_word': company_name})
-    if response.get('statusCode') == 1:
-        company_list = response.get('data').get('items')
-        if company_list:
-            for company in company_list:
-                n_company_name = company['company_name']
-                return n_company_name
-    return None
+    with metrics.timed('normalize', url), tracing.span('normalize_company_name', company_name=company_name) as current:
+        response = await create_api_adapter(url).invoke({'key_word': company_name}, speculative=speculative)
+        status_code = response.get('statusCode')
+        n_company_name = None
+        if status_code == 1:
+            company_list = (response.get('data') or {}).get('items')
+            if company_list:
+                n_company_name = company_list[0]['company_name']
+        if current is not None:
+            current.set_attribute('shuidi.matched_name', n_company_name or '')
+    return n_company_name, status_code
+
 
 def main():
     try:
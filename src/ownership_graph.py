@@ -0,0 +1,298 @@
+import asyncio
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from api_tool import create_api_adapter
+from cache import DAY
+from json_codec import RawJSON, loads
+
+
+load_dotenv()
+
+PARTNERS_URL = 'https://api.shuidi.cn/utn/ic/Partners/V2'
+INVEST_URL = 'https://api.shuidi.cn/utn/ic/Invest/V3'
+
+# 节点的股东、对外投资加载后的有效期(秒)，过期后查询时重新获取
+GRAPH_TTL = float(os.getenv("shuidi_graph_ttl", str(DAY)))
+# 图中最多的节点数，超过时清空
+GRAPH_MAX_NODES = int(os.getenv("shuidi_graph_max_nodes", "100000"))
+# 展开节点时查询接口的并发数，及单次查询最多展开的节点数
+GRAPH_CONCURRENCY = int(os.getenv("shuidi_graph_concurrency", "8"))
+GRAPH_MAX_EXPAND = int(os.getenv("shuidi_graph_max_expand", "200"))
+
+UP = 'up'
+DOWN = 'down'
+DIRECTIONS = (UP, DOWN, 'both')
+COMPANY = 'company'
+PERSON = 'person'
+
+CREDIT_CODE_PATTERN = re.compile(r'^[0-9A-Z]{18}$')
+
+
+class OwnershipGraph:
+    """
+    股权关系图，节点为企业或自然人，边为持股关系 股东 -> 被投资企业
+    股东、实控人接口不返回被查询企业的信用代码，因此节点以名称为key，已知的统一信用代码作为别名索引；同名自然人视为同一节点
+    节点的股东(UP)、对外投资(DOWN)记录是否已完整加载，查询时只对未加载的企业节点并发调用接口
+    """
+    def __init__(self, ttl=GRAPH_TTL, max_nodes=GRAPH_MAX_NODES, concurrency=GRAPH_CONCURRENCY):
+        self.ttl = ttl
+        self.max_nodes = max_nodes
+        self.concurrency = concurrency
+        # key -> [类型, 统一信用代码]
+        self._nodes = {}
+        # 被投资企业 -> {股东: (持股比例, 关系类型)}，股东 -> {被投资企业: (持股比例, 关系类型)}
+        self._holders = {}
+        self._holdings = {}
+        # 方向 -> {key: 过期时间}
+        self._loaded = {UP: {}, DOWN: {}}
+        # 接口返回未找到企业的名称 -> 过期时间
+        self._not_found = {}
+        self._credit_codes = {}
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.resets = 0
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def key_of(self, name_or_code: str) -> str:
+        return self._credit_codes.get(name_or_code, name_or_code)
+
+    def _node(self, name: str, kind: str = COMPANY, credit_code=None) -> str:
+        key = self.key_of(credit_code) if credit_code and credit_code in self._credit_codes else name
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = [kind, None]
+        if credit_code and CREDIT_CODE_PATTERN.match(credit_code):
+            node[1] = credit_code
+            self._credit_codes[credit_code] = key
+        return key
+
+    def add_edge(self, holder: str, target: str, proportion=None, relation='INVEST'):
+        self._holders.setdefault(target, {})[holder] = (proportion, relation)
+        self._holdings.setdefault(holder, {})[target] = (proportion, relation)
+
+    def _reset_holders(self, target: str):
+        # 重新加载股东时删除原有的股东关系，变更后的股东不与旧股东并存
+        for holder in self._holders.pop(target, {}):
+            holdings = self._holdings.get(holder)
+            if holdings is not None:
+                holdings.pop(target, None)
+                if not holdings:
+                    del self._holdings[holder]
+
+    def _reset_holdings(self, holder: str):
+        for target in self._holdings.pop(holder, {}):
+            holders = self._holders.get(target)
+            if holders is not None:
+                holders.pop(holder, None)
+                if not holders:
+                    del self._holders[target]
+
+    def _mark_loaded(self, key: str, direction: str):
+        self._loaded[direction][key] = time.monotonic() + self.ttl
+
+    def _mark_found(self, key: str, response):
+        if response.get('statusCode') == 2:
+            self._not_found[key] = time.monotonic() + self.ttl
+        else:
+            self._not_found.pop(key, None)
+
+    def is_loaded(self, key: str, direction: str) -> bool:
+        expires = self._loaded[direction].get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def is_not_found(self, key: str) -> bool:
+        expires = self._not_found.get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def _check_size(self):
+        if len(self._nodes) > self.max_nodes:
+            logger.warning(f"股权关系图节点数超过{self.max_nodes}，已清空")
+            self.clear()
+            self.resets += 1
+
+    def ingest_partners(self, company_name: str, response) -> None:
+        """
+        写入股东接口(Partners/V2)的响应，股东type为1时为自然人，替换企业原有的股东关系
+        透传的原始响应不解析(见ingest_paths)
+        """
+        if isinstance(response, RawJSON) or response.get('statusCode') not in (1, 2):
+            return
+        target = self._node(company_name)
+        self._reset_holders(target)
+        for item in (response.get('data') or {}).get('items') or []:
+            if not item.get('name'):
+                continue
+            kind = PERSON if str(item.get('type')) == '1' else COMPANY
+            holder = self._node(item['name'], kind, item.get('identifyNo') if kind == COMPANY else None)
+            self.add_edge(holder, target, item.get('stockProportion'))
+        self._mark_loaded(target, UP)
+        self._mark_found(target, response)
+        self._check_size()
+
+    def ingest_investments(self, company_name: str, response) -> None:
+        """
+        写入对外投资接口(Invest/V3)的响应，替换企业原有的对外投资关系
+        透传的原始响应不解析(见ingest_paths)
+        """
+        if isinstance(response, RawJSON) or response.get('statusCode') not in (1, 2):
+            return
+        holder = self._node(company_name)
+        self._reset_holdings(holder)
+        data = response.get('data') or {}
+        for item in data.get('Items') or data.get('items') or []:
+            if not item.get('Name'):
+                continue
+            target = self._node(item['Name'], COMPANY, item.get('CreditCode'))
+            self.add_edge(holder, target, item.get('FundedRatio'))
+        self._mark_loaded(holder, DOWN)
+        self._mark_found(holder, response)
+        self._check_size()
+
+    def ingest_paths(self, response, list_key: str) -> None:
+        """
+        写入实控人(ControllerData)、受益所有人(BeneficialOwnerData)响应中的控制路径，路径只是部分关系，不标记为已加载
+        只写入投资(Type为INVEST)的步骤，任职、分支机构等步骤不是持股关系，不作为股东边
+        透传的原始响应不解析，以免工具调用失去透传模式的意义；未写入的关系在图查询时由_fetch加载
+        """
+        if isinstance(response, RawJSON) or response.get('statusCode') != 1:
+            return
+        for entry in (response.get('data') or {}).get(list_key) or []:
+            for path in entry.get('Paths') or []:
+                for step in path if isinstance(path, list) else [path]:
+                    if not step.get('StartName') or not step.get('EndName') or (step.get('Type') or 'INVEST') != 'INVEST':
+                        continue
+                    holder = self._node(step['StartName'], PERSON if str(step.get('StartNodeType')) == '1' else COMPANY)
+                    target = self._node(step['EndName'], PERSON if str(step.get('EndNodeType')) == '1' else COMPANY)
+                    self.add_edge(holder, target, step.get('Proportion'))
+        self._check_size()
+
+    async def _fetch(self, key: str, direction: str) -> dict:
+        self.fetches += 1
+        url = PARTNERS_URL if direction == UP else INVEST_URL
+        response = await create_api_adapter(url).invoke({'keyword': key})
+        if isinstance(response, RawJSON):
+            # 图查询需要完整的关系，透传的响应在此解析；不使用RawJSON.data，以免解析结果随缓存的原始文本常驻内存
+            response = loads(str(response))
+        if direction == UP:
+            self.ingest_partners(key, response)
+        else:
+            self.ingest_investments(key, response)
+        if response.get('statusCode') not in (1, 2):
+            self.fetch_failures += 1
+        return response
+
+    async def expand(self, keys, directions, budget: list) -> list:
+        """
+        并发加载节点未加载的股东或对外投资，自然人没有可查询的股东及对外投资
+        :param budget: {'remaining': 剩余可展开的节点数, 'exhausted': 是否有节点因超过上限而未展开}，多层展开共用
+        :return 加载失败的节点 [{'name', 'direction', 'statusCode', 'statusMessage'}]，statusCode == 2表示未找到企业
+        """
+        pending = [(key, direction) for key in keys for direction in directions
+                   if self._nodes.get(key, [COMPANY])[0] == COMPANY and not self.is_loaded(key, direction)]
+        if len(pending) > budget['remaining']:
+            pending = pending[:max(budget['remaining'], 0)]
+            budget['exhausted'] = True
+        budget['remaining'] -= len(pending)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(key, direction):
+            async with semaphore:
+                try:
+                    return key, direction, await self._fetch(key, direction)
+                except Exception as e:
+                    self.fetch_failures += 1
+                    return key, direction, {'statusCode': 99999, 'statusMessage': str(e)}
+
+        failed = []
+        for key, direction, response in await asyncio.gather(*(fetch(key, direction) for key, direction in pending)):
+            if response.get('statusCode') != 1:
+                failed.append({'name': key, 'direction': direction, 'statusCode': response.get('statusCode'),
+                               'statusMessage': response.get('statusMessage')})
+        return failed
+
+    def _neighbors(self, key: str, directions) -> list:
+        neighbors = []
+        if UP in directions:
+            neighbors.extend(self._holders.get(key, ()))
+        if DOWN in directions:
+            neighbors.extend(self._holdings.get(key, ()))
+        return neighbors
+
+    async def bfs(self, name: str, hops: int, direction: str = UP, max_nodes: int = 200, max_expand=GRAPH_MAX_EXPAND):
+        """
+        广度优先遍历start起N层以内的节点，逐层并发加载缺失的边
+        :return (起点key, {key: 层数}, 加载失败的节点, 是否因节点数或展开数上限而截断)
+        """
+        directions = (UP, DOWN) if direction == 'both' else (direction,)
+        start = self.key_of(name)
+        distances = {start: 0}
+        frontier = [start]
+        failed = []
+        budget = {'remaining': max_expand, 'exhausted': False}
+        truncated = False
+        for depth in range(1, hops + 1):
+            if not frontier:
+                break
+            failed.extend(await self.expand(frontier, directions, budget))
+            truncated = truncated or budget['exhausted']
+            next_frontier = []
+            for key in frontier:
+                for neighbor in self._neighbors(key, directions):
+                    if neighbor in distances:
+                        continue
+                    if len(distances) >= max_nodes:
+                        truncated = True
+                        break
+                    distances[neighbor] = depth
+                    next_frontier.append(neighbor)
+            frontier = next_frontier
+        return start, distances, failed, truncated
+
+    def describe(self, key: str) -> dict:
+        kind, credit_code = self._nodes.get(key, (COMPANY, None))
+        node = {'name': key, 'kind': kind}
+        if credit_code:
+            node['credit_code'] = credit_code
+        return node
+
+    def edges_between(self, keys) -> list:
+        """
+        :return [[股东, 被投资企业, 持股比例, 关系类型]]
+        """
+        keys = set(keys)
+        return [[holder, target, proportion, relation]
+                for holder in keys for target, (proportion, relation) in self._holdings.get(holder, {}).items()
+                if target in keys]
+
+    def holders_of(self, key: str) -> dict:
+        return self._holders.get(key, {})
+
+    def clear(self):
+        self._nodes.clear()
+        self._holders.clear()
+        self._holdings.clear()
+        self._loaded[UP].clear()
+        self._loaded[DOWN].clear()
+        self._not_found.clear()
+        self._credit_codes.clear()
+
+    def stats(self) -> dict:
+        return {
+            'nodes': len(self._nodes),
+            'edges': sum(len(targets) for targets in self._holdings.values()),
+            'loaded_shareholders': len(self._loaded[UP]),
+            'loaded_investments': len(self._loaded[DOWN]),
+            'fetches': self.fetches,
+            'fetch_failures': self.fetch_failures,
+            'resets': self.resets,
+        }
+
+
+ownership_graph = OwnershipGraph()
@@ -0,0 +1,277 @@
+import os
+import random
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from cache import estimate_size
+from json_codec import STREAM_PARSE, stream_events
+from metrics import current_tool
+
+
+load_dotenv()
+
+# 统计节省字节数的采样比例，需要序列化响应，因此只抽样统计
+PROJECTION_STATS_SAMPLE = float(os.getenv("shuidi_projection_stats_sample", "0.1"))
+
+
+@dataclass(frozen=True)
+class Projection:
+    """
+    接口响应的字段裁剪规则，路径以.分隔，*匹配任意key，路径经过列表时作用于列表中的每个元素
+    keep   路径 -> 保留的字段，该路径下的对象(或列表中的每个对象)只保留这些字段
+    drop   删除的路径
+    limits 路径 -> 列表最多保留的条数，列表被截断时，同级增加 {key}_total 记录原始条数
+    stream 响应较大，安装ijson时边下载边解析，不保留的字段及超出条数的元素不创建对象
+    """
+    keep: dict = field(default_factory=dict)
+    drop: tuple = ()
+    limits: dict = field(default_factory=dict)
+    stream: bool = False
+
+
+class _Node:
+    __slots__ = ('children', 'keep', 'drop', 'limit')
+
+    def __init__(self):
+        self.children = {}
+        self.keep = None
+        self.drop = set()
+        self.limit = None
+
+
+def _node(root, path):
+    node = root
+    for key in path.split('.') if path else []:
+        node = node.children.setdefault(key, _Node())
+    return node
+
+
+def compile_projection(projection: Projection, extra_fields=()):
+    """
+    将裁剪规则编译为路径树，extra_fields为额外保留的字段路径，例如 data.data_list.regCapital
+    """
+    root = _Node()
+    for path, keys in projection.keep.items():
+        _node(root, path).keep = set(keys)
+    for path in projection.drop:
+        parent, _, key = path.rpartition('.')
+        _node(root, parent).drop.add(key)
+    for path, limit in projection.limits.items():
+        _node(root, path).limit = limit
+    for path in extra_fields or ():
+        parent, _, key = path.rpartition('.')
+        node = _node(root, parent)
+        if node.keep is not None:
+            node.keep.add(key)
+        node.drop.discard(key)
+    return root
+
+
+def _apply(value, node, nested=False):
+    """
+    :param nested: 列表中的列表，条数上限只作用于规则路径上的列表，不作用于其中嵌套的列表
+    """
+    if isinstance(value, list):
+        items = value if node.limit is None or nested else value[:node.limit]
+        if not (node.children or node.keep is not None or node.drop):
+            return items
+        return [_apply(item, node, True) for item in items]
+
+    if not isinstance(value, dict):
+        return value
+
+    # 只复制有规则的节点，其余子树原样引用
+    result = {}
+    wildcard = node.children.get('*')
+    for key, item in value.items():
+        if key in node.drop or (node.keep is not None and key not in node.keep):
+            continue
+        child = node.children.get(key, wildcard)
+        result[key] = item if child is None else _apply(item, child)
+        if child is not None and child.limit is not None and isinstance(item, list) and len(item) > child.limit:
+            result[f'{key}_total'] = len(item)
+    return result
+
+
+_SKIP = object()
+
+
+class StreamingProjector:
+    """
+    按裁剪规则由ijson的basic_parse事件增量构建响应，结果与_apply相同
+    不保留的字段及超出条数上限的列表元素在解析时跳过，只计数，不创建对象
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self.result = None
+        # [容器, 规则节点, 对象为当前key/列表为已读取的元素数, 列表的条数上限]
+        self._stack = []
+        # 正在跳过的容器嵌套层数
+        self._skip = 0
+
+    def _node_of_next(self):
+        """
+        下一个值适用的规则节点，None表示原样保留，_SKIP表示跳过
+        """
+        if not self._stack:
+            return self.tree
+        frame = self._stack[-1]
+        node = frame[1]
+        if isinstance(frame[0], dict):
+            if node is None:
+                return None
+            key = frame[2]
+            if key in node.drop or (node.keep is not None and key not in node.keep):
+                return _SKIP
+            return node.children.get(key, node.children.get('*'))
+        frame[2] += 1
+        if frame[3] is not None and frame[2] > frame[3]:
+            return _SKIP
+        return node
+
+    def _add(self, value):
+        if not self._stack:
+            self.result = value
+            return
+        frame = self._stack[-1]
+        if isinstance(frame[0], dict):
+            frame[0][frame[2]] = value
+        else:
+            frame[0].append(value)
+
+    def feed(self, events):
+        for event, value in events:
+            if self._skip:
+                if event == 'start_map' or event == 'start_array':
+                    self._skip += 1
+                elif event == 'end_map' or event == 'end_array':
+                    self._skip -= 1
+                continue
+            if event == 'map_key':
+                self._stack[-1][2] = value
+            elif event == 'end_map' or event == 'end_array':
+                container, node, count, limit = self._stack.pop()
+                if limit is not None and count > limit and self._stack and isinstance(self._stack[-1][0], dict):
+                    parent = self._stack[-1]
+                    parent[0][f'{parent[2]}_total'] = count
+            else:
+                node = self._node_of_next()
+                if node is _SKIP:
+                    if event == 'start_map' or event == 'start_array':
+                        self._skip = 1
+                elif event == 'start_map':
+                    container = {}
+                    self._add(container)
+                    self._stack.append([container, node, None, None])
+                elif event == 'start_array':
+                    # 与_apply相同，列表中嵌套的列表不截断
+                    nested = bool(self._stack) and isinstance(self._stack[-1][0], list)
+                    container = []
+                    self._add(container)
+                    self._stack.append([container, node, 0, None if node is None or nested else node.limit])
+                else:
+                    self._add(value)
+
+
+SEARCH_FIELDS = ['companyName', 'creditNo', 'establishDate', 'legalPerson', 'capital', 'companyStatusStr']
+RISK_EVENT_FIELDS = ['cid', 'company_name', 'company_event_count', 'tip']
+# 风险信息中每种类型保留的风险事件数，及每个事件保留的涉及企业数，截断时总数见list_data_total、company_events_total
+RISK_EVENT_LIMIT = int(os.getenv("shuidi_risk_event_limit", "50"))
+RISK_EVENT_COMPANY_LIMIT = int(os.getenv("shuidi_risk_event_company_limit", "20"))
+# 实控人、受益所有人的控制路径保留的字段(不保留节点id)，及每个实控人、受益所有人保留的路径数，截断时总数见Paths_total
+CONTROL_PATH_FIELDS = ['StartName', 'StartNodeType', 'EndName', 'EndNodeType', 'Type', 'Sequence', 'Proportion']
+CONTROL_PATH_LIMIT = int(os.getenv("shuidi_control_path_limit", "20"))
+
+# 各接口的裁剪规则，按接口路径配置，未配置的接口原样返回
+PROJECTIONS = {
+    # 控制响应大小，只保留接口返回的必要数据，删除多余的status,与其他api接口统一返回格式
+    '/utn/action/search/SeniorSearch': Projection(keep={'data.data_list': SEARCH_FIELDS}, drop=('status',)),
+    '/utn/risk/CompanyRiskInfo': Projection(keep={'data.*.list_data.company_events': RISK_EVENT_FIELDS},
+                                            limits={'data.*.list_data': RISK_EVENT_LIMIT,
+                                                    'data.*.list_data.company_events': RISK_EVENT_COMPANY_LIMIT},
+                                            stream=True),
+    '/utn/pic/ActualController': Projection(keep={'data.ControllerData.Paths': CONTROL_PATH_FIELDS},
+                                            limits={'data.ControllerData.Paths': CONTROL_PATH_LIMIT}),
+    '/utn/pic/BeneficialOwner': Projection(keep={'data.BeneficialOwnerData.Paths': CONTROL_PATH_FIELDS},
+                                           limits={'data.BeneficialOwnerData.Paths': CONTROL_PATH_LIMIT}),
+}
+
+_compiled = {}
+
+
+class ProjectionStats:
+    """
+    按调用的工具抽样统计裁剪前后的响应大小，工具之外的调用(如关注列表刷新)按接口路径统计
+    """
+    def __init__(self, sample=PROJECTION_STATS_SAMPLE):
+        self.sample = sample
+        self._stats = defaultdict(lambda: {'calls': 0, 'sampled': 0, 'raw_bytes': 0, 'projected_bytes': 0})
+
+    def record(self, endpoint, raw, projected, raw_bytes=None):
+        """
+        :param raw_bytes: 流式解析时没有完整的原始响应，使用读取的字节数
+        """
+        stats = self._stats[current_tool.get() or endpoint]
+        stats['calls'] += 1
+        if self.sample > 0 and random.random() < self.sample:
+            stats['sampled'] += 1
+            stats['raw_bytes'] += estimate_size(raw) if raw_bytes is None else raw_bytes
+            stats['projected_bytes'] += estimate_size(projected)
+
+    def stats(self) -> dict:
+        report = {}
+        for name, stats in self._stats.items():
+            saved = stats['raw_bytes'] - stats['projected_bytes']
+            report[name] = dict(stats, saved_bytes=saved,
+                                    saved_ratio=round(saved / stats['raw_bytes'], 4) if stats['raw_bytes'] else 0.0)
+        return report
+
+
+projection_stats = ProjectionStats()
+
+
+def has_projection(url) -> bool:
+    return urlsplit(url).path in PROJECTIONS
+
+
+def has_stream_projection(url) -> bool:
+    projection = PROJECTIONS.get(urlsplit(url).path)
+    return STREAM_PARSE and projection is not None and projection.stream
+
+
+def _tree(endpoint, projection, extra_fields=None):
+    if extra_fields:
+        return compile_projection(projection, extra_fields)
+    tree = _compiled.get(endpoint)
+    if tree is None:
+        tree = _compiled[endpoint] = compile_projection(projection)
+    return tree
+
+
+def project(url, response, extra_fields=None):
+    """
+    按接口的裁剪规则处理响应，未配置规则的接口原样返回
+    """
+    endpoint = urlsplit(url).path
+    projection = PROJECTIONS.get(endpoint)
+    if projection is None or not isinstance(response, dict):
+        return response
+    projected = _apply(response, _tree(endpoint, projection, extra_fields))
+    projection_stats.record(endpoint, response, projected)
+    return projected
+
+
+async def project_stream(url, chunks, extra_fields=None):
+    """
+    边读取响应正文边按裁剪规则构建响应，只用于has_stream_projection的接口
+    :param chunks: 响应正文的异步字节块
+    :return (裁剪后的响应, 读取的字节数)
+    """
+    endpoint = urlsplit(url).path
+    projector = StreamingProjector(_tree(endpoint, PROJECTIONS[endpoint], extra_fields))
+    size = await stream_events(chunks, projector.feed)
+    projection_stats.record(endpoint, None, projector.result, raw_bytes=size)
+    return projector.result, size
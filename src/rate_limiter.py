@@ -0,0 +1,242 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from httpx import TimeoutException, TransportError
+
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("shuidi_rate_limit_enabled", "true").lower() in ('1', 'true', 'yes')
+# 全局及单接口的令牌桶：每秒请求数及突发容量
+GLOBAL_RATE = float(os.getenv("shuidi_rate_limit_global_rate", "50"))
+GLOBAL_BURST = float(os.getenv("shuidi_rate_limit_global_burst", "100"))
+ENDPOINT_RATE = float(os.getenv("shuidi_rate_limit_endpoint_rate", "20"))
+ENDPOINT_BURST = float(os.getenv("shuidi_rate_limit_endpoint_burst", "40"))
+# 单接口自适应并发数的初始值及上下限
+CONCURRENCY_INITIAL = int(os.getenv("shuidi_concurrency_initial", "8"))
+CONCURRENCY_MIN = int(os.getenv("shuidi_concurrency_min", "1"))
+CONCURRENCY_MAX = int(os.getenv("shuidi_concurrency_max", "64"))
+# 延迟超过基线的倍数时视为过载
+LATENCY_TOLERANCE = float(os.getenv("shuidi_concurrency_latency_tolerance", "2.0"))
+# 排队等待的最长时间(秒)，超时后调用失败
+QUEUE_TIMEOUT = float(os.getenv("shuidi_rate_limit_queue_timeout", "30"))
+
+# 上游过载时返回的http状态码
+OVERLOAD_HTTP_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    令牌桶，等待的调用方按到达顺序依次获取令牌
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: float):
+        """
+        :param deadline: 进入排队时计算的截止时间，等待锁及等待令牌补充共用
+        """
+        try:
+            async with asyncio.timeout(max(deadline - time.monotonic(), 0)):
+                async with self._lock:
+                    while True:
+                        self._refill()
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            return
+                        wait = (1 - self.tokens) / self.rate
+                        if time.monotonic() + wait > deadline:
+                            raise RateLimitTimeout('等待限流令牌超时')
+                        await asyncio.sleep(wait)
+        except TimeoutError:
+            raise RateLimitTimeout('等待限流令牌超时')
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD自适应并发上限：请求正常时每个请求增加 1/limit ，过载(错误或延迟超过基线的倍数)时减半
+    延迟基线为正常请求延迟的指数移动平均
+    """
+    def __init__(self, initial=CONCURRENCY_INITIAL, min_limit=CONCURRENCY_MIN, max_limit=CONCURRENCY_MAX,
+                 latency_tolerance=LATENCY_TOLERANCE, backoff=0.5, alpha=0.05):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.alpha = alpha
+        self.baseline = None
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, deadline: float):
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        # 按到达顺序排队，释放时由释放方直接把额度交给队首的等待者
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(deadline - time.monotonic(), 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # 超时或取消前释放方可能已把额度交给本等待者(in_flight已增加)，需要归还，否则额度永久减少
+            if waiter.done() and not waiter.cancelled():
+                self.release(0, False, adjust=False)
+            if isinstance(e, asyncio.TimeoutError):
+                raise RateLimitTimeout('等待并发额度超时')
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self, latency: float, overloaded: bool, adjust: bool = True):
+        self.in_flight -= 1
+        if adjust:
+            self._adjust(latency, overloaded)
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adjust(self, latency: float, overloaded: bool):
+        if not overloaded and self.baseline is not None and latency > self.baseline * self.latency_tolerance:
+            overloaded = True
+        now = time.monotonic()
+        if overloaded:
+            # 同一批并发请求同时过载时只减一次
+            if now - self._last_decrease > latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.baseline = latency if self.baseline is None else (1 - self.alpha) * self.baseline + self.alpha * latency
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'latency_baseline': round(self.baseline, 4) if self.baseline is not None else None,
+        }
+
+
+class Permit:
+    def __init__(self):
+        self.overloaded = False
+
+    def record(self, http_status: int):
+        if http_status in OVERLOAD_HTTP_STATUS:
+            self.overloaded = True
+
+
+class RateLimiter:
+    """
+    上游接口的准入控制：全局令牌桶 + 单接口令牌桶 + 单接口自适应并发上限，超出时排队等待
+    """
+    def __init__(self, enabled=RATE_LIMIT_ENABLED, queue_timeout=QUEUE_TIMEOUT):
+        self.enabled = enabled
+        self.queue_timeout = queue_timeout
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.endpoint_rate = ENDPOINT_RATE
+        self.endpoint_burst = ENDPOINT_BURST
+        self._buckets = {}
+        self._concurrency = {}
+        self.timeouts = 0
+
+    def _endpoint(self, url):
+        endpoint = urlsplit(url).path
+        if endpoint not in self._buckets:
+            self._buckets[endpoint] = TokenBucket(self.endpoint_rate, self.endpoint_burst)
+            self._concurrency[endpoint] = AdaptiveConcurrency()
+        return self._buckets[endpoint], self._concurrency[endpoint]
+
+    def partition(self, workers: int):
+        """
+        多进程部署时各进程平分令牌桶的速率及容量，总的上游请求速率不随进程数增加
+        """
+        workers = max(workers, 1)
+        for bucket in (self.global_bucket, *self._buckets.values()):
+            bucket.rate /= workers
+            bucket.burst = max(bucket.burst / workers, 1)
+            bucket.tokens = min(bucket.tokens, bucket.burst)
+        self.endpoint_rate /= workers
+        self.endpoint_burst = max(self.endpoint_burst / workers, 1)
+
+    @asynccontextmanager
+    async def slot(self, url, timeout=None):
+        """
+        获取一次请求的准入许可，请求完成后通过许可记录上游状态，用于调整并发上限
+        """
+        permit = Permit()
+        if not self.enabled:
+            yield permit
+            return
+
+        bucket, concurrency = self._endpoint(url)
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        try:
+            await concurrency.acquire(deadline)
+        except RateLimitTimeout:
+            self.timeouts += 1
+            raise
+        try:
+            await self.global_bucket.acquire(deadline)
+            await bucket.acquire(deadline)
+        except BaseException as e:
+            if isinstance(e, RateLimitTimeout):
+                self.timeouts += 1
+            concurrency.release(0, False, adjust=False)
+            raise
+
+        start = time.monotonic()
+        completed = False
+        try:
+            yield permit
+            completed = True
+        except (TimeoutException, TransportError):
+            permit.overloaded = True
+            completed = True
+            raise
+        finally:
+            # 调用被取消或出现其它异常时不调整并发上限
+            concurrency.release(time.monotonic() - start, permit.overloaded, adjust=completed)
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'timeouts': self.timeouts,
+            'global_tokens': round(self.global_bucket.tokens, 2),
+            'endpoints': {endpoint: dict(concurrency.stats(), tokens=round(self._buckets[endpoint].tokens, 2))
+                          for endpoint, concurrency in self._concurrency.items()},
+        }
+
+
+rate_limiter = RateLimiter()
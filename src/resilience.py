@@ -0,0 +1,226 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from httpx import TimeoutException, TransportError
+from loguru import logger
+
+import tracing
+
+
+load_dotenv()
+
+# 重试：最多尝试次数(含首次)及指数退避的基础/最大等待时间(秒)，等待时间在[0, 退避时间]内随机
+RETRY_MAX_ATTEMPTS = int(os.getenv("shuidi_retry_max_attempts", "3"))
+RETRY_BASE_DELAY = float(os.getenv("shuidi_retry_base_delay", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("shuidi_retry_max_delay", "5"))
+# 对冲请求：请求耗时超过该接口历史延迟的分位数后，再发一个相同请求，取先返回的结果
+HEDGE_ENABLED = os.getenv("shuidi_hedge_enabled", "false").lower() in ('1', 'true', 'yes')
+HEDGE_QUANTILE = float(os.getenv("shuidi_hedge_quantile", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("shuidi_hedge_min_delay", "0.05"))
+# 延迟样本数不足时不发对冲请求
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+# 熔断：连续失败次数达到阈值后熔断，经过reset_timeout(秒)后进入半开状态放行少量探测请求
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("shuidi_breaker_failure_threshold", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("shuidi_breaker_reset_timeout", "30"))
+BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("shuidi_breaker_half_open_max_calls", "1"))
+
+
+class UpstreamHTTPError(Exception):
+    """
+    上游返回429或5xx
+    """
+    def __init__(self, status_code: int):
+        super().__init__(f'上游接口返回http状态码{status_code}')
+        self.status_code = status_code
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+RETRYABLE_ERRORS = (TimeoutException, TransportError, UpstreamHTTPError)
+
+
+def backoff_delay(attempt: int, base=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY) -> float:
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """
+    记录最近的请求耗时，用于计算对冲请求的等待时间
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def quantile(self, q: float):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 half_open_max_calls=BREAKER_HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.rejected = 0
+        self.transitions = 0
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning(f"接口[{self.name}]熔断器状态 {self.state} -> {state}")
+            self.state = state
+            self.transitions += 1
+
+    def before_call(self):
+        """
+        熔断状态下直接失败，超过reset_timeout后进入半开状态，只放行有限的探测请求
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f'接口[{self.name}]已熔断，请稍后重试')
+            self._transition(self.HALF_OPEN)
+            self.half_open_calls = 0
+        if self.state == self.HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError(f'接口[{self.name}]熔断恢复中，请稍后重试')
+            self.half_open_calls += 1
+
+    def on_success(self):
+        self.failures = 0
+        self._transition(self.CLOSED)
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'transitions': self.transitions,
+        }
+
+
+class Resilience:
+    """
+    上游请求的容错策略：按接口熔断、可重试错误的带抖动指数退避重试、可选的对冲请求
+    """
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, hedge_enabled=HEDGE_ENABLED, hedge_quantile=HEDGE_QUANTILE):
+        self.max_attempts = max(max_attempts, 1)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self._breakers = {}
+        self._latencies = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _endpoint(self, url):
+        endpoint = urlsplit(url).path
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker(endpoint)
+            self._latencies[endpoint] = LatencyTracker()
+        return self._breakers[endpoint], self._latencies[endpoint]
+
+    async def call(self, url, send):
+        """
+        :param send: 发送一次请求的协程函数，每次重试或对冲都会重新调用(重新签名)
+        """
+        breaker, latencies = self._endpoint(url)
+        for attempt in range(self.max_attempts):
+            breaker.before_call()
+            try:
+                response = await self._send(send, latencies)
+            except RETRYABLE_ERRORS as e:
+                breaker.on_failure()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                self.retries += 1
+                tracing.set_attribute('shuidi.retries', attempt + 1)
+                delay = backoff_delay(attempt)
+                logger.warning(f"请求[{url}]失败，{delay:.2f}秒后第{attempt + 1}次重试: {e!r}")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # 取消等其它异常不计入熔断统计，释放半开状态的探测名额
+                if breaker.state == breaker.HALF_OPEN:
+                    breaker.half_open_calls = max(breaker.half_open_calls - 1, 0)
+                raise
+            else:
+                breaker.on_success()
+                return response
+
+    def record_latency(self, url, latency: float):
+        """
+        记录一次上游请求的网络耗时(不含排队时间)
+        """
+        self._endpoint(url)[1].record(latency)
+
+    async def _send(self, send, latencies):
+        delay = None
+        if self.hedge_enabled and len(latencies) >= HEDGE_MIN_SAMPLES:
+            delay = max(latencies.quantile(self.hedge_quantile), HEDGE_MIN_DELAY)
+        if delay is None:
+            return await send()
+
+        primary = asyncio.ensure_future(send())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                tasks.add(asyncio.ensure_future(send()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'endpoints': {endpoint: dict(breaker.stats(),
+                                         p95_latency=self._latencies[endpoint].quantile(0.95))
+                          for endpoint, breaker in self._breakers.items()},
+        }
+
+
+resilience = Resilience()
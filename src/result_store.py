@@ -0,0 +1,119 @@
+import os
+import uuid
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from cache import MINUTE, TTLCache
+
+
+load_dotenv()
+
+# 结果超过该大小(按JSON估算的字节数)时保存在服务端，只返回摘要及句柄，0表示不启用
+RESULT_HANDLE_THRESHOLD = int(os.getenv("shuidi_result_handle_threshold", "0"))
+RESULT_TTL = float(os.getenv("shuidi_result_ttl", str(30 * MINUTE)))
+RESULT_STORE_MAX_BYTES = int(os.getenv("shuidi_result_store_max_bytes", str(64 * 1024 * 1024)))
+# 摘要中每个列表保留的条数
+PREVIEW_ITEMS = 3
+# 摘要统计列表时的最大嵌套深度
+SUMMARY_MAX_DEPTH = 4
+
+
+def resolve_path(value, path: str):
+    """
+    按路径取值，路径以.分隔，列表使用下标，例如 data.ControllerData.0.Paths
+    """
+    if not path:
+        return value
+    for key in path.split('.'):
+        if isinstance(value, list):
+            value = value[int(key)]
+        elif isinstance(value, dict):
+            value = value[key]
+        else:
+            raise KeyError(path)
+    return value
+
+
+def list_paths(value, prefix='', depth=0, paths=None) -> dict:
+    """
+    统计结果中所有列表的路径及长度，列表中的元素只展开第一个
+    """
+    paths = {} if paths is None else paths
+    if depth > SUMMARY_MAX_DEPTH:
+        return paths
+    if isinstance(value, dict):
+        for key, item in value.items():
+            list_paths(item, f'{prefix}.{key}' if prefix else str(key), depth + 1, paths)
+    elif isinstance(value, list):
+        paths[prefix] = len(value)
+        if value:
+            list_paths(value[0], f'{prefix}.0', depth + 1, paths)
+    return paths
+
+
+def preview(value, items=PREVIEW_ITEMS):
+    if isinstance(value, dict):
+        return {key: preview(item, items) for key, item in value.items()}
+    if isinstance(value, list):
+        return [preview(item, items) for item in value[:items]]
+    return value
+
+
+class ResultStore:
+    """
+    保存较大的查询结果，按句柄分片读取，超过有效期或容量上限后淘汰
+    """
+    def __init__(self, ttl=RESULT_TTL, max_bytes=RESULT_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # 句柄只在本进程内有效，多worker的无状态模式下后续请求可能由其它进程处理，此时停用
+        self.enabled = True
+        self._results = TTLCache(max_bytes=max_bytes)
+
+    def put(self, result, size) -> Optional[str]:
+        """
+        :return 句柄，未启用或结果超过容量上限而无法保存时返回None，调用方应直接返回完整结果
+        """
+        if not self.enabled or size > self.max_bytes:
+            return None
+        handle = uuid.uuid4().hex
+        self._results.set(handle, result, self.ttl, size=size)
+        return handle
+
+    def get(self, handle):
+        return self._results.get(handle)
+
+    def summary(self, handle) -> dict:
+        result = self.get(handle)
+        if result is None:
+            return None
+        return {'handle': handle, 'lists': list_paths(result), 'preview': preview(result)}
+
+    def slice(self, handle, path: str, offset: int = 0, limit: int = 50) -> dict:
+        """
+        读取结果中path处的列表的[offset, offset + limit)部分，path不是列表时返回该处的值
+        """
+        result = self.get(handle)
+        if result is None:
+            return None
+        value = resolve_path(result, path)
+        if not isinstance(value, list):
+            return {'handle': handle, 'path': path, 'value': value}
+        offset = max(offset, 0)
+        items = value[offset:offset + max(limit, 0)]
+        next_offset = offset + len(items)
+        return {
+            'handle': handle,
+            'path': path,
+            'total': len(value),
+            'offset': offset,
+            'items': items,
+            'next_offset': next_offset if next_offset < len(value) else None,
+        }
+
+    def stats(self) -> dict:
+        return self._results.stats()
+
+
+result_store = ResultStore()
@@ -0,0 +1,59 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    合并相同key的并发调用：同一时刻只执行一次，其余调用方等待同一个结果，异常同样会传递给所有调用方
+    某个调用方被取消时不会取消共享的调用，其余调用方仍可拿到结果
+    """
+    def __init__(self):
+        self._calls = {}
+        # key -> [等待中的调用方数, 所有调用方取消后是否取消共享的调用]
+        self._waiters = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, cancel_abandoned=False):
+        """
+        :param cancel_abandoned: 新发起的调用在所有调用方都取消后随之取消，用于结果可能不再需要的投机调用；
+                                 加入已有调用时沿用发起方的设置
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = waiters = [0, cancel_abandoned]
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.calls += 1
+        else:
+            waiters = self._waiters[key]
+            self.coalesced += 1
+        waiters[0] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waiters[0] -= 1
+            if waiters[0] == 0 and waiters[1] and not task.done():
+                # 取消要到下一轮事件循环才生效，先移除，之后的调用方发起新的调用，而不是等到取消
+                self._forget(key, task)
+                task.cancel()
+                self.abandoned += 1
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+
+    def _done(self, key, task):
+        self._forget(key, task)
+        # 所有调用方都已取消时，避免出现 "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'calls': self.calls, 'coalesced': self.coalesced,
+                'abandoned': self.abandoned}
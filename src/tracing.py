@@ -0,0 +1,204 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from dotenv import load_dotenv
+from loguru import logger
+
+
+load_dotenv()
+
+# 导出方式：为空不启用，stdout、stderr 或文件路径，每条trace以一行OTLP/JSON(ExportTraceServiceRequest)写入
+TRACE_EXPORTER = os.getenv("shuidi_trace_exporter", "")
+# 按trace采样的比例，未采样的调用不创建span
+TRACE_SAMPLE_RATE = float(os.getenv("shuidi_trace_sample_rate", "1.0"))
+# 只导出耗时不低于该值(毫秒)的trace
+TRACE_MIN_DURATION_MS = float(os.getenv("shuidi_trace_min_duration_ms", "0"))
+TRACE_SERVICE_NAME = os.getenv("shuidi_trace_service_name", "shuidi-mcp-server")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# 未采样的trace，其下的span都不记录
+_NOT_SAMPLED = object()
+_current_span = ContextVar('shuidi_current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_span_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'status',
+                 'message')
+
+    def __init__(self, trace, name, parent_span_id, kind, attributes):
+        self.trace = trace
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = STATUS_OK
+        self.message = ''
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.message} if self.message else {'code': self.status},
+        }
+        if self.parent_span_id:
+            span['parentSpanId'] = self.parent_span_id
+        return span
+
+
+class _Trace:
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self):
+        self.trace_id = f'{random.getrandbits(128):032x}'
+        self.spans = []
+
+
+def _otlp_attribute(key, value) -> dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class TraceExporter:
+    """
+    将完成的trace以OTLP/JSON格式逐行写入文件或标准输出，可由OpenTelemetry Collector的otlpjsonfile接收器读取
+    """
+    def __init__(self, target=TRACE_EXPORTER, min_duration_ms=TRACE_MIN_DURATION_MS, service_name=TRACE_SERVICE_NAME):
+        self.target = target
+        self.min_duration_ms = min_duration_ms
+        self.resource = {'attributes': [_otlp_attribute('service.name', service_name),
+                                        _otlp_attribute('process.pid', os.getpid())]}
+        self.exported = 0
+        self.dropped = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.target)
+
+    def _stream(self):
+        if self.target == 'stdout':
+            return sys.stdout
+        if self.target == 'stderr':
+            return sys.stderr
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.target)), exist_ok=True)
+            self._file = open(self.target, 'a', encoding='utf-8')
+        return self._file
+
+    def export(self, root: Span):
+        if (root.end_ns - root.start_ns) / 1e6 < self.min_duration_ms:
+            self.dropped += 1
+            return
+        request = {'resourceSpans': [{
+            'resource': self.resource,
+            'scopeSpans': [{'scope': {'name': 'shuidi'}, 'spans': [span.to_otlp() for span in root.trace.spans]}],
+        }]}
+        line = json.dumps(request, ensure_ascii=False, separators=(',', ':')) + '\n'
+        try:
+            with self._lock:
+                stream = self._stream()
+                stream.write(line)
+                stream.flush()
+            self.exported += 1
+        except OSError as e:
+            logger.warning(f"导出trace失败，已停用: {e}")
+            self.target = ''
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+exporter = TraceExporter()
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """
+    在当前trace下创建span，当前没有trace时按采样比例创建新的trace
+    并发的子任务会复制创建时的上下文，其中的span自动成为当前span的子span
+    :return 未启用或未采样时返回None
+    """
+    parent = _current_span.get()
+    if parent is _NOT_SAMPLED or (parent is None and not exporter.enabled):
+        yield None
+        return
+    if parent is None and random.random() >= TRACE_SAMPLE_RATE:
+        token = _current_span.set(_NOT_SAMPLED)
+        try:
+            yield None
+        finally:
+            _current_span.reset(token)
+        return
+
+    current = Span(parent.trace if parent else _Trace(), name, parent.span_id if parent else None, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = STATUS_ERROR
+        current.message = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        current.trace.spans.append(current)
+        if parent is None:
+            exporter.export(current)
+
+
+def set_attribute(key, value):
+    """
+    设置当前span的属性，未采样时忽略
+    """
+    current = _current_span.get()
+    if current is not None and current is not _NOT_SAMPLED:
+        current.set_attribute(key, value)
+
+
+def traced(name: str, kind: int = SPAN_KIND_INTERNAL):
+    """
+    异步函数的span，返回值包含statusCode时记录为属性
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, kind) as current:
+                response = await func(*args, **kwargs)
+                if current is not None and hasattr(response, 'get'):
+                    current.set_attribute('shuidi.status_code', str(response.get('statusCode')))
+                return response
+        return wrapper
+    return decorator
@@ -0,0 +1,262 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager, suppress
+
+from dotenv import load_dotenv
+from loguru import logger
+
+import tracing
+from api_tool import create_api_adapter
+from cache import MINUTE, response_cache
+from normalizer import normalize_company_name
+
+
+load_dotenv()
+
+RISK_URL = 'https://api.shuidi.cn/utn/risk/CompanyRiskInfo'
+BASE_URL = 'http://api.shuidi.cn/utn/ic/Base/V1'
+CONTROLLER_URL = 'https://api.shuidi.cn/utn/pic/ActualController'
+# 可预热的工具 -> 工具调用的接口，参数均为keyword
+WATCH_TARGETS = {
+    'search_company_risk': RISK_URL,
+    'get_company_info': BASE_URL,
+    'get_company_controller': CONTROLLER_URL,
+}
+
+# 关注的企业列表文件，每行一个企业名称，空行及#开头的行忽略，文件修改后自动重新读取；为空时不启用
+WATCHLIST_PATH = os.getenv("shuidi_watchlist_path", "")
+# 预热的工具，逗号分隔
+WATCHLIST_TOOLS = [tool.strip() for tool in os.getenv("shuidi_watchlist_tools", ','.join(WATCH_TARGETS)).split(',')
+                   if tool.strip()]
+# 缓存剩余有效期小于 refresh_ahead + [0, jitter]内的随机值(秒) 时刷新，随机值使同时写入的缓存分散刷新
+WATCHLIST_REFRESH_AHEAD = float(os.getenv("shuidi_watchlist_refresh_ahead", str(5 * MINUTE)))
+WATCHLIST_JITTER = float(os.getenv("shuidi_watchlist_jitter", "60"))
+# 检查缓存剩余有效期的间隔(秒)，应小于refresh_ahead
+WATCHLIST_INTERVAL = float(os.getenv("shuidi_watchlist_interval", "30"))
+WATCHLIST_CONCURRENCY = int(os.getenv("shuidi_watchlist_concurrency", "4"))
+# 刷新失败或未找到企业时，再次尝试的间隔(秒)
+WATCHLIST_RETRY_DELAY = float(os.getenv("shuidi_watchlist_retry_delay", str(10 * MINUTE)))
+# 多worker时由持有磁盘缓存中租约的一个worker刷新，租约有效期(秒)，持有者退出后其它worker在过期后接替
+WATCHLIST_LEASE_TTL = float(os.getenv("shuidi_watchlist_lease_ttl", "120"))
+WATCHLIST_LEASE = 'watchlist'
+
+
+class WatchlistRefresher:
+    """
+    关注列表的提前刷新：在服务的事件循环中定期检查关注企业的缓存，在过期前重新请求并写入缓存，
+    使交互查询始终命中缓存；刷新与交互查询使用相同的接口地址及参数，缓存key相同
+    内存缓存过期或即将过期时先从磁盘缓存加载，磁盘缓存也即将过期时才请求接口
+    shared为True时(多worker)，只有持有磁盘缓存中租约的进程刷新，刷新结果经磁盘缓存供其它进程使用
+    """
+    def __init__(self, path=WATCHLIST_PATH, tools=WATCHLIST_TOOLS, refresh_ahead=WATCHLIST_REFRESH_AHEAD,
+                 jitter=WATCHLIST_JITTER, interval=WATCHLIST_INTERVAL, concurrency=WATCHLIST_CONCURRENCY,
+                 retry_delay=WATCHLIST_RETRY_DELAY):
+        self.path = path
+        unknown = [tool for tool in tools if tool not in WATCH_TARGETS]
+        if unknown:
+            logger.warning(f"关注列表不支持预热工具{','.join(unknown)}，可选值: {','.join(WATCH_TARGETS)}")
+        self.adapters = {WATCH_TARGETS[tool]: create_api_adapter(WATCH_TARGETS[tool])
+                         for tool in tools if tool in WATCH_TARGETS}
+        self.refresh_ahead = refresh_ahead
+        self.jitter = jitter
+        self.interval = interval
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self.shared = False
+        self.lease_ttl = WATCHLIST_LEASE_TTL
+        self._owner = f'{os.getpid()}-{uuid.uuid4().hex}'
+        self._lease_expires = 0.0
+        self.names = []
+        self._mtime = None
+        # 企业名称 -> 接口返回未找到时匹配的全称
+        self._resolved = {}
+        # (企业名称, 接口地址) -> 不早于该时间再次尝试
+        self._retry_at = {}
+        # (企业名称, 接口地址) -> 最近一次刷新写入的缓存的过期时间，用于发现过期前被淘汰的缓存
+        self._expires = {}
+        self.refreshes = 0
+        self.disk_reloads = 0
+        self.failures = 0
+        self.evictions = 0
+        self.scans = 0
+        self.last_scan_seconds = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and bool(self.adapters) and response_cache.enabled
+
+    def load(self) -> bool:
+        """
+        文件有修改时重新读取关注列表
+        :return 是否重新读取
+        """
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return False
+        with open(self.path, encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+        self.names = list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+        self._mtime = mtime
+        watched = set(self.names)
+        self._resolved = {name: resolved for name, resolved in self._resolved.items() if name in watched}
+        self._retry_at = {entry: at for entry, at in self._retry_at.items() if entry[0] in watched}
+        self._expires = {entry: at for entry, at in self._expires.items() if entry[0] in watched}
+        logger.info(f"关注列表已加载{len(self.names)}家企业")
+        return True
+
+    def _cache_key(self, name: str, url: str) -> str:
+        return response_cache.make_key(self.adapters[url].url, {'keyword': self._resolved.get(name) or name})
+
+    async def due(self) -> list:
+        """
+        :return 需要刷新的[(企业名称, 接口地址)]：内存及磁盘缓存都不存在或剩余有效期小于提前量
+        """
+        now = time.monotonic()
+        entries = []
+        for url in self.adapters:
+            ttl = response_cache.policy(url).ttl
+            for name in self.names:
+                entry = (name, url)
+                if self._retry_at.get(entry, 0) > now:
+                    continue
+                key = self._cache_key(name, url)
+                # 提前量不超过有效期的一半，避免有效期较短的接口反复刷新
+                ahead = min(self.refresh_ahead + random.uniform(0, self.jitter), ttl / 2)
+                remaining = response_cache.ttl(key)
+                if remaining is not None and remaining >= ahead:
+                    continue
+                if await response_cache.reload(url, key, ahead) is not None:
+                    self.disk_reloads += 1
+                    continue
+                if remaining is None and self._expires.pop(entry, 0) > now:
+                    self.evictions += 1
+                entries.append(entry)
+        return entries
+
+    async def hold_lease(self) -> bool:
+        """
+        多worker时获取或续期刷新的租约，剩余有效期不足一半时才访问磁盘缓存
+        """
+        if not self.shared:
+            return True
+        now = time.monotonic()
+        if self._lease_expires - now > self.lease_ttl / 2:
+            return True
+        leader = self._lease_expires > now
+        if await response_cache.disk.acquire_lease(WATCHLIST_LEASE, self._owner, self.lease_ttl):
+            if not leader:
+                logger.info(f"worker进程{os.getpid()}负责刷新关注列表")
+            self._lease_expires = now + self.lease_ttl
+            return True
+        self._lease_expires = 0.0
+        return False
+
+    async def release_lease(self):
+        if self.shared and self._lease_expires > time.monotonic():
+            await response_cache.disk.release_lease(WATCHLIST_LEASE, self._owner)
+        self._lease_expires = 0.0
+
+    async def refresh(self, name: str, url: str) -> bool:
+        with tracing.span('WatchlistRefresher.refresh', company_name=name, **{'url.path': url}):
+            response = await self.adapters[url].invoke({'keyword': self._resolved.get(name) or name}, refresh=True)
+            if response.get('statusCode') == 2 and name not in self._resolved:
+                # 与工具相同，未找到企业时匹配全称，匹配结果缓存为别名，交互查询同样使用全称
+                self._resolved[name] = await normalize_company_name(name)
+                if self._resolved[name] and self._resolved[name] != name:
+                    return await self.refresh(name, url)
+        if response.get('statusCode') != 1:
+            self.failures += 1
+            self._retry_at[(name, url)] = time.monotonic() + self.retry_delay
+            return False
+        self.refreshes += 1
+        self._retry_at.pop((name, url), None)
+        self._expires[(name, url)] = time.monotonic() + response_cache.policy(url).ttl
+        return True
+
+    async def scan(self):
+        """
+        刷新一轮需要刷新的缓存，首轮预热所有关注企业
+        """
+        start = time.monotonic()
+        try:
+            self.load()
+        except OSError as e:
+            # 文件暂时不可读时继续使用已加载的列表
+            logger.warning(f"读取关注列表{self.path}失败: {e}")
+        evictions = self.evictions
+        entries = await self.due()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(name, url):
+            async with semaphore:
+                # 首轮预热耗时可能超过租约有效期，刷新过程中续期，失去租约时停止
+                if not await self.hold_lease():
+                    return
+                try:
+                    await self.refresh(name, url)
+                except Exception as e:
+                    logger.warning(f"刷新关注企业[{name}]的缓存失败: {e}")
+                    self.failures += 1
+                    self._retry_at[(name, url)] = time.monotonic() + self.retry_delay
+
+        await asyncio.gather(*(refresh(name, url) for name, url in entries))
+        if self.evictions > evictions:
+            logger.warning(f"关注企业的{self.evictions - evictions}条缓存在过期前被淘汰，可增大shuidi_cache_max_bytes")
+        self.scans += 1
+        self.last_scan_seconds = round(time.monotonic() - start, 3)
+
+    async def run(self):
+        logger.info(f"关注列表刷新已启动: {self.path}")
+        try:
+            while True:
+                try:
+                    if await self.hold_lease():
+                        await self.scan()
+                except Exception as e:
+                    logger.error(e)
+                await asyncio.sleep(self.interval)
+        finally:
+            # 退出时释放租约，其它worker无需等待租约过期即可接替
+            await asyncio.shield(self.release_lease())
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        entries = [(name, url) for url in self.adapters for name in self.names]
+        return {
+            'enabled': self.enabled,
+            'leader': not self.shared or self._lease_expires > now,
+            'companies': len(self.names),
+            'entries': len(entries),
+            'cached': sum(1 for name, url in entries if response_cache.ttl(self._cache_key(name, url)) is not None),
+            'retrying': sum(1 for at in self._retry_at.values() if at > now),
+            'refreshes': self.refreshes,
+            'disk_reloads': self.disk_reloads,
+            'failures': self.failures,
+            'evictions': self.evictions,
+            'scans': self.scans,
+            'last_scan_seconds': self.last_scan_seconds,
+        }
+
+
+watchlist_refresher = WatchlistRefresher()
+
+
+@asynccontextmanager
+async def watchlist_lifespan():
+    """
+    配置了关注列表时，在当前事件循环中启动后台刷新任务，退出时取消
+    每个进程只应进入一次，不能放在随MCP会话进入的lifespan中
+    """
+    if not watchlist_refresher.enabled:
+        yield
+        return
+    task = asyncio.create_task(watchlist_refresher.run())
+    try:
+        yield
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,44 @@
+import os
+import socket
+import tempfile
+
+import pytest
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+STUB_PORT = _free_port()
+
+# 服务模块在导入时读取环境变量，测试经本地桩服务(bench/stub_server.py)调用接口，不写入磁盘缓存
+os.environ.setdefault('shuidi_pname', 'test')
+os.environ.setdefault('shuidi_pkey', 'test')
+os.environ.setdefault('shuidi_api_base', f'http://127.0.0.1:{STUB_PORT}')
+os.environ.setdefault('shuidi_disk_cache_enabled', 'false')
+os.environ.setdefault('shuidi_rate_limit_enabled', 'false')
+os.environ.setdefault('shuidi_export_dir', tempfile.mkdtemp(prefix='shuidi-test-'))
+
+
+@pytest.fixture(scope='session')
+def stub_server():
+    """
+    在后台线程中运行桩服务，返回其统计接口的地址
+    """
+    from stub_server import StubServer, create_stub_app
+
+    with StubServer(create_stub_app(items=3), port=STUB_PORT) as server:
+        yield server.base_url
+
+
+@pytest.fixture
+def upstream_requests(stub_server):
+    """
+    :return 返回测试开始后桩服务收到的请求数的函数
+    """
+    import httpx
+
+    httpx.post(f'{stub_server}/_stats/reset')
+    return lambda: httpx.get(f'{stub_server}/_stats').json()['requests']
@@ -0,0 +1,94 @@
+import asyncio
+import random
+from datetime import date, timedelta
+
+from establish_counter import EstablishCounter
+from http_client import http_client_lifespan
+
+
+def run(coroutine):
+    async def main():
+        async with http_client_lifespan():
+            return await coroutine
+    return asyncio.run(main())
+
+
+def test_direct_query_cached(upstream_requests):
+    """
+    没有开始日期或缺失的桶过多时按整个范围直接查询，结果同样缓存
+    """
+    counter = EstablishCounter(max_missing=2)
+    today = date(2024, 3, 2)
+    params = {'province': '浙江'}
+    for date_range in ('@2020-12-31', '2001-01-05@2020-12-31'):
+        first = run(counter.count(params, date_range, today=today))
+        again = run(counter.count(params, date_range, today=today))
+        assert first == again and first['data']['buckets'] == 0
+    assert upstream_requests() == 2 and counter.direct_queries == 2
+
+
+def test_split_date_range_edges():
+    from establish_counter import split_date_range
+
+    assert split_date_range(date(2022, 12, 30), date(2024, 2, 1)) == [
+        (date(2022, 12, 30), date(2022, 12, 30)), (date(2022, 12, 31), date(2022, 12, 31)),
+        (date(2023, 1, 1), date(2023, 12, 31)), (date(2024, 1, 1), date(2024, 1, 31)), (date(2024, 2, 1), date(2024, 2, 1))]
+    # 闰年二月
+    assert split_date_range(date(2024, 1, 31), date(2024, 3, 1)) == [
+        (date(2024, 1, 31), date(2024, 1, 31)), (date(2024, 2, 1), date(2024, 2, 29)), (date(2024, 3, 1), date(2024, 3, 1))]
+    assert split_date_range(date(2023, 1, 1), date(2023, 12, 31)) == [(date(2023, 1, 1), date(2023, 12, 31))]
+    # 差一天不足整年时拆为11个整月及12月的30天
+    assert len(split_date_range(date(2023, 1, 1), date(2023, 12, 30))) == 11 + 30
+    assert split_date_range(date(2024, 3, 2), date(2024, 3, 1)) == []
+
+
+def test_split_date_range_covers_range():
+    """
+    桶首尾相接覆盖整个区间，每个桶为单日、整月或整年
+    """
+    from establish_counter import split_date_range
+
+    rng = random.Random(0)
+    for _ in range(2000):
+        start = date(2019, 1, 1) + timedelta(days=rng.randrange(6 * 366))
+        end = start + timedelta(days=rng.randrange(800))
+        buckets = split_date_range(start, end)
+        assert buckets[0][0] == start and buckets[-1][1] == end
+        for (_, previous_end), (bucket_start, _) in zip(buckets, buckets[1:]):
+            assert bucket_start == previous_end + timedelta(days=1)
+        for bucket_start, bucket_end in buckets:
+            assert bucket_start == bucket_end or (
+                bucket_start.day == 1 and (bucket_end + timedelta(days=1)).day == 1
+                and (bucket_end.month == bucket_start.month or (bucket_start.month, bucket_end.month) == (1, 12)))
+
+
+def test_split_periods():
+    from establish_counter import split_periods
+
+    assert split_periods(date(2023, 11, 15), date(2024, 2, 10), 'month') == [
+        ('2023-11', date(2023, 11, 15), date(2023, 11, 30)), ('2023-12', date(2023, 12, 1), date(2023, 12, 31)),
+        ('2024-01', date(2024, 1, 1), date(2024, 1, 31)), ('2024-02', date(2024, 2, 1), date(2024, 2, 10))]
+    assert split_periods(date(2022, 6, 1), date(2024, 3, 3), 'year') == [
+        ('2022', date(2022, 6, 1), date(2022, 12, 31)), ('2023', date(2023, 1, 1), date(2023, 12, 31)),
+        ('2024', date(2024, 1, 1), date(2024, 3, 3))]
+    assert split_periods(date(2024, 12, 31), date(2025, 1, 1), 'month') == [
+        ('2024-12', date(2024, 12, 31), date(2024, 12, 31)), ('2025-01', date(2025, 1, 1), date(2025, 1, 1))]
+
+
+def test_range_ending_today(upstream_requests):
+    """
+    结束日期省略或晚于今天时按今天分桶，包含最近几天的桶使用较短的有效期，重复查询全部命中已缓存的桶
+    """
+    counter = EstablishCounter()
+    today = date(2024, 3, 2)
+    params = {'province': '浙江'}
+    first = run(counter.count(params, '2024-01-01@', today=today))['data']
+    assert (first['buckets'], first['cached_buckets'], first['fetched_buckets']) == (4, 0, 4)
+    later = run(counter.count(params, '2024-01-01@2030-12-31', today=today))['data']
+    assert (later['buckets'], later['cached_buckets'], later['fetched_buckets']) == (4, 4, 0)
+    assert later['num_found'] == first['num_found']
+    assert upstream_requests() == 4
+    assert counter._bucket_ttl((today, today), today) == counter.recent_ttl
+    assert counter._bucket_ttl((date(2024, 1, 1), date(2024, 1, 31)), today) == counter.ttl
+    empty = run(counter.count(params, '2024-03-03@', today=today))['data']
+    assert empty['num_found'] == 0 and empty['buckets'] == 0
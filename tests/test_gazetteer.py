@@ -0,0 +1,26 @@
+import pytest
+
+from normalizer import Area
+
+
+@pytest.mark.parametrize('province, city, district, expected', [
+    # 直辖市：只传省份、只传城市(简称或全称)时都补全省份及城市
+    ('北京', None, None, ('北京', '北京市', None)),
+    ('上海', None, '浦东新区', ('上海', '上海市', '浦东新区')),
+    (None, '上海', None, ('上海', '上海市', None)),
+    (None, '上海市', None, ('上海', '上海市', None)),
+    (None, '北京', '朝阳', ('北京', '北京市', '朝阳区')),
+    (None, '天津', None, ('天津', '天津市', None)),
+    (None, '重庆市', '渝中', ('重庆', '重庆市', '渝中区')),
+    # 直辖市的城市参数为其下的区县时作为区县
+    ('上海', '浦东', None, ('上海', '上海市', '浦东新区')),
+    # 其它省份
+    (None, '杭州', None, (None, '杭州市', None)),
+    ('湖北', '恩施', None, ('湖北', '恩施土家族苗族自治州', None)),
+    (None, '昆山', None, (None, '苏州市', '昆山市')),
+    # 表中没有的城市名称保持原样
+    ('河北', '雄安', None, ('河北', '雄安', None)),
+])
+def test_area(province, city, district, expected):
+    area = Area(province=province, city=city, district=district)
+    assert (area.province, area.city, area.district) == expected
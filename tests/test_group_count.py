@@ -0,0 +1,72 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+import mcp_server
+from gazetteer import gazetteer
+from http_client import http_client_lifespan
+from mcp_server import GROUP_MAX_GROUPS, group_conditions
+
+
+def test_group_conditions():
+    provinces = group_conditions('province', city='杭州', establish_date='2024-01-01@')
+    assert len(provinces) == len(gazetteer.mainland_provinces())
+    assert all(conditions['city'] is None and conditions['establish_date'] == '2024-01-01@'
+               for _, conditions in provinces)
+    # 直辖市按区县分组
+    districts = group_conditions('city', province='上海')
+    assert districts and all(conditions['city'] == '上海市' for _, conditions in districts)
+    assert len(group_conditions('status', company_status='正常')) == 3
+
+
+@pytest.mark.parametrize('group_by, kwargs', [('city', {}), ('district', {'province': '浙江'}), ('month', {}),
+                                              ('unknown', {})])
+def test_group_conditions_missing(group_by, kwargs):
+    with pytest.raises(ValueError):
+        group_conditions(group_by, **kwargs)
+
+
+def test_group_limit():
+    # 按月分组恰好达到上限时可以查询，多一个月时失败
+    after_limit = date(2000 + GROUP_MAX_GROUPS // 12, GROUP_MAX_GROUPS % 12 + 1, 1)
+    months = group_conditions('month', establish_date=f'2000-01-01@{after_limit - timedelta(days=1)}')
+    assert len(months) == GROUP_MAX_GROUPS
+    with pytest.raises(ValueError, match='超过上限'):
+        group_conditions('month', establish_date=f'2000-01-01@{after_limit}')
+
+
+def test_month_groups_end_today():
+    today = date.today()
+    groups = group_conditions('month', establish_date=f'{today.replace(day=1).isoformat()}@')
+    assert len(groups) == 1 and groups[0][1]['establish_date'].endswith(f'@{today.isoformat()}')
+
+
+def test_group_fan_out_concurrency(stub_server, monkeypatch):
+    """
+    分组查询并发执行，同时进行的查询数不超过shuidi_group_concurrency
+    """
+    count = mcp_server.establish_counter.count
+    in_flight = {'current': 0, 'max': 0}
+
+    async def counted(*args, **kwargs):
+        in_flight['current'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['current'])
+        try:
+            return await count(*args, **kwargs)
+        finally:
+            in_flight['current'] -= 1
+
+    monkeypatch.setattr(mcp_server.establish_counter, 'count', counted)
+
+    async def main():
+        async with http_client_lifespan():
+            return await mcp_server.group_count_companies('city', province='浙江',
+                                                          establish_date='2023-01-01@2023-12-31')
+
+    response = asyncio.run(main())
+    data = response['data']
+    assert response['statusCode'] == 1 and not data['failed']
+    assert len(data['source']) == len(group_conditions('city', province='浙江'))
+    assert data['total'] == sum(row[1] for row in data['source'])
+    assert 1 < in_flight['max'] <= mcp_server.GROUP_CONCURRENCY
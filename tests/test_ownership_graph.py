@@ -0,0 +1,77 @@
+import asyncio
+
+import api_tool
+from http_client import http_client_lifespan
+from json_codec import raw_response
+from ownership_graph import UP, OwnershipGraph
+
+
+def partners(*holders):
+    return {'statusCode': 1, 'data': {'items': [{'name': name, 'type': 1 if name.startswith('自然人') else 0,
+                                                  'stockProportion': '10%'} for name in holders]}}
+
+
+def make_graph() -> OwnershipGraph:
+    """
+    目标企业有3家企业股东及1个自然人股东，每家企业股东又有3家未加载股东的企业股东
+    """
+    graph = OwnershipGraph()
+    graph.ingest_partners('目标企业', partners('股东0', '股东1', '股东2', '自然人甲'))
+    for i in range(3):
+        graph.ingest_partners(f'股东{i}', partners(*(f'股东{i}-{j}' for j in range(3))))
+    return graph
+
+
+def test_bfs_hops():
+    graph = make_graph()
+    start, distances, failed, truncated = asyncio.run(graph.bfs('目标企业', 1, max_expand=0))
+    assert start == '目标企业' and len(distances) == 5 and not failed and not truncated
+    _, distances, _, truncated = asyncio.run(graph.bfs('目标企业', 2, max_expand=0))
+    assert len(distances) == 14 and max(distances.values()) == 2 and not truncated
+
+
+def test_bfs_max_nodes():
+    _, distances, _, truncated = asyncio.run(make_graph().bfs('目标企业', 2, max_nodes=6, max_expand=0))
+    assert len(distances) == 6 and truncated
+
+
+def test_bfs_expand_budget():
+    # 第3层需要展开9家未加载的企业，超过展开数上限时截断且不调用接口，自然人不展开
+    graph = make_graph()
+    _, distances, _, truncated = asyncio.run(graph.bfs('目标企业', 3, max_expand=0))
+    assert len(distances) == 14 and truncated and graph.fetches == 0
+
+
+def test_reingest_replaces_holders():
+    graph = make_graph()
+    graph.ingest_partners('目标企业', partners('股东0'))
+    _, distances, _, _ = asyncio.run(graph.bfs('目标企业', 1, max_expand=0))
+    assert set(distances) == {'目标企业', '股东0'}
+
+
+def test_paths_only_invest_steps():
+    graph = OwnershipGraph()
+    graph.ingest_paths({'statusCode': 1, 'data': {'ControllerData': [{'Paths': [[
+        {'StartName': '自然人甲', 'StartNodeType': 1, 'EndName': '目标企业', 'EndNodeType': 2, 'Type': 'INVEST', 'Proportion': '60%'},
+        {'StartName': '自然人乙', 'StartNodeType': 1, 'EndName': '目标企业', 'EndNodeType': 2, 'Type': 'LEGAL'},
+        {'StartName': '目标企业', 'StartNodeType': 2, 'EndName': '分支机构', 'EndNodeType': 2, 'Type': 'BRANCH'},
+    ]]}]}}, 'ControllerData')
+    assert set(graph.holders_of('目标企业')) == {'自然人甲'}
+    assert not graph.holders_of('分支机构')
+
+
+def test_passthrough_response_fetched_for_graph(upstream_requests, monkeypatch):
+    """
+    透传的原始响应写入时不解析，图查询时再加载并解析
+    """
+    monkeypatch.setattr(api_tool, 'JSON_PASSTHROUGH', True)
+    graph = OwnershipGraph()
+    raw = raw_response('{"statusCode":1,"data":{"items":[{"name":"股东0","type":0}]}}')
+    graph.ingest_partners('透传企业', raw)
+    assert raw._data is None and not graph.is_loaded('透传企业', UP)
+
+    async def main():
+        async with http_client_lifespan():
+            return await graph.bfs('透传企业', 1)
+    _, distances, failed, _ = asyncio.run(main())
+    assert not failed and '张三' in distances and graph.is_loaded('透传企业', UP) and upstream_requests() == 1
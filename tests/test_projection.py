@@ -0,0 +1,23 @@
+from projection import CONTROL_PATH_LIMIT, project
+
+CONTROLLER_URL = 'https://api.shuidi.cn/utn/pic/ActualController'
+
+
+def controller(paths: int) -> dict:
+    step = {'StartNode': 'a1', 'StartName': '某某投资有限公司', 'StartNodeType': '0', 'EndNode': 'b2',
+            'EndName': '某某科技有限公司', 'EndNodeType': '0', 'Type': 'INVEST', 'Sequence': 0, 'Proportion': '51%'}
+    return {'statusCode': 1, 'data': {'ControllerData': [{'AcName': '张三', 'Paths': [[step, step]] * paths}]}}
+
+
+def test_control_paths_limited():
+    entry = project(CONTROLLER_URL, controller(CONTROL_PATH_LIMIT + 5))['data']['ControllerData'][0]
+    assert entry['AcName'] == '张三' and len(entry['Paths']) == CONTROL_PATH_LIMIT
+    assert entry['Paths_total'] == CONTROL_PATH_LIMIT + 5
+    # 路径中嵌套的步骤列表不截断，只去掉节点id
+    assert len(entry['Paths'][0]) == 2 and 'StartNode' not in entry['Paths'][0][0]
+    assert 'Paths_total' not in project(CONTROLLER_URL, controller(1))['data']['ControllerData'][0]
+
+
+def test_control_path_extra_fields():
+    entry = project(CONTROLLER_URL, controller(1), ['data.ControllerData.Paths.StartNode'])['data']['ControllerData'][0]
+    assert entry['Paths'][0][0]['StartNode'] == 'a1' and 'EndNode' not in entry['Paths'][0][0]
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import AdaptiveConcurrency, RateLimitTimeout, TokenBucket
+
+
+def test_concurrency_slot_returned_when_timeout_races_release(monkeypatch):
+    """
+    释放方把额度交给等待者后等待者随即超时，额度应归还而不是永久占用
+    """
+    concurrency = AdaptiveConcurrency(initial=1, min_limit=1, max_limit=1)
+
+    async def wait_for(waiter, timeout):
+        # 超时触发前释放方已完成交接
+        concurrency.release(0, False, adjust=False)
+        assert waiter.done()
+        raise asyncio.TimeoutError()
+
+    async def main():
+        await concurrency.acquire(time.monotonic() + 1)
+        monkeypatch.setattr(rate_limiter.asyncio, 'wait_for', wait_for)
+        with pytest.raises(RateLimitTimeout):
+            await concurrency.acquire(time.monotonic() + 1)
+        monkeypatch.undo()
+        assert concurrency.in_flight == 0 and concurrency.waiting == 0
+        await asyncio.wait_for(concurrency.acquire(time.monotonic() + 1), 0.1)
+        assert concurrency.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_token_bucket_lock_wait_bounded_by_deadline():
+    """
+    排在其它等待者之后时，等待锁的时间同样受截止时间限制
+    """
+    async def main():
+        bucket = TokenBucket(rate=1, burst=1)
+        await bucket.acquire(time.monotonic() + 1)
+        holder = asyncio.create_task(bucket.acquire(time.monotonic() + 5))
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        with pytest.raises(RateLimitTimeout):
+            await bucket.acquire(time.monotonic() + 0.1)
+        assert time.monotonic() - start < 0.5
+        await holder
+
+    asyncio.run(main())
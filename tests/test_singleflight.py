@@ -0,0 +1,52 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_abandoned_call_cancelled():
+    """
+    投机调用的所有调用方取消后取消共享的调用，普通调用继续执行
+    """
+    async def main():
+        flight = SingleFlight()
+        started = {}
+
+        async def call(key):
+            started[key] = asyncio.current_task()
+            await asyncio.sleep(10)
+
+        callers = [asyncio.ensure_future(flight.do('spec', lambda: call('spec'), cancel_abandoned=True)),
+                   asyncio.ensure_future(flight.do('spec', lambda: call('spec'))),
+                   asyncio.ensure_future(flight.do('plain', lambda: call('plain')))]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not started['spec'].done()
+        for caller in callers[1:]:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        assert started['spec'].cancelled() and not started['plain'].done()
+        assert flight.stats() == {'in_flight': 1, 'calls': 2, 'coalesced': 1, 'abandoned': 1}
+        started['plain'].cancel()
+    asyncio.run(main())
+
+
+def test_abandoned_key_restarts():
+    """
+    取消生效前加入的调用方发起新的调用，不会收到取消
+    """
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        first = asyncio.ensure_future(flight.do('key', call, cancel_abandoned=True))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert await flight.do('key', call) == 2
+    asyncio.run(main())